@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the ``ceryx.db`` data layer against a locally spawned
+redis-server.
+
+For every table size given, a fresh redis-server is started, seeded with
+a synthetic route table and every operation is timed. Results are written
+as JSON, one object per table size, so that runs of different versions
+can be compared:
+
+    python benchmarks/bench_db.py --routes 1000 100000 1000000 -o results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import redis
+
+from ceryx import settings
+from ceryx.db import RedisRouter, RedisUsers, chunks
+
+
+ROUTELIB = os.path.join(os.path.dirname(__file__), '..', '..',
+                        'proxy', 'nginx', 'lualib', 'routelib.lua')
+
+
+class RedisServer:
+    """
+    redis-server process running on a free port, without persistence.
+    """
+
+    def __init__(self, executable):
+        self.executable = executable
+        self.port = None
+        self.process = None
+        self.directory = None
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        self.directory = tempfile.mkdtemp(prefix='ceryx-bench-')
+        self.process = subprocess.Popen(
+            [self.executable, '--port', str(self.port), '--bind', '127.0.0.1',
+             '--save', '', '--appendonly', 'no', '--dir', self.directory],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        client = redis.StrictRedis(port=self.port)
+        for _ in range(100):
+            try:
+                client.ping()
+                return self
+            except redis.ConnectionError:
+                time.sleep(0.05)
+
+        self.__exit__()
+        raise RuntimeError('redis-server did not start')
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def percentile(timings, p):
+    """Returns the p-th percentile of sorted timings"""
+    index = min(int(round(p / 100 * (len(timings) - 1))), len(timings) - 1)
+    return timings[index]
+
+
+def measure(func, args, duration, max_ops):
+    """
+    Calls ``func`` with each args tuple in turn, for at most ``duration``
+    seconds and ``max_ops`` calls, returning latency statistics in
+    milliseconds and the throughput in operations per second.
+    """
+    timings = []
+    started = time.perf_counter()
+
+    for call_args in args:
+        start = time.perf_counter()
+        func(*call_args)
+        timings.append(time.perf_counter() - start)
+
+        if len(timings) >= max_ops or time.perf_counter() - started > duration:
+            break
+
+    elapsed = time.perf_counter() - started
+    timings.sort()
+
+    return {
+        'ops': len(timings),
+        'throughput': len(timings) / elapsed if elapsed else None,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p90_ms': percentile(timings, 90) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'max_ms': timings[-1] * 1000,
+    }
+
+
+def synthetic_routes(routes, paths_per_host, depth):
+    """
+    Yields (host, path, target) entries of a synthetic route table, the
+    paths having ``depth`` segments, the last one unique per host
+    """
+    hosts = max(routes // paths_per_host, 1)
+    for index in range(routes):
+        host = f'host-{index % hosts}.example.com'
+        number = index // hosts
+        segments = [f's{(number + level) % 7}' for level in range(depth - 1)]
+        segments.append(f'p{number}')
+        path = '/' + '/'.join(segments) if index >= hosts else '/'
+        yield host, path, f'service-{index % 97}:8080'
+
+
+def random_requests(router, sample, depth):
+    """Yields random (host, request path) pairs of the seeded table"""
+    hosts = router.lookup_hosts_page(count=sample)
+    names = [f's{i}' for i in range(7)] + ['p1', 'p3', 'x', 'api']
+    while True:
+        host = random.choice(hosts)
+        segments = random.randint(0, depth + 1)
+        path = '/' + '/'.join(random.choice(names) for _ in range(segments))
+        yield host, path
+
+
+def positive_int(value):
+    """argparse type of the options which must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not a positive integer')
+    return number
+
+
+def bench(server, args):
+    router = RedisRouter('127.0.0.1', server.port, 0, 'bench')
+    users = RedisUsers('127.0.0.1', server.port, 0, 'bench')
+    results = {}
+
+    started = time.perf_counter()
+    entries = synthetic_routes(args.size, args.paths_per_host, args.depth)
+    for chunk in chunks(entries, args.chunk_size):
+        router.insert_many(chunk)
+    results['seed'] = {'routes': args.size,
+                       'seconds': time.perf_counter() - started}
+
+    hosts = router.lookup_hosts_page(count=1000)
+    requests = random_requests(router, 1000, args.depth)
+
+    def host_paths():
+        while True:
+            yield random.choice(hosts), '/'
+
+    results['lookup'] = measure(lambda h, p: router.lookup(h, p, silent=True),
+                                host_paths(), args.duration, args.max_ops)
+
+    with open(args.routelib) as f:
+        script = router.client.script_load(f.read())
+
+    def eval_route(host, path):
+        router.client.evalsha(script, 2, router._prefixed_route_key(host),
+                              router._path_index_key(host), path)
+
+    results['routelib_evalsha'] = measure(eval_route, requests,
+                                          args.duration, args.max_ops)
+
+    results['lookup_routes'] = measure(lambda: router.lookup_routes(None),
+                                       iter(tuple, 1), args.duration,
+                                       args.max_full_scans)
+
+    def new_routes():
+        for index in range(sys.maxsize):
+            yield f'bench-{index}.example.com', '/', 'service:80'
+
+    results['insert'] = measure(router.insert, new_routes(),
+                                args.duration, args.max_ops)
+
+    def renames():
+        for index in range(sys.maxsize):
+            host = hosts[index % len(hosts)]
+            yield host, host + '.renamed'
+            yield host + '.renamed', host
+
+    results['update_host'] = measure(router.update_host, renames(),
+                                     args.duration, args.max_ops)
+
+    users.insert('bench', 'password')
+
+    def logins(cached):
+        while True:
+            # without the login cache, every call checks the password with bcrypt
+            if not cached:
+                users._logins.clear()
+            yield 'bench', 'password'
+
+    results['users_login'] = measure(users.login, logins(False), args.duration,
+                                     args.max_logins)
+    results['users_login_cached'] = measure(users.login, logins(True),
+                                            args.duration, args.max_ops)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ceryx.db data layer')
+    parser.add_argument('--routes', type=int, nargs='+', default=[1000, 100000],
+                        help='route table sizes to benchmark')
+    parser.add_argument('--paths-per-host', type=int, default=4,
+                        help='average number of paths per host')
+    parser.add_argument('--depth', type=positive_int, default=2,
+                        help='number of segments of the synthetic paths')
+    parser.add_argument('--duration', type=float, default=5,
+                        help='maximum seconds spent per operation')
+    parser.add_argument('--max-ops', type=int, default=10000,
+                        help='maximum calls per operation')
+    parser.add_argument('--max-full-scans', type=int, default=5,
+                        help='maximum calls of lookup_routes')
+    parser.add_argument('--max-logins', type=int, default=20,
+                        help='maximum uncached calls of RedisUsers.login')
+    parser.add_argument('--chunk-size', type=int, default=settings.REDIS_CHUNK_SIZE,
+                        help='routes per round trip when seeding')
+    parser.add_argument('--redis-server', default=shutil.which('redis-server'),
+                        help='path of the redis-server executable')
+    parser.add_argument('--routelib', default=ROUTELIB,
+                        help='path of routelib.lua')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('-o', '--output', help='file to write the results to')
+    args = parser.parse_args()
+
+    if not args.redis_server:
+        parser.error('redis-server not found, use --redis-server')
+
+    runs = []
+    for size in args.routes:
+        random.seed(args.seed)
+        args.size = size
+        with RedisServer(args.redis_server) as server:
+            redis_version = redis.StrictRedis(port=server.port).info()['redis_version']
+            runs.append({
+                'routes': size,
+                'paths_per_host': args.paths_per_host,
+                'results': bench(server, args),
+            })
+        print(f'{size} routes done', file=sys.stderr)
+
+    output = {
+        'python': platform.python_version(),
+        'redis_py': redis.__version__,
+        'redis_server': redis_version,
+        'runs': runs,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,57 @@
 #!/usr/bin/env python
 """
 Executable for the Ceryx server.
+
+Serves the manager with gunicorn, tuned by the ``CERYX_WEB_*`` settings,
+or with the Flask development server if ``--dev`` is given. Every worker
+takes part in running the background jobs, each of them being run by a
+single worker at a time.
 """
+import argparse
+import sys
 
-if __name__ == '__main__':
-    import sys
-    sys.path.insert(0, '/opt/ceryx')
+
+def post_fork(server, worker):
+    from ceryx.manager import start_background_jobs
+    start_background_jobs()
+
+
+def run_gunicorn(settings):
+    from gunicorn.app.base import BaseApplication
+
+    class ManagerApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{settings.WEB_BIND_HOST}:{settings.WEB_BIND_PORT}')
+            self.cfg.set('workers', settings.WEB_WORKERS)
+            self.cfg.set('threads', settings.WEB_THREADS)
+            self.cfg.set('timeout', settings.WEB_TIMEOUT)
+            self.cfg.set('accesslog', '-')
+            self.cfg.set('post_fork', post_fork)
+
+        def load(self):
+            # imported by every worker, after the fork
+            from ceryx.manager import get_app
+            return get_app()
+
+    ManagerApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the Ceryx manager')
+    parser.add_argument('--dev', action='store_true',
+                        help='use the Flask development server')
+    args = parser.parse_args()
 
     from ceryx import settings
-    from ceryx.manager import app
-    app.run(host=settings.WEB_BIND_HOST, port=settings.WEB_BIND_PORT)
+
+    if args.dev:
+        from ceryx.manager import get_app, start_background_jobs
+        start_background_jobs()
+        get_app().run(host=settings.WEB_BIND_HOST, port=settings.WEB_BIND_PORT)
+    else:
+        run_gunicorn(settings)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, '/opt/ceryx')
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Executable to export and import the Ceryx route table.
+
+    ceryx-routes.py export [--format ndjson|json] [--pattern PATTERN] [FILE]
+    ceryx-routes.py import [--json] [--dry-run] [--chunk-size N] [FILE]
+    ceryx-routes.py simulate [--summary] [FILE]
+    ceryx-routes.py conflicts
+    ceryx-routes.py migrate [--batch-size N] [--max-rate N] [--restart] [--verify-only]
+    ceryx-routes.py rebuild-indexes [--force]
+
+FILE defaults to the standard output/input. ``simulate`` resolves a list of
+URLs, one per line, as the proxy would and ``conflicts`` lists the route
+paths shadowed by others. ``migrate`` rewrites the legacy string route keys
+into the hash layout, resuming an interrupted migration, and verifies the
+result. ``rebuild-indexes`` rebuilds the host and path indexes if they are
+missing or outdated, or always with ``--force``.
+"""
+import argparse
+import json
+import sys
+
+
+def export_command(router, args):
+    from ceryx import transfer
+
+    out = open(args.file, 'w') if args.file else sys.stdout
+    try:
+        for text in transfer.export_routes(router, args.pattern, args.format):
+            out.write(text)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def import_command(router, args):
+    from ceryx import transfer
+
+    source = open(args.file) if args.file else sys.stdin
+    try:
+        if args.json:
+            parsed = transfer.parse_json_routes(source)
+        else:
+            parsed = transfer.parse_routes(source)
+
+        failed = False
+        for report in transfer.import_routes(router, parsed, args.chunk_size,
+                                             args.dry_run):
+            failed = failed or bool(report['errors'])
+            print(json.dumps(report))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    return 1 if failed else 0
+
+
+def simulate_command(router, args):
+    from ceryx.simulation import Simulator
+
+    simulator = Simulator(router.build_snapshot())
+    source = open(args.file) if args.file else sys.stdin
+    try:
+        results = simulator.simulate_many(source)
+        if args.summary:
+            print(json.dumps(simulator.summary(results), indent=2))
+        else:
+            for result in results:
+                print(json.dumps(result))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return 0
+
+
+def conflicts_command(router, args):
+    from ceryx.simulation import Simulator
+
+    conflicts = Simulator(router.build_snapshot()).conflicts()
+    print(json.dumps(conflicts, indent=2))
+    return 1 if conflicts['unreachable'] else 0
+
+
+def migrate_command(router, args):
+    from ceryx.migration import LegacyMigration
+
+    migration = LegacyMigration.from_config(router)
+    if args.batch_size:
+        migration.batch_size = args.batch_size
+    if args.max_rate:
+        migration.max_rate = args.max_rate
+
+    if not args.verify_only:
+        if args.restart:
+            migration.reset()
+        for report in migration.run():
+            print(json.dumps(report))
+        print(json.dumps(migration.checkpoint()))
+
+    report = migration.verify()
+    print(json.dumps(report, indent=2))
+    return 1 if report['counts']['legacy'] or report['counts']['unindexed'] else 0
+
+
+def rebuild_indexes_command(router, args):
+    if args.force:
+        router.rebuild_indexes()
+        rebuilt = True
+    else:
+        rebuilt = router.ensure_indexes()
+    print(json.dumps({'rebuilt': rebuilt, 'hosts': router.count_hosts()}))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export and import Ceryx routes')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    export_parser = commands.add_parser('export', help='export the route table')
+    export_parser.add_argument('--format', choices=['ndjson', 'json'], default='ndjson')
+    export_parser.add_argument('--pattern', help='export only hosts matching the pattern')
+    export_parser.add_argument('file', nargs='?')
+    export_parser.set_defaults(func=export_command)
+
+    import_parser = commands.add_parser('import', help='import routes')
+    import_parser.add_argument('--json', action='store_true',
+                               help='read a JSON array instead of NDJSON')
+    import_parser.add_argument('--dry-run', action='store_true',
+                               help='report the changes without writing them')
+    import_parser.add_argument('--chunk-size', type=int,
+                               help='number of routes written per round trip')
+    import_parser.add_argument('file', nargs='?')
+    import_parser.set_defaults(func=import_command)
+
+    simulate_parser = commands.add_parser('simulate', help='resolve a list of URLs')
+    simulate_parser.add_argument('--summary', action='store_true',
+                                 help='print the hits per route instead of every result')
+    simulate_parser.add_argument('file', nargs='?')
+    simulate_parser.set_defaults(func=simulate_command)
+
+    conflicts_parser = commands.add_parser('conflicts',
+                                           help='list the shadowed route paths')
+    conflicts_parser.set_defaults(func=conflicts_command)
+
+    migrate_parser = commands.add_parser('migrate',
+                                         help='migrate the legacy string route keys')
+    migrate_parser.add_argument('--batch-size', type=int,
+                                help='number of keys scanned per batch')
+    migrate_parser.add_argument('--max-rate', type=int,
+                                help='number of keys scanned per second at most')
+    migrate_parser.add_argument('--restart', action='store_true',
+                                help='start over instead of resuming')
+    migrate_parser.add_argument('--verify-only', action='store_true',
+                                help='only verify the migration')
+    migrate_parser.set_defaults(func=migrate_command)
+
+    indexes_parser = commands.add_parser('rebuild-indexes',
+                                         help='rebuild the host and path indexes')
+    indexes_parser.add_argument('--force', action='store_true',
+                                help='rebuild the indexes even if up to date')
+    indexes_parser.set_defaults(func=rebuild_indexes_command)
+
+    args = parser.parse_args()
+
+    from ceryx.db import RedisRouter
+    router = RedisRouter.from_config()
+    return args.func(router, args)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, '/opt/ceryx')
+    sys.exit(main())
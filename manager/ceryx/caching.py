@@ -0,0 +1,105 @@
+"""
+Per route response caching.
+
+The ``cache`` policy of a route path has the proxies cache the responses
+of its upstream for ``ttl`` seconds, under a key made of request
+components, unless the request has one of the ``bypass`` headers. It is
+stored in the policies of the path as::
+
+    {"cache": {"ttl": 60, "key": ["host", "path", "args"], "bypass": ["Authorization"]}}
+
+Only ``GET`` and ``HEAD`` requests are cached, and responses the upstream
+marks as private or setting cookies are not, nginx ``proxy_cache`` leaving
+them out by default (see ``sites-enabled/ceryx.conf``).
+"""
+import collections
+import re
+
+
+KEY_COMPONENTS = ('scheme', 'host', 'path', 'args')
+KEY_HEADER = 'header:'
+KEY_COOKIE = 'cookie:'
+
+DEFAULT_KEY = ('host', 'path', 'args')
+DEFAULT_BYPASS = ('Authorization',)
+
+# the responses are kept at most a day, see proxy_cache_valid in ceryx.conf
+MAX_TTL = 86400
+
+_TOKEN = re.compile(r'^[A-Za-z0-9!#$%&\'*+.^_`|~-]+$')
+
+
+class InvalidCachePolicy(ValueError):
+    """
+    Exception raised when a cache policy is malformed.
+    """
+    pass
+
+
+def _split(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value or () if v and v.strip()]
+
+
+def _validate_component(component):
+    for prefix in (KEY_HEADER, KEY_COOKIE):
+        if component.startswith(prefix):
+            name = component[len(prefix):]
+            if not _TOKEN.match(name):
+                raise InvalidCachePolicy(f'Invalid {prefix[:-1]} name "{name}"')
+            if prefix == KEY_HEADER:
+                name = name.lower()
+            return prefix + name
+
+    if component not in KEY_COMPONENTS:
+        raise InvalidCachePolicy(
+            f'Invalid key component "{component}", expected one of '
+            f'{", ".join(KEY_COMPONENTS)}, {KEY_HEADER}<name> or {KEY_COOKIE}<name>')
+    return component
+
+
+class CachePolicy(collections.namedtuple('CachePolicy', ['ttl', 'key', 'bypass'])):
+    """
+    Cache policy of a route, ``ttl`` being in seconds, ``key`` the request
+    components of the cache key and ``bypass`` the request headers making
+    requests skip the cache.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def create(ttl, key=None, bypass=None):
+        """
+        Returns a validated ``CachePolicy``. ``key`` and ``bypass`` are lists
+        or comma separated strings, ``key`` defaulting to ``DEFAULT_KEY``.
+        """
+        try:
+            ttl = int(ttl)
+        except (TypeError, ValueError):
+            raise InvalidCachePolicy('TTL must be a number of seconds')
+        if not 0 < ttl <= MAX_TTL:
+            raise InvalidCachePolicy(f'TTL must be between 1 and {MAX_TTL} seconds')
+
+        key = tuple(_validate_component(c) for c in _split(key)) or DEFAULT_KEY
+
+        bypass = _split(bypass)
+        for header in bypass:
+            if not _TOKEN.match(header):
+                raise InvalidCachePolicy(f'Invalid header name "{header}"')
+
+        return CachePolicy(ttl, key, tuple(bypass))
+
+    @staticmethod
+    def from_policy(policy):
+        """Returns the ``CachePolicy`` of a route policy, or None"""
+        config = (policy or {}).get('cache')
+        if not config:
+            return None
+        if not isinstance(config, dict):
+            raise InvalidCachePolicy('Cache policy must be an object')
+        return CachePolicy.create(config.get('ttl'), config.get('key'),
+                                  config.get('bypass'))
+
+    def to_policy(self):
+        """Returns the ``cache`` entry of a route policy"""
+        return {'ttl': self.ttl, 'key': list(self.key), 'bypass': list(self.bypass)}
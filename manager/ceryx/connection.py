@@ -0,0 +1,272 @@
+"""
+Connections to Redis, shared by every data class of the process.
+
+Three topologies are supported, selected with ``settings.REDIS_MODE``:
+
+* ``single``: a single server, with optional read replicas.
+* ``sentinel``: servers monitored by Redis Sentinel.
+* ``cluster``: a Redis Cluster. Every key of Ceryx shares the hash tag of
+  the prefix, so they all live in a single slot and transactions and
+  scripts keep working; the cluster provides failover and replica reads,
+  but does not shard the routes, since the route scripts update per host
+  and global keys together.
+
+Servers are discovered whenever a connection is opened, and connections
+are dropped when their server is demoted or the slot moved, so that the
+command is retried against the new server.
+"""
+import os
+import random
+import threading
+import weakref
+
+import redis
+import redis.client
+import redis.sentinel
+from redis._compat import nativestr
+
+from ceryx import metrics, settings
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """
+    Redis client timing every round trip and counting it for the current
+    web request, see ``ceryx.metrics``.
+    """
+
+    def execute_command(self, *args, **options):
+        with metrics.redis_roundtrip(args[0]):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
+
+
+class InstrumentedPipeline(redis.client.StrictPipeline):
+    """
+    Pipeline counting each execution as a single round trip.
+    """
+
+    def immediate_execute_command(self, *args, **options):
+        with metrics.redis_roundtrip(args[0]):
+            return super().immediate_execute_command(*args, **options)
+
+    def execute(self, raise_on_error=True):
+        if not self.command_stack:
+            return super().execute(raise_on_error)
+
+        command = 'MULTI' if self.transaction else 'PIPELINE'
+        with metrics.redis_roundtrip(command):
+            return super().execute(raise_on_error)
+
+
+def parse_nodes(nodes):
+    """
+    Parses a comma separated list of ``host:port`` nodes.
+    """
+    addresses = []
+    for node in nodes.split(','):
+        node = node.strip()
+        if node:
+            host, _, port = node.rpartition(':')
+            addresses.append((host, int(port)))
+    return addresses
+
+
+class Topology:
+    """
+    Servers of a Redis deployment. Both methods return the addresses to
+    try, in order of preference.
+    """
+    cluster = False
+
+    def primaries(self):
+        raise NotImplementedError()
+
+    def replicas(self):
+        raise NotImplementedError()
+
+
+class SingleTopology(Topology):
+    """
+    A single server, along with its replicas, if any.
+    """
+
+    def __init__(self, address, replicas=()):
+        self.address = address
+        self.replica_addresses = list(replicas)
+
+    def primaries(self):
+        return [self.address]
+
+    def replicas(self):
+        replicas = random.sample(self.replica_addresses, len(self.replica_addresses))
+        return replicas + [self.address]
+
+
+class SentinelTopology(Topology):
+    """
+    Servers monitored by Redis Sentinel under the given service name.
+    """
+
+    def __init__(self, sentinels, service):
+        self.sentinel = redis.sentinel.Sentinel(sentinels, socket_timeout=1)
+        self.service = service
+
+    def primaries(self):
+        return [self.sentinel.discover_master(self.service)]
+
+    def replicas(self):
+        replicas = self.sentinel.discover_slaves(self.service)
+        random.shuffle(replicas)
+        try:
+            return replicas + self.primaries()
+        except redis.sentinel.MasterNotFoundError:
+            return replicas
+
+
+class ClusterTopology(Topology):
+    """
+    Nodes of a Redis Cluster serving the slot of the given hash tag,
+    discovered through any of the given nodes.
+    """
+    cluster = True
+
+    def __init__(self, nodes, tag):
+        self.nodes = list(nodes)
+        self.tag = tag
+
+    def _slot_nodes(self):
+        """
+        Returns the master and the replicas serving the slot of the tag.
+        """
+        error = None
+        for host, port in random.sample(self.nodes, len(self.nodes)):
+            client = redis.StrictRedis(host=host, port=port, socket_timeout=1)
+            try:
+                slot = client.execute_command('CLUSTER KEYSLOT', self.tag)
+                for start, end, *nodes in client.execute_command('CLUSTER SLOTS'):
+                    if start <= slot <= end:
+                        # an empty address stands for the queried node
+                        return [(nativestr(n[0]) or host, int(n[1])) for n in nodes]
+            except redis.ConnectionError as e:
+                error = e
+            finally:
+                client.connection_pool.disconnect()
+        raise error or redis.ConnectionError('No cluster node serves the slot')
+
+    def primaries(self):
+        return self._slot_nodes()[:1]
+
+    def replicas(self):
+        master, *replicas = self._slot_nodes()
+        random.shuffle(replicas)
+        return replicas + [master]
+
+
+class TopologyConnection(redis.Connection):
+    """
+    Connection to the server chosen by the topology of its pool.
+    """
+
+    def __init__(self, **kwargs):
+        self.connection_pool = kwargs.pop('connection_pool')
+        super().__init__(**kwargs)
+
+    def connect(self):
+        if self._sock:
+            return
+
+        error = None
+        for self.host, self.port in self.connection_pool.addresses():
+            try:
+                return super().connect()
+            except redis.ConnectionError as e:
+                error = e
+        raise error or redis.ConnectionError('No Redis server available')
+
+    def on_connect(self):
+        super().on_connect()
+        pool = self.connection_pool
+        if pool.replica and pool.topology.cluster:
+            # allows reads from the replicas of a cluster
+            self.send_command('READONLY')
+            if nativestr(self.read_response()) != 'OK':
+                raise redis.ConnectionError('READONLY failed')
+
+    def read_response(self):
+        try:
+            return super().read_response()
+        except redis.exceptions.ReadOnlyError:
+            if self.connection_pool.replica:
+                raise
+            # the master was demoted, a new one is found on reconnection
+            self.disconnect()
+            raise redis.ConnectionError('The Redis master was demoted')
+        except redis.ResponseError as e:
+            message = str(e)
+            # scripts fail at their first write on a demoted master, so
+            # nothing was written and they can be retried as well
+            demoted = '-READONLY ' in message and not self.connection_pool.replica
+            if not demoted and not message.startswith(('MOVED ', 'CLUSTERDOWN ')):
+                raise
+            self.disconnect()
+            raise redis.ConnectionError(message)
+
+
+class TopologyConnectionPool(redis.ConnectionPool):
+    """
+    Connection pool to the primary server or, if ``replica`` is set, to
+    the replicas of a topology.
+    """
+
+    def __init__(self, topology, replica=False, **kwargs):
+        kwargs.setdefault('connection_class', TopologyConnection)
+        self.topology = topology
+        self.replica = replica
+        super().__init__(**kwargs)
+        self.connection_kwargs['connection_pool'] = weakref.proxy(self)
+
+    def addresses(self):
+        if self.replica:
+            return self.topology.replicas()
+        return self.topology.primaries()
+
+
+def topology_from_config():
+    """Returns the ``Topology`` configured in settings"""
+    if settings.REDIS_MODE == 'sentinel':
+        return SentinelTopology(parse_nodes(settings.REDIS_SENTINELS),
+                                settings.REDIS_SENTINEL_SERVICE)
+    if settings.REDIS_MODE == 'cluster':
+        return ClusterTopology(parse_nodes(settings.REDIS_CLUSTER_NODES),
+                               settings.REDIS_PREFIX)
+    if settings.REDIS_MODE == 'single':
+        return SingleTopology((settings.REDIS_HOST, int(settings.REDIS_PORT)),
+                              parse_nodes(settings.REDIS_REPLICAS))
+    raise ValueError(f'Unknown Redis mode "{settings.REDIS_MODE}"')
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(replica=False):
+    """
+    Returns the client of the configured topology shared by the process,
+    or, if ``replica`` is set, the one for read-only commands, which reads
+    from the replicas if ``settings.REDIS_READ_FROM_REPLICAS`` is set.
+    Clients are created again in forked processes.
+    """
+    with _clients_lock:
+        if _clients.get('pid') != os.getpid():
+            _clients['pid'] = os.getpid()
+            topology = topology_from_config()
+            pool = TopologyConnectionPool(topology, db=0, decode_responses=True)
+            _clients['primary'] = _clients['replica'] = InstrumentedRedis(connection_pool=pool)
+            if settings.REDIS_READ_FROM_REPLICAS:
+                pool = TopologyConnectionPool(topology, replica=True, db=0,
+                                              decode_responses=True)
+                _clients['replica'] = InstrumentedRedis(connection_pool=pool)
+        return _clients['replica' if replica else 'primary']
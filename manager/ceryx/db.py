@@ -1,15 +1,117 @@
 """
 Simple Redis client, implemented the data logic of Ceryx.
 """
+import collections
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import redis
 import bcrypt
 
-from ceryx import settings
+from ceryx import metrics, routing, settings
+from ceryx.connection import InstrumentedRedis, get_client
+
 
+logger = logging.getLogger(__name__)
 
 REDIS_DEFAULT_DB = 0
 
+# version of the index layout, bumped whenever the indexes need a rebuild
+INDEXES_VERSION = 2
+
+
+def chunks(iterable, size):
+    """
+    Splits an iterable in lists of at most ``size`` items.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _lex_prefix_range(prefix):
+    """
+    Returns the ZRANGEBYLEX bounds matching every member starting with the
+    given prefix.
+    """
+    if not prefix:
+        return '-', '+'
+    return f'[{prefix}', b'[' + prefix.encode() + b'\xff'
+
+
+def _lex_count(count):
+    """
+    Returns the ZRANGEBYLEX LIMIT count, where a negative count means all
+    the remaining members.
+    """
+    return -1 if count is None else count
+
+
+class ScriptRegistry:
+    """
+    Lua scripts of the ``ceryx/scripts`` directory, loaded once with
+    SCRIPT LOAD and run with EVALSHA. A script is loaded again whenever
+    Redis lost it (NOSCRIPT), for example after a restart. ``common.lua``
+    is prepended to every script.
+
+    Scripts report conflicts with error replies, which are raised as the
+    exception mapped to them in ``errors``.
+    """
+    DIRECTORY = os.path.join(os.path.dirname(__file__), 'scripts')
+    COMMON = 'common'
+
+    def __init__(self, client, errors=None, directory=DIRECTORY):
+        self.client = client
+        self.errors = errors or {}
+        self.directory = directory
+        self._sources = {}
+        self._shas = {}
+
+    def _read(self, name):
+        with open(os.path.join(self.directory, f'{name}.lua')) as f:
+            return f.read()
+
+    def source(self, name):
+        """Returns the source of a script, including the common chunk"""
+        source = self._sources.get(name)
+        if source is None:
+            source = self._read(self.COMMON) + '\n' + self._read(name)
+            self._sources[name] = source
+        return source
+
+    def load(self, name):
+        """Loads a script in Redis, returning its SHA1"""
+        sha = self._shas[name] = self.client.script_load(self.source(name))
+        return sha
+
+    def run(self, name, keys=(), args=()):
+        """Runs a script, loading it first if needed"""
+        sha = self._shas.get(name) or self.load(name)
+        try:
+            try:
+                return self.client.evalsha(sha, len(keys), *keys, *args)
+            except redis.exceptions.NoScriptError:
+                return self.client.evalsha(self.load(name), len(keys), *keys, *args)
+        except redis.exceptions.ResponseError as e:
+            error = self.errors.get(str(e))
+            if error is None:
+                raise
+            raise error(str(e)) from None
+
 
+@metrics.instrumented('redis_router')
 class RedisRouter:
     """
     Router using a redis backend, in order to route incoming requests.
@@ -40,29 +142,279 @@ class RedisRouter:
         """
         pass
 
+    class DiscoveryChanged(Exception):
+        """
+        Exception raised when the routes of discovered services keep being
+        changed while applying them.
+        """
+        pass
+
+    # attempts at applying discovered routes changed concurrently
+    DISCOVERY_RETRIES = 5
+
     @staticmethod
     def from_config(path=None):
         """
         Returns a RedisRouter, using the default configuration from Ceryx
         settings.
         """
-        return RedisRouter(settings.REDIS_HOST, settings.REDIS_PORT,
-                           REDIS_DEFAULT_DB, settings.REDIS_PREFIX)
+        return RedisRouter(prefix=settings.REDIS_PREFIX, client=get_client(),
+                           read_client=get_client(replica=True))
 
-    def __init__(self, host, port, db, prefix):
-        self.client = redis.StrictRedis(host=host, port=port, db=db, decode_responses=True)
+    def __init__(self, host=None, port=None, db=REDIS_DEFAULT_DB, prefix=None,
+                 client=None, read_client=None):
+        """
+        Either connects to the given server or uses the given clients,
+        ``read_client`` serving the read-only lookups, which may be stale if
+        it reads from replicas.
+        """
+        if client is None:
+            client = InstrumentedRedis(host=host, port=port, db=db, decode_responses=True)
+        self.client = client
+        self.read_client = read_client or client
         self.prefix = prefix
+        self.scripts = ScriptRegistry(self.client, {
+            'PATH_EXISTS': RedisRouter.PathExists,
+            'PATH_NOT_FOUND': RedisRouter.LookupNotFound,
+            'HOST_EXISTS': RedisRouter.HostExists,
+            'HOST_NOT_FOUND': RedisRouter.LookupNotFound,
+            'DISCOVERY_CHANGED': RedisRouter.DiscoveryChanged,
+        })
+
+    def primary(self):
+        """
+        Returns a router reading from the primary server, for reads which
+        must not be stale.
+        """
+        if self.read_client is self.client:
+            return self
+        return RedisRouter(prefix=self.prefix, client=self.client)
+
+    def _prefixed_key(self, key):
+        """
+        Returns the prefixed key, if prefix has been defined.
+        """
+        if self.prefix is not None:
+            return f'{self.prefix}:{key}'
+        return key
 
     def _prefixed_route_key(self, source):
         """
         Returns the prefixed key, if prefix has been defined, for the given
         route.
         """
-        prefixed_key = f'routes:{source}'
-        if self.prefix is not None:
-            prefixed_key = f'{self.prefix}:{prefixed_key}'
-        
-        return prefixed_key
+        return self._prefixed_key(f'routes:{source}')
+
+    def _host_index_key(self):
+        """
+        Returns the key of the sorted set indexing every host.
+        """
+        return self._prefixed_key('hosts')
+
+    def _path_index_key(self, host):
+        """
+        Returns the key of the hash indexing the paths of the given host by
+        their normalized path, used by the proxy to find the matching path
+        of a request without checking every path of the host.
+        """
+        return self._prefixed_key(f'paths:{host}')
+
+    def _policies_key(self, host):
+        """
+        Returns the key of the hash of the policies of the paths of a host,
+        path -> JSON policy.
+        """
+        return self._prefixed_key(f'policies:{host}')
+
+    def _deadlines_key(self):
+        """
+        Returns the key of the sorted set of the deadlines of the expiring
+        paths, "<host> <path>" -> unix time.
+        """
+        return self._prefixed_key('deadlines')
+
+    def _expires_key(self, host):
+        """
+        Returns the key of the hash of the deadlines of the expiring paths
+        of a host, path -> unix time.
+        """
+        return self._prefixed_key(f'expires:{host}')
+
+    def _generations_key(self):
+        """
+        Returns the key of the hash holding the generation of every host,
+        bumped on every change of the host routes.
+        """
+        return self._prefixed_key('generations')
+
+    def _generation_key(self):
+        """
+        Returns the key of the generation of the whole route table.
+        """
+        return self._prefixed_key('generation')
+
+    def _invalidations_channel(self):
+        """
+        Returns the pub/sub channel where changed hosts are published.
+        """
+        return self._prefixed_key('invalidations')
+
+    def _queue_touch(self, pipe, *hosts):
+        """
+        Queues the commands bumping the generation of the given hosts and of
+        the route table and publishing the hosts as invalidated. Must be
+        queued in the same transaction as the change itself, which adds the
+        hosts. New hosts start at the generation of the route table, as in
+        ``scripts/common.lua``.
+        """
+        generation = self.client.get(self._generation_key()) or 0
+        for host in hosts:
+            pipe.hsetnx(self._generations_key(), host, generation)
+            pipe.hincrby(self._generations_key(), host, 1)
+            pipe.publish(self._invalidations_channel(), host)
+        pipe.incr(self._generation_key())
+
+    def generation(self, host=None):
+        """
+        Returns the generation of the given host or, if no host is given, of
+        the whole route table.
+        """
+        if host is None:
+            generation = self.read_client.get(self._generation_key())
+        else:
+            generation = self.read_client.hget(self._generations_key(), host)
+        return int(generation or 0)
+
+    def host_generations(self):
+        """
+        Returns the generations of every host changed at least once, as a
+        ``{host: generation}`` dict. Deleted hosts have no generation.
+        """
+        return {host: int(generation) for host, generation in
+                self.read_client.hgetall(self._generations_key()).items()}
+
+    def adopt_generations(self, hosts):
+        """
+        Gives the hosts which have routes but no generation, never changed
+        since the generations exist, the generation of the route table.
+        Returns the ``{host: generation}`` of the hosts given one.
+        """
+        adopted = {}
+        for chunk in chunks(hosts, settings.REDIS_CHUNK_SIZE):
+            keys = self._script_keys() + [self._prefixed_route_key(host) for host in chunk]
+            generation, hosts = self.scripts.run('adopt_generations', keys,
+                                                 [self._invalidations_channel(), *chunk])
+            adopted.update((host, generation) for host in hosts)
+        return adopted
+
+    def subscribe(self):
+        """
+        Returns a ``RouteSubscriber`` listening to the invalidated hosts.
+        """
+        return RouteSubscriber(self.client, self._invalidations_channel())
+
+    def _unhealthy_key(self):
+        """
+        Returns the key of the set of the targets found unhealthy by the
+        health checker.
+        """
+        return self._prefixed_key('unhealthy')
+
+    def _health_channel(self):
+        """
+        Returns the pub/sub channel where health changes are published, as
+        "1 <target>" for healthy and "0 <target>" for unhealthy targets.
+        """
+        return self._prefixed_key('health')
+
+    def lookup_unhealthy(self):
+        """
+        Returns the set of the unhealthy targets.
+        """
+        return self.read_client.smembers(self._unhealthy_key())
+
+    def set_health(self, changes):
+        """
+        Stores and publishes the health of several targets, given as a
+        ``{target: healthy}`` dict, in a single transaction.
+        """
+        if not changes:
+            return
+
+        key = self._unhealthy_key()
+        pipe = self.client.pipeline()
+        for target, healthy in changes.items():
+            if healthy:
+                pipe.srem(key, target)
+            else:
+                pipe.sadd(key, target)
+            pipe.publish(self._health_channel(), f'{int(healthy)} {target}')
+        pipe.execute()
+
+    def _snapshot_key(self, name=None):
+        """
+        Returns the key of the routing snapshot, or of one of its companion
+        keys if a name is given.
+        """
+        key = 'snapshot' if name is None else f'snapshot:{name}'
+        return self._prefixed_key(key)
+
+    def build_snapshot(self, retries=3):
+        """
+        Builds a ``RoutingSnapshot`` of the whole route table, versioned with
+        the route table generation. The table is read in chunks, so it is
+        read again, up to ``retries`` times, if it changed meanwhile. The
+        version is the generation read before the table, so a snapshot of a
+        table that kept changing is never newer than its version.
+        """
+        router = self.primary()
+        for attempt in range(retries + 1):
+            version = router.generation()
+            routes = {r['host']: r['paths'] for r in router.iter_routes()}
+            policies = {}
+            for hosts in chunks(routes, settings.REDIS_CHUNK_SIZE):
+                for host, host_policies in zip(hosts, router.lookup_policies_many(hosts)):
+                    if host_policies:
+                        policies[host] = host_policies
+            if router.generation() == version:
+                break
+        return RoutingSnapshot(version, routes, policies)
+
+    def publish_snapshot(self, snapshot):
+        """
+        Stores the snapshot and notifies its version to the proxies, unless
+        a snapshot at least as recent is already stored. Returns whether the
+        snapshot was published.
+        """
+        version_key = self._snapshot_key('version')
+
+        def publish(pipe):
+            current = pipe.get(version_key)
+            if current is not None and int(current) >= snapshot.version:
+                return False
+
+            pipe.multi()
+            pipe.set(self._snapshot_key(), snapshot.to_json())
+            pipe.set(version_key, snapshot.version)
+            pipe.publish(self._prefixed_key('snapshots'), snapshot.version)
+            return True
+
+        return self.client.transaction(publish, version_key,
+                                       value_from_callable=True)
+
+    def snapshot_version(self):
+        """
+        Returns the version of the stored snapshot, or None if there is none.
+        """
+        version = self.client.get(self._snapshot_key('version'))
+        return None if version is None else int(version)
+
+    def lookup_snapshot(self):
+        """
+        Fetches the stored ``RoutingSnapshot``, or None if there is none.
+        """
+        data = self.client.get(self._snapshot_key())
+        return None if data is None else RoutingSnapshot.from_json(data)
 
     def lookup(self, host, path=None, silent=False):
         """
@@ -72,7 +424,7 @@ class RedisRouter:
         lookup_host = self._prefixed_route_key(host)
         path = path or '/'
 
-        target_host = self.client.hget(lookup_host, path)
+        target_host = self.read_client.hget(lookup_host, path)
         if target_host is None and not silent:
             raise RedisRouter.LookupNotFound(
                 'Given host does not match with any route'
@@ -80,90 +432,803 @@ class RedisRouter:
         else:
             return target_host
     
+    def resolve(self, host, path):
+        """
+        Resolves a request as the proxy does, skipping the paths whose
+        target is unhealthy and falling back to the wildcard routes. Returns
+        a ``(target, unrooted path)`` tuple or None.
+        """
+        pipe = self.read_client.pipeline(transaction=False)
+        pipe.hgetall(self._prefixed_route_key(host))
+        pipe.hgetall(self._prefixed_route_key(RoutingSnapshot.WILDCARD_HOST))
+        pipe.smembers(self._unhealthy_key())
+        paths, wildcard, unhealthy = pipe.execute()
+
+        result = routing.resolve(paths, path, unhealthy) if paths else None
+        if result is None and host != RoutingSnapshot.WILDCARD_HOST and wildcard:
+            result = routing.resolve(wildcard, path, unhealthy)
+        return result
+
     def lookup_paths(self, host):
         """
         Fetches the (path, target) pairs for the given host, returning
         a dict of the key -> value pairs
         """
         lookup_host = self._prefixed_route_key(host)
-        return self.client.hgetall(lookup_host)
+        return self.read_client.hgetall(lookup_host)
+
+    def iter_hosts(self, pattern=None, count=None):
+        """
+        Yields hosts that match the given pattern, walking the keyspace with
+        a SCAN cursor so that Redis is never blocked. ``count`` is the SCAN
+        batch size hint and defaults to ``settings.REDIS_SCAN_COUNT``. A host
+        may be yielded more than once if the keyspace is rehashed while
+        scanning.
+        """
+        pattern = pattern or '*'
+        count = count or settings.REDIS_SCAN_COUNT
+        lookup_pattern = self._prefixed_route_key(pattern)
+        key_prefix = len(lookup_pattern) - len(pattern)
+        for key in self.read_client.scan_iter(match=lookup_pattern, count=count):
+            yield key[key_prefix:]
 
     def lookup_hosts(self, pattern):
         """
         Fetches hosts that match the given pattern. If no pattern is given,
         all hosts are returned.
         """
-        if not pattern:
-            pattern = '*'
-        lookup_pattern = self._prefixed_route_key(pattern)
-        keys = self.client.keys(lookup_pattern)
-        return [key[len(lookup_pattern) - len(pattern):] for key in keys]
+        return list(self.iter_hosts(pattern))
+
+    def lookup_paths_many(self, hosts):
+        """
+        Fetches the (path, target) pairs of several hosts in a single
+        pipelined round trip, returning a list of dicts in the same order as
+        the given hosts. Legacy string route keys, which have not been
+        migrated yet (see ``ceryx/migration.py``), have no paths.
+        """
+        pipe = self.read_client.pipeline(transaction=False)
+        for host in hosts:
+            pipe.hgetall(self._prefixed_route_key(host))
+        return [{} if isinstance(paths, redis.ResponseError) else paths
+                for paths in pipe.execute(raise_on_error=False)]
+
+    def iter_routes(self, pattern=None, chunk_size=None):
+        """
+        Yields routes with host that matches the given pattern. Hosts are
+        fetched in chunks of ``chunk_size`` (defaults to
+        ``settings.REDIS_CHUNK_SIZE``), each chunk costing a single round
+        trip, so memory stays bounded regardless of the table size.
+        """
+        chunk_size = chunk_size or settings.REDIS_CHUNK_SIZE
+        for hosts in chunks(self.iter_hosts(pattern), chunk_size):
+            for host, paths in zip(hosts, self.lookup_paths_many(hosts)):
+                # the host may have been deleted after it was scanned
+                if paths:
+                    yield {'host': host, 'paths': paths}
 
-    def lookup_routes(self, pattern):
+    def lookup_routes(self, pattern, chunk_size=None):
         """
         Fetches routes with host that matches the given pattern. If no pattern
         is given, all routes are returned.
         """
-        hosts = self.lookup_hosts(pattern)
-        routes = []
+        return list(self.iter_routes(pattern, chunk_size))
+
+    def lookup_hosts_page(self, prefix=None, offset=0, count=None):
+        """
+        Fetches hosts starting with the given prefix from the host index, in
+        lexicographical order, skipping the first ``offset`` hosts and
+        returning at most ``count`` of them.
+        """
+        lex_min, lex_max = _lex_prefix_range(prefix)
+        return self.read_client.zrangebylex(self._host_index_key(), lex_min, lex_max,
+                                       start=offset, num=_lex_count(count))
+
+    def lookup_hosts_range(self, start, end, offset=0, count=None):
+        """
+        Fetches hosts between ``start`` and ``end`` (inclusive) from the host
+        index, in lexicographical order.
+        """
+        return self.read_client.zrangebylex(self._host_index_key(),
+                                       f'[{start}', f'[{end}',
+                                       start=offset, num=_lex_count(count))
+
+    def count_hosts(self, prefix=None):
+        """
+        Counts the hosts starting with the given prefix in the host index.
+        """
+        lex_min, lex_max = _lex_prefix_range(prefix)
+        return self.read_client.zlexcount(self._host_index_key(), lex_min, lex_max)
+
+    def rebuild_indexes(self, on_chunk=None):
+        """
+        Rebuilds the host index and the path index of every host from the
+        route keys, which is needed for databases written before the indexes
+        existed. ``on_chunk`` is called after every chunk of hosts, for
+        example to renew a lease.
+
+        The indexes are built into temporary keys renamed into place, so
+        that the live indexes stay complete while rebuilding. The hosts
+        added to the live host index meanwhile are kept.
+        """
+        primary = self.primary()
+        index_key = self._host_index_key()
+        rebuilt_key = self._prefixed_key('hosts:rebuild')
+        self.client.delete(rebuilt_key)
+
+        for routes in chunks(primary.iter_routes(), settings.REDIS_CHUNK_SIZE):
+            pipe = self.client.pipeline(transaction=False)
+            for route in routes:
+                host = route['host']
+                path_index_key = self._path_index_key(host)
+                rebuilt_paths_key = f'{path_index_key}:rebuild'
+                pipe.zadd(rebuilt_key, 0, host)
+                pipe.delete(rebuilt_paths_key)
+                for path in route['paths']:
+                    self._queue_index_path(pipe, host, path, rebuilt_paths_key)
+                pipe.rename(rebuilt_paths_key, path_index_key)
+            pipe.execute()
+            if on_chunk is not None:
+                on_chunk()
+
+        self._swap_host_index(rebuilt_key, index_key)
+        self.client.set(self._prefixed_key('indexes'), INDEXES_VERSION)
+
+    def ensure_indexes(self, on_chunk=None):
+        """
+        Rebuilds the indexes if they are missing or outdated, see
+        ``rebuild_indexes``. Returns whether they were rebuilt.
+        """
+        version = self.client.get(self._prefixed_key('indexes'))
+        if version is None or int(version) < INDEXES_VERSION:
+            self.rebuild_indexes(on_chunk)
+            return True
+        return False
+
+    def _missing_hosts(self, rebuilt_key, index_key):
+        """
+        Returns the hosts of the live host index missing from the rebuilt
+        one which still have routes, added while rebuilding.
+        """
+        missing = []
+        for hosts in chunks(self.client.zscan_iter(index_key), settings.REDIS_CHUNK_SIZE):
+            hosts = [host for host, _ in hosts]
+            pipe = self.client.pipeline(transaction=False)
+            for host in hosts:
+                pipe.zscore(rebuilt_key, host)
+                pipe.exists(self._prefixed_route_key(host))
+            results = pipe.execute()
+            missing += [host for host, score, exists
+                        in zip(hosts, results[::2], results[1::2])
+                        if score is None and exists]
+        return missing
+
+    def _swap_host_index(self, rebuilt_key, index_key):
+        """
+        Renames the rebuilt host index into place, along with the hosts
+        added to the live index meanwhile, retrying if the live index
+        changed again.
+        """
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(index_key, rebuilt_key)
+                    missing = self._missing_hosts(rebuilt_key, index_key)
+                    rebuilt = pipe.exists(rebuilt_key)
+                    pipe.multi()
+                    for hosts in chunks(missing, settings.REDIS_CHUNK_SIZE):
+                        pipe.zadd(rebuilt_key, *[arg for host in hosts for arg in (0, host)])
+                    if rebuilt or missing:
+                        pipe.rename(rebuilt_key, index_key)
+                    else:
+                        pipe.delete(index_key)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue
+
+    def _queue_index_path(self, pipe, host, path, index_key=None):
+        """
+        Queues the commands adding the path to the path index of the host,
+        or to ``index_key``. Both "/a" and "/a/" normalize to "/a/", the
+        latter being preferred.
+        """
+        index_key = index_key or self._path_index_key(host)
+        if path.endswith('/'):
+            pipe.hset(index_key, routing.normalize(path), path)
+        else:
+            pipe.hsetnx(index_key, routing.normalize(path), path)
+
+    def _queue_clear_deadline(self, pipe, host, path):
+        """
+        Queues the commands removing the deadline of the path, if any.
+        """
+        pipe.hdel(self._expires_key(host), path)
+        pipe.zrem(self._deadlines_key(), f'{host} {path}')
+
+    def _script_keys(self, *hosts):
+        """
+        Returns the keys given to the route mutation scripts, see
+        ``scripts/common.lua``, followed by the route key, path index key,
+        policies key and deadlines key of every host.
+        """
+        keys = [self._host_index_key(), self._generations_key(),
+                self._generation_key(), self._deadlines_key()]
         for host in hosts:
-            routes.append(
-                {
-                    'host': host,
-                    'paths': self.lookup_paths(host)
-                }
-            )
-        return routes
+            keys += [self._prefixed_route_key(host), self._path_index_key(host),
+                     self._policies_key(host), self._expires_key(host)]
+        return keys
 
-    def insert(self, host, path, target):
+    @staticmethod
+    def _policy_arg(policy):
         """
-        Inserts a new host/path -> target entry in to the database.
+        Returns the policy argument of the route mutation scripts, None
+        keeping the current policy and an empty dict removing it.
         """
-        host_key = self._prefixed_route_key(host)
-        self.client.hset(host_key, path, target)
-    
-    def update_path(self, host, old_path, new_path, target):
+        if policy is None:
+            return ''
+        return json.dumps(policy, separators=(',', ':'), sort_keys=True)
+
+    def insert(self, host, path, target, overwrite=True, policy=None,
+               expires_in=None):
         """
-        Updates a path -> target mapping
+        Inserts a new host/path -> target entry in to the database. Raises
+        ``PathExists`` if the path exists, unless ``overwrite`` is set.
+        ``policy`` is the policy of the path, a replaced path keeping its
+        policy if None. The path is deleted by ``expire_due`` after
+        ``expires_in`` seconds, or never if None. Returns whether the path
+        was added.
         """
-        host_key = self._prefixed_route_key(host)
-        
-        if self.client.hexists(host, new_path) > 0:
-            raise RedisRouter.PathExists()
-        
+        deadline = 0 if expires_in is None else time.time() + expires_in
+        added = self.scripts.run('insert', self._script_keys(host),
+                                 [self._invalidations_channel(), host, path,
+                                  target, int(overwrite), self._policy_arg(policy),
+                                  repr(deadline)])
+        return bool(added)
+
+    def lookup_deadlines(self, host):
+        """
+        Fetches the deadlines of the expiring paths of a host, as a
+        path -> unix time dict.
+        """
+        deadlines = self.read_client.hgetall(self._expires_key(host))
+        return {path: float(deadline) for path, deadline in deadlines.items()}
+
+    def lookup_deadlines_many(self, hosts):
+        """
+        Same as ``lookup_deadlines`` for several hosts, in a single pipelined
+        round trip.
+        """
+        pipe = self.read_client.pipeline(transaction=False)
+        for host in hosts:
+            pipe.hgetall(self._expires_key(host))
+        return [{path: float(deadline) for path, deadline in deadlines.items()}
+                for deadlines in pipe.execute()]
+
+    def next_deadline(self):
+        """
+        Returns the earliest deadline of the expiring paths, or None.
+        """
+        first = self.client.zrange(self._deadlines_key(), 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    def expire_due(self, now=None, count=100):
+        """
+        Deletes up to ``count`` paths whose deadline is due at ``now``, in
+        a single script run, and returns them as (host, path) pairs. Due
+        paths are found in the deadlines sorted set, without scanning.
+        """
+        now = time.time() if now is None else now
+        members = self.client.zrangebyscore(self._deadlines_key(), '-inf', now,
+                                            start=0, num=count)
+        if not members:
+            return []
+
+        entries = [member.split(' ', 1) for member in members]
+        keys = self._script_keys(*[host for host, _ in entries])
+        args = [self._invalidations_channel(), repr(now)]
+        for host, path in entries:
+            args += [host, path]
+
+        expired = self.scripts.run('expire', keys, args)
+        return [tuple(member.split(' ', 1)) for member in expired]
+
+    def lookup_policies(self, host):
+        """
+        Fetches the policies of the paths of a host, as a path -> policy
+        dict.
+        """
+        policies = self.read_client.hgetall(self._policies_key(host))
+        return {path: json.loads(policy) for path, policy in policies.items()}
+
+    def lookup_policies_many(self, hosts):
+        """
+        Same as ``lookup_policies`` for several hosts, in a single pipelined
+        round trip.
+        """
+        pipe = self.read_client.pipeline(transaction=False)
+        for host in hosts:
+            pipe.hgetall(self._policies_key(host))
+        return [{path: json.loads(policy) for path, policy in policies.items()}
+                for policies in pipe.execute()]
+
+    def set_policy(self, host, path, policy):
+        """
+        Sets the policy of a path, an empty or None policy removing it.
+        Raises ``LookupNotFound`` if the path does not exist.
+        """
+        self.scripts.run('set_policy', self._script_keys(host),
+                         [self._invalidations_channel(), host, path,
+                          self._policy_arg(policy or {})])
+
+    def lookup_many(self, entries):
+        """
+        Fetches the targets of several (host, path) pairs in a single
+        pipelined round trip, None being returned for missing routes.
+        """
+        pipe = self.read_client.pipeline(transaction=False)
+        for host, path in entries:
+            pipe.hget(self._prefixed_route_key(host), path)
+        return pipe.execute()
+
+    def insert_many(self, entries):
+        """
+        Inserts several (host, path, target) entries in a single pipelined
+        transaction.
+        """
+        index_key = self._host_index_key()
+
         pipe = self.client.pipeline()
-        if old_path != new_path:
-            pipe.mdel(host_key, old_path)
-        pipe.msetnx(host_key, new_path, target)
+        for host, path, target in entries:
+            pipe.hset(self._prefixed_route_key(host), path, target)
+            pipe.zadd(index_key, 0, host)
+            self._queue_index_path(pipe, host, path)
+            self._queue_clear_deadline(pipe, host, path)
+        self._queue_touch(pipe, *{host for host, _, _ in entries})
         pipe.execute()
-    
-    def update_host(self, old_host, new_host):
+
+    def update_path(self, host, old_path, new_path, target, policy=None):
         """
-        Updates a host in the database
+        Moves a path to a new path, target and policy, the policy being
+        moved along if None. Raises ``LookupNotFound`` if the path does not
+        exist and ``PathExists`` if the new path already exists.
         """
-        old_key = self._prefixed_route_key(old_host)
-        new_key = self._prefixed_route_key(new_host)
-        
-        if self.client.exists(new_key) > 0:
-            raise RedisRouter.HostExists()
+        self.scripts.run('move_path', self._script_keys(host),
+                         [self._invalidations_channel(), host, old_path,
+                          new_path, target, self._policy_arg(policy)])
 
-        self.client.renamenx(old_key, new_key)
+    def update_host(self, old_host, new_host):
+        """
+        Renames a host. Raises ``LookupNotFound`` if the host does not exist
+        and ``HostExists`` if the new host already exists.
+        """
+        self.scripts.run('rename_host', self._script_keys(old_host, new_host),
+                         [self._invalidations_channel(), old_host, new_host])
 
     def delete_path(self, host, path):
         """
-        Deletes the entry of the given path, if it exists.
+        Deletes the entry of the given path, if it exists. Returns whether
+        it existed.
         """
-        host_key = self._prefixed_route_key(host)
-        self.client.hdel(host_key, path)
-    
+        deleted = self.scripts.run('delete_path', self._script_keys(host),
+                                   [self._invalidations_channel(), host, path])
+        return bool(deleted)
+
     def delete_host(self, host):
         """
-        Deletes the entry of the given host, if it exists.
+        Deletes the entry of the given host, if it exists. Returns whether
+        it existed.
+        """
+        deleted = self.scripts.run('delete_host', self._script_keys(host),
+                                   [self._invalidations_channel(), host])
+        return bool(deleted)
+
+    def _discovery_key(self, name):
+        """
+        Returns the key of the hash tracking the routes owned by discovered
+        services, ``services`` mapping each service to its routes and
+        ``owners`` mapping each route, as host + path, to its service.
+        """
+        return self._prefixed_key(f'discovery:{name}')
+
+    def lookup_discovered(self):
+        """
+        Returns the (host, path, target) routes owned by every discovered
+        service.
+        """
+        owned = self.client.hgetall(self._discovery_key('services'))
+        return {name: [tuple(r) for r in json.loads(routes)]
+                for name, routes in owned.items()}
+
+    def apply_discovered(self, services):
+        """
+        Applies the routes discovered for the given services, a
+        ``{service: [(host, path, target)]}`` dict where None stands for a
+        removed service, and returns the changes made as (host, path,
+        target) entries, target being None for deleted routes.
+
+        The difference with the routes the services already own is computed
+        and written by the ``apply_discovered.lua`` script, atomically with
+        the reads it depends on. Routes owned by another service or entered
+        by hand are never overwritten, and routes changed by hand since they
+        were discovered are left alone. The script is run again if another
+        manager changed the routes of the services in the meantime.
+        """
+        if not services:
+            return []
+
+        services_key = self._discovery_key('services')
+        names = list(services)
+        request = [[name, [list(r) for r in services[name] or ()]] for name in names]
+        desired_hosts = {h for _, routes in request for h, _, _ in routes}
+
+        for _ in range(self.DISCOVERY_RETRIES):
+            owned_hosts = {r[0] for routes in self.client.hmget(services_key, names)
+                           if routes for r in json.loads(routes)}
+            hosts = sorted(desired_hosts | owned_hosts)
+            keys = self._script_keys(*hosts)
+            keys[4:4] = [services_key, self._discovery_key('owners')]
+            try:
+                changes, conflicts = self.scripts.run(
+                    'apply_discovered', keys,
+                    [self._invalidations_channel(), json.dumps(request),
+                     json.dumps(hosts)])
+                break
+            except RedisRouter.DiscoveryChanged:
+                continue
+        else:
+            raise RedisRouter.DiscoveryChanged(
+                f'Routes of services {", ".join(names)} kept changing')
+
+        for host, path, name, owner in conflicts:
+            if owner is None:
+                logger.warning('Route %s%s of service %s is already set by hand',
+                               host, path, name)
+            else:
+                logger.warning('Route %s%s of service %s is owned by service %s',
+                               host, path, name, owner)
+
+        return [(host, path, target) for host, path, target in changes]
+
+
+class RoutingSnapshot:
+    """
+    Copy of the whole routing table, as a ``{host: {path: target}}`` dict,
+    along with the ``{host: {path: policy}}`` policies of the paths having
+    one, versioned with the route table generation it was built at. The
+    ``$wildcard`` host holds the routes of requests for unknown hosts.
+    """
+    WILDCARD_HOST = '$wildcard'
+
+    def __init__(self, version, routes, policies=None):
+        self.version = version
+        self.routes = routes
+        self.policies = policies or {}
+
+    @property
+    def wildcard(self):
+        return self.routes.get(RoutingSnapshot.WILDCARD_HOST)
+
+    def to_json(self):
+        return json.dumps({'version': self.version, 'routes': self.routes,
+                           'policies': self.policies},
+                          separators=(',', ':'), sort_keys=True)
+
+    @staticmethod
+    def from_json(data):
+        snapshot = json.loads(data)
+        return RoutingSnapshot(snapshot['version'], snapshot['routes'],
+                               snapshot.get('policies'))
+
+    def entries(self):
+        """
+        Yields the (host, path, target) entries of the snapshot, sorted.
+        """
+        for host in sorted(self.routes):
+            for path, target in sorted(self.routes[host].items()):
+                yield host, path, target
+
+    def diff(self, other):
+        """
+        Returns the changes from this snapshot to the other one, as a dict
+        with the ``added`` and ``removed`` (host, path, target) entries and
+        the ``changed`` (host, path, target, new target) entries.
+        """
+        added, removed, changed = [], [], []
+
+        for host in sorted(self.routes.keys() | other.routes.keys()):
+            paths = self.routes.get(host, {})
+            other_paths = other.routes.get(host, {})
+            for path in sorted(paths.keys() | other_paths.keys()):
+                target, other_target = paths.get(path), other_paths.get(path)
+                if target is None:
+                    added.append((host, path, other_target))
+                elif other_target is None:
+                    removed.append((host, path, target))
+                elif target != other_target:
+                    changed.append((host, path, target, other_target))
+
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def resolve(self, host, path):
+        """
+        Resolves a request as the proxy does, falling back to the wildcard
+        routes if no route of the host matches. Returns a
+        ``(target, unrooted path)`` tuple or None.
+        """
+        paths = self.routes.get(host)
+        result = routing.resolve(paths, path) if paths else None
+        if result is None and host != RoutingSnapshot.WILDCARD_HOST and self.wildcard:
+            result = routing.resolve(self.wildcard, path)
+        return result
+
+
+class SnapshotPublisher:
+    """
+    Republishes the routing snapshot whenever routes change. Changes made
+    within ``delay`` seconds are coalesced in a single snapshot, and a lock
+    in Redis keeps several publishers from building it at the same time.
+    """
+    CHECK_INTERVAL = 60
+    LOCK_TIMEOUT = 300
+    # seconds waited at most for a change before checking whether stopped
+    STOP_INTERVAL = 1
+
+    @staticmethod
+    def from_config(router):
+        return SnapshotPublisher(router, settings.SNAPSHOT_DELAY)
+
+    def __init__(self, router, delay):
+        self.router = router.primary()
+        self.delay = delay
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def publish(self):
+        """
+        Builds and publishes a snapshot, unless another publisher is busy
+        doing so.
+        """
+        client = self.router.client
+        lock_key = self.router._snapshot_key('lock')
+        token = uuid.uuid4().hex
+
+        if not client.set(lock_key, token, nx=True, ex=self.LOCK_TIMEOUT):
+            return False
+
+        try:
+            snapshot = self.router.build_snapshot()
+            return self.router.publish_snapshot(snapshot)
+        finally:
+            if client.get(lock_key) == token:
+                client.delete(lock_key)
+
+    def _is_outdated(self):
+        version = self.router.snapshot_version()
+        return version is None or version < self.router.generation()
+
+    def run(self):
+        """
+        Publishes a snapshot after every change, until stopped.
+        """
+        while not self._stopped.is_set():
+            subscriber = None
+            try:
+                subscriber = self.router.subscribe()
+                if self._is_outdated():
+                    self.publish()
+
+                checked_at = time.monotonic()
+                while not self._stopped.is_set():
+                    if subscriber.get_host(timeout=self.STOP_INTERVAL) is not None:
+                        self._stopped.wait(self.delay)
+                        while subscriber.get_host() is not None:
+                            pass
+                    elif time.monotonic() - checked_at < self.CHECK_INTERVAL:
+                        continue
+                    checked_at = time.monotonic()
+                    if self._is_outdated():
+                        self.publish()
+            except Exception:
+                logger.exception('Failed to publish routing snapshot')
+                self._stopped.wait(self.CHECK_INTERVAL)
+            finally:
+                if subscriber is not None:
+                    subscriber.close()
+
+    def start(self):
+        """
+        Runs the publisher in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            name='ceryx-snapshot-publisher',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the publisher, which exits the background thread within ``STOP_INTERVAL`` seconds.
+        """
+        self._stopped.set()
+
+
+class RouteReaper:
+    """
+    Deletes the expiring paths once their deadline is due. Due paths are
+    taken from the deadlines sorted set in batches of ``batch_size``, each
+    batch being deleted by a single script run, and the reaper sleeps until
+    the next deadline, checking at least every ``interval`` seconds for
+    paths inserted meanwhile. Several reapers may run at once, a path being
+    deleted by a single one of them.
+    """
+
+    @staticmethod
+    def from_config(router):
+        return RouteReaper(router, settings.REAPER_INTERVAL,
+                           settings.REAPER_BATCH_SIZE)
+
+    def __init__(self, router, interval=1, batch_size=100):
+        self.router = router.primary()
+        self.interval = interval
+        self.batch_size = batch_size
+        self._listeners = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """
+        Registers a callback called with ``(host, path, None)`` for every
+        deleted path, as the ``LabelReconciler`` listeners are.
+        """
+        self._listeners.append(callback)
+
+    def reap(self, now=None):
+        """
+        Deletes a batch of due paths, returning them as (host, path) pairs.
+        """
+        expired = self.router.expire_due(now, self.batch_size)
+        for host, path in expired:
+            logger.info('Route %s%s expired', host, path)
+            for callback in self._listeners:
+                callback(host, path, None)
+        return expired
+
+    def _wait_time(self):
+        deadline = self.router.next_deadline()
+        if deadline is None:
+            return self.interval
+        return min(max(deadline - time.time(), 0), self.interval)
+
+    def run(self):
+        """
+        Deletes the due paths, until stopped.
+        """
+        while not self._stopped.is_set():
+            try:
+                if len(self.reap()) < self.batch_size:
+                    self._stopped.wait(self._wait_time())
+            except Exception:
+                logger.exception('Failed to delete expired routes')
+                self._stopped.wait(self.interval)
+
+    def start(self):
+        """
+        Runs the reaper in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            name='ceryx-route-reaper',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the reaper, which exits the background thread once the current batch is deleted.
+        """
+        self._stopped.set()
+
+
+class RouteSubscriber:
+    """
+    Subscriber of the hosts invalidated by changes made through
+    ``RedisRouter``, allowing caches of routes to be kept for long and
+    still be dropped as soon as a host changes.
+    """
+
+    def __init__(self, client, channel):
+        self.pubsub = client.pubsub()
+        self.pubsub.subscribe(channel)
+
+    def listen(self):
+        """
+        Yields every invalidated host. Hosts changed before subscribing or
+        while disconnected are not yielded, so caches should be dropped
+        entirely whenever a new subscriber is created.
         """
-        host_key = self._prefixed_route_key(host)
-        self.client.delete(host_key)
+        for message in self.pubsub.listen():
+            if message['type'] == 'message':
+                yield message['data']
+
+    def get_host(self, timeout=0, on_subscribe=None):
+        """
+        Returns the next invalidated host, waiting at most ``timeout``
+        seconds, or None if none was published. ``on_subscribe`` is called
+        once the subscription is confirmed, and again whenever it is
+        restored after a disconnection, hosts changed meanwhile being missed.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            message = self.pubsub.get_message(timeout=timeout)
+            if message is None:
+                return None
+            if message['type'] == 'message':
+                return message['data']
+            if message['type'] == 'subscribe' and on_subscribe is not None:
+                on_subscribe()
+            timeout = max(deadline - time.monotonic(), 0)
+
+    def invalidate(self, cache, timeout=0):
+        """
+        Drops the invalidated hosts from ``cache``, a dict keyed by host,
+        waiting at most ``timeout`` seconds for the first one. Returns the
+        invalidated hosts.
+        """
+        hosts = set()
+        host = self.get_host(timeout)
+        while host is not None:
+            hosts.add(host)
+            cache.pop(host, None)
+            host = self.get_host()
+        return hosts
+
+    def close(self):
+        self.pubsub.close()
+
+
+class ExpiringCache:
+    """
+    In process cache of at most ``size`` entries, each expiring ``ttl``
+    seconds after being set, the least recently used entries being evicted
+    first.
+    """
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
 
+    def __len__(self):
+        return len(self._entries)
 
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@metrics.instrumented('redis_users')
 class RedisUsers:
     """
     Users db using a redis backend
@@ -174,19 +1239,54 @@ class RedisUsers:
         """
         pass
 
+    class Busy(Exception):
+        """
+        Exception raised when too many passwords are already being hashed or
+        checked and no slot became free in time.
+        """
+        pass
+
+    MAX_CACHED_LOGINS = 10000
+    MAX_CACHED_USERS = 10000
+
     @staticmethod
     def from_config(path=None):
         """
         Returns a RedisUsers, using the default configuration from Ceryx
         settings.
         """
-        return RedisUsers(settings.REDIS_HOST, settings.REDIS_PORT,
-                          REDIS_DEFAULT_DB, settings.REDIS_PREFIX)
+        return RedisUsers(prefix=settings.REDIS_PREFIX, client=get_client(),
+                          read_client=get_client(replica=True))
 
-    def __init__(self, host, port, db, prefix):
-        self.client = redis.StrictRedis(host=host, port=port, db=db, decode_responses=True)
+    def __init__(self, host=None, port=None, db=REDIS_DEFAULT_DB, prefix=None,
+                 client=None, read_client=None):
+        if client is None:
+            client = InstrumentedRedis(host=host, port=port, db=db, decode_responses=True)
+        self.client = client
+        self.read_client = read_client or client
         self.prefix = prefix
 
+        self._cache = ExpiringCache(self.MAX_CACHED_USERS, settings.USER_CACHE_TTL)
+        self._logins = ExpiringCache(self.MAX_CACHED_LOGINS, settings.LOGIN_CACHE_TTL)
+        self._login_key = os.urandom(32)
+        self._bcrypt = ThreadPoolExecutor(max_workers=settings.BCRYPT_WORKERS)
+        self._bcrypt_slots = threading.BoundedSemaphore(settings.BCRYPT_MAX_PENDING)
+
+    def _run_bcrypt(self, func, *args):
+        """
+        Runs a bcrypt function in the bcrypt thread pool, so that at most
+        ``settings.BCRYPT_WORKERS`` hashes are computed at once. Raises
+        ``RedisUsers.Busy`` if ``settings.BCRYPT_MAX_PENDING`` calls are
+        already running or waiting for ``settings.BCRYPT_TIMEOUT`` seconds.
+        """
+        if not self._bcrypt_slots.acquire(timeout=settings.BCRYPT_TIMEOUT):
+            raise RedisUsers.Busy()
+
+        try:
+            return self._bcrypt.submit(func, *args).result()
+        finally:
+            self._bcrypt_slots.release()
+
     def _prefixed_key(self, username):
         """
         Returns the prefixed key, if prefix has been defined, for the given user.
@@ -197,31 +1297,224 @@ class RedisUsers:
         
         return prefixed_key
     
+    def _login_digest(self, username, plain_password, password):
+        """
+        Returns the digest of a login, keyed with a secret of the process so
+        that cached logins can not be guessed from the cache.
+        """
+        message = '\0'.join((username, plain_password, password)).encode()
+        return hmac.new(self._login_key, message, hashlib.sha256).digest()
+
     def login(self, username, plain_password):
+        """
+        Checks the password of a user. Successful logins are cached in
+        process for ``settings.LOGIN_CACHE_TTL`` seconds, so that API clients
+        authenticating every request do not pay for a bcrypt check each
+        time. The cache is keyed on the stored hash as well, so a changed
+        password is checked again. Raises ``RedisUsers.Busy`` if no bcrypt
+        worker is available.
+        """
         key = self._prefixed_key(username)
         password = self.client.get(key)
 
         if not password:
             return False
 
-        password = password.encode()
-        plain_password = plain_password.encode()
+        digest = self._login_digest(username, plain_password, password)
+        if self._logins.get(digest):
+            return True
 
-        return bcrypt.checkpw(plain_password, password)
+        valid = self._run_bcrypt(bcrypt.checkpw, plain_password.encode(),
+                                 password.encode())
+        if valid:
+            self._logins.set(digest, True)
+        return valid
 
-    def lookup(self, pattern=None):
+    def exists(self, username):
+        """
+        Checks if the given user exists. Results are cached in process for
+        ``settings.USER_CACHE_TTL`` seconds, for at most ``MAX_CACHED_USERS``
+        usernames, since this is called on every authenticated request.
+        """
+        cached = self._cache.get(username)
+        if cached is not None:
+            return cached
+
+        exists = self.client.exists(self._prefixed_key(username)) > 0
+        self._cache.set(username, exists)
+        return exists
+
+    def iter_users(self, pattern=None, count=None):
+        """
+        Yields usernames that match the given pattern using a SCAN cursor,
+        ``count`` being the SCAN batch size hint.
+        """
         pattern = pattern or '*'
+        count = count or settings.REDIS_SCAN_COUNT
         lookup_pattern = self._prefixed_key(pattern)
-        keys = self.client.keys(lookup_pattern)
-        return [key[len(lookup_pattern) - len(pattern):] for key in keys]
+        key_prefix = len(lookup_pattern) - len(pattern)
+        for key in self.read_client.scan_iter(match=lookup_pattern, count=count):
+            yield key[key_prefix:]
+
+    def lookup(self, pattern=None):
+        return list(self.iter_users(pattern))
     
     def insert(self, username, plain_password):
-        hashed_password = bcrypt.hashpw(plain_password.encode(), bcrypt.gensalt())
+        hashed_password = self._run_bcrypt(bcrypt.hashpw, plain_password.encode(),
+                                           bcrypt.gensalt())
         password = hashed_password.decode('utf-8')
 
         key = self._prefixed_key(username)
         self.client.set(key, password)
+        self._cache.pop(username)
 
     def delete(self, username):
         key = self._prefixed_key(username)
         self.client.delete(key)
+        self._cache.pop(username)
+
+
+@metrics.instrumented('redis_stats')
+class RedisStats:
+    """
+    Traffic statistics of the routes, accumulated by the proxies and
+    flushed in batches to per time bucket keys (see ``stats.lua``):
+
+    * ``stats:hits:<bucket>``: sorted set of the hits of each route,
+      ``"<host> <path>"`` being the route member.
+    * ``stats:requests:<bucket>``: the number of routed requests.
+    * ``stats:clients:<bucket>``: HyperLogLog of the client addresses.
+    * ``stats:clients:<bucket>:<host> <path>``: HyperLogLog of the client
+      addresses of a route.
+
+    Buckets are the start of ``bucket`` seconds periods, so the keys of a
+    time range are known and never scanned.
+    """
+
+    @staticmethod
+    def from_config():
+        """
+        Returns a RedisStats, using the default configuration from Ceryx
+        settings.
+        """
+        return RedisStats(prefix=settings.REDIS_PREFIX, client=get_client(),
+                          read_client=get_client(replica=True),
+                          bucket=settings.STATS_BUCKET)
+
+    def __init__(self, host=None, port=None, db=REDIS_DEFAULT_DB, prefix=None,
+                 client=None, read_client=None, bucket=60):
+        if client is None:
+            client = InstrumentedRedis(host=host, port=port, db=db, decode_responses=True)
+        self.client = client
+        self.read_client = read_client or client
+        self.prefix = prefix
+        self.bucket = bucket
+
+    def _prefixed_key(self, key):
+        """
+        Returns the prefixed key, if prefix has been defined.
+        """
+        if self.prefix is not None:
+            return f'{self.prefix}:{key}'
+        return key
+
+    @staticmethod
+    def route_member(host, path):
+        """Returns the member of a route in the statistics keys"""
+        return f'{host} {path}'
+
+    @staticmethod
+    def parse_member(member):
+        """Returns the (host, path) of a route member"""
+        host, _, path = member.partition(' ')
+        return host, path
+
+    def buckets(self, start, end):
+        """
+        Returns the buckets from the one containing the ``start`` timestamp
+        to the one containing ``end``.
+        """
+        first = int(start) // self.bucket * self.bucket
+        return list(range(first, int(end) + 1, self.bucket))
+
+    def _hits_key(self, bucket):
+        return self._prefixed_key(f'stats:hits:{bucket}')
+
+    def _requests_key(self, bucket):
+        return self._prefixed_key(f'stats:requests:{bucket}')
+
+    def _clients_key(self, bucket, member=None):
+        if member is None:
+            return self._prefixed_key(f'stats:clients:{bucket}')
+        return self._prefixed_key(f'stats:clients:{bucket}:{member}')
+
+    def top_routes(self, start, end, count=10):
+        """
+        Returns the ``count`` routes with the most hits between the given
+        timestamps, as ``(host, path, hits)`` tuples. The union of the
+        buckets is kept for a bucket, so that reloading the page does not
+        compute it again.
+        """
+        buckets = self.buckets(start, end)
+        union_key = self._prefixed_key(f'stats:top:{buckets[0]}:{buckets[-1]}')
+
+        top = self.client.zrevrange(union_key, 0, count - 1, withscores=True)
+        if not top and not self.client.exists(union_key):
+            with self.client.pipeline() as pipe:
+                pipe.zunionstore(union_key, [self._hits_key(b) for b in buckets])
+                pipe.expire(union_key, self.bucket)
+                pipe.zrevrange(union_key, 0, count - 1, withscores=True)
+                _, _, top = pipe.execute()
+
+        return [(*self.parse_member(member), int(hits)) for member, hits in top]
+
+    def distinct_clients(self, start, end, host=None, path=None):
+        """
+        Returns the estimated number of distinct clients between the given
+        timestamps, of a route if ``host`` is given.
+        """
+        member = None if host is None else self.route_member(host, path)
+        keys = [self._clients_key(b, member) for b in self.buckets(start, end)]
+        return self.read_client.pfcount(*keys)
+
+    def distinct_clients_many(self, routes, start, end):
+        """
+        Same as ``distinct_clients`` for each of the ``(host, path)`` routes,
+        in a single round trip.
+        """
+        buckets = self.buckets(start, end)
+        with self.read_client.pipeline(transaction=False) as pipe:
+            for host, path in routes:
+                member = self.route_member(host, path)
+                pipe.pfcount(*[self._clients_key(b, member) for b in buckets])
+            return pipe.execute()
+
+    def series(self, start, end, points=60, host=None, path=None):
+        """
+        Returns the hits and the estimated distinct clients between the
+        given timestamps, of a route if ``host`` is given, grouping the
+        buckets in at most ``points`` ``(timestamp, hits, clients)`` points.
+        """
+        buckets = self.buckets(start, end)
+        size = -(-len(buckets) // points)
+        groups = [buckets[i:i + size] for i in range(0, len(buckets), size)]
+        member = None if host is None else self.route_member(host, path)
+
+        with self.read_client.pipeline(transaction=False) as pipe:
+            for group in groups:
+                if member is None:
+                    pipe.mget([self._requests_key(b) for b in group])
+                else:
+                    for bucket in group:
+                        pipe.zscore(self._hits_key(bucket), member)
+                pipe.pfcount(*[self._clients_key(b, member) for b in group])
+            results = iter(pipe.execute())
+
+        series = []
+        for group in groups:
+            if member is None:
+                hits = sum(int(h or 0) for h in next(results))
+            else:
+                hits = sum(int(next(results) or 0) for _ in group)
+            series.append((group[0], hits, next(results)))
+        return series
@@ -0,0 +1,166 @@
+"""
+Discovery of routes from the labels of the services in the proxy network.
+
+A service declares its routes with the following labels, ``ceryx`` being
+the default label prefix:
+
+    ceryx.host: example.com,www.example.com
+    ceryx.path: /api
+    ceryx.port: 8080
+"""
+import logging
+import threading
+
+from ceryx import settings
+from ceryx.db import chunks
+
+
+logger = logging.getLogger(__name__)
+
+
+class LabelReconciler:
+    """
+    Keeps the routes declared by service labels in sync with Redis.
+
+    Changes reported by ``DockerService`` are queued, coalesced for
+    ``delay`` seconds and applied with ``RedisRouter.apply_discovered``,
+    which only writes the difference with the routes the services already
+    own. Every service is reconciled on start, so that services removed
+    meanwhile lose their routes.
+    """
+    RETRY_DELAY = 5
+    RESYNC_INTERVAL = 60
+
+    @staticmethod
+    def from_config(docker_api, router):
+        return LabelReconciler(docker_api, router,
+                               settings.DISCOVERY_LABEL_PREFIX,
+                               settings.DISCOVERY_DELAY)
+
+    def __init__(self, docker_api, router, label_prefix='ceryx', delay=0.2):
+        self.docker_api = docker_api
+        self.router = router
+        self.label_prefix = label_prefix
+        self.delay = delay
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._listeners = []
+        self._thread = None
+
+    def _label(self, labels, name):
+        return (labels.get(f'{self.label_prefix}.{name}') or '').strip()
+
+    def routes(self, service):
+        """
+        Returns the (host, path, target) routes declared by the labels of
+        the given service.
+        """
+        labels = service.attrs['Spec'].get('Labels') or {}
+        hosts = self._label(labels, 'host')
+        if not hosts:
+            return []
+
+        path = self._label(labels, 'path') or '/'
+        if not path.startswith('/'):
+            path = '/' + path
+
+        port = self._label(labels, 'port')
+        target = service.name
+        if port and port != '80':
+            target = f'{target}:{port}'
+
+        return [(host.strip(), path, target)
+                for host in hosts.split(',') if host.strip()]
+
+    def add_listener(self, callback):
+        """
+        Registers a callback called with ``(host, path, target)`` for every
+        route changed by the reconciler, target being None for deleted
+        routes.
+        """
+        self._listeners.append(callback)
+
+    def on_service_change(self, name, service):
+        """Listener for ``DockerService`` changes"""
+        routes = None if service is None else self.routes(service)
+        with self._lock:
+            self._pending[name] = routes
+        self._wakeup.set()
+
+    def reconcile(self):
+        """
+        Applies the queued service changes, returning the changes made to
+        the routes.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        changes = []
+        for names in chunks(pending, settings.REDIS_CHUNK_SIZE):
+            services = {name: pending[name] for name in names}
+            changes.extend(self.router.apply_discovered(services))
+
+        for change in changes:
+            for callback in self._listeners:
+                try:
+                    callback(*change)
+                except Exception:
+                    logger.exception('Discovery listener failed')
+
+        return changes
+
+    def reconcile_all(self):
+        """
+        Reconciles every service in the proxy network, as well as the
+        discovered services which no longer exist.
+        """
+        services = {s.name: s for s in self.docker_api.services()}
+        for name in self.router.lookup_discovered():
+            if name not in services:
+                self.on_service_change(name, None)
+        for name, service in services.items():
+            self.on_service_change(name, service)
+        return self.reconcile()
+
+    def run(self):
+        """
+        Reconciles the services as they change, until stopped.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.reconcile_all()
+                while not self._stopped.is_set():
+                    if not self._wakeup.wait(self.RESYNC_INTERVAL):
+                        # resyncs the services if the cache expired
+                        self.docker_api.services()
+                        continue
+                    self._stopped.wait(self.delay)
+                    self._wakeup.clear()
+                    if not self._stopped.is_set():
+                        self.reconcile()
+            except Exception:
+                logger.exception('Failed to reconcile discovered routes')
+                self._stopped.wait(self.RETRY_DELAY)
+
+    def start(self):
+        """
+        Listens to the service changes and reconciles them in a background
+        thread.
+        """
+        if self._thread is None:
+            self.docker_api.add_listener(self.on_service_change)
+            self._thread = threading.Thread(target=self.run,
+                                            name='ceryx-discovery',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops listening to the service changes and reconciling them.
+        """
+        self.docker_api.remove_listener(self.on_service_change)
+        self._stopped.set()
+        self._wakeup.set()
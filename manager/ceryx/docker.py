@@ -2,22 +2,54 @@
 Package containing a service to interact with the Docker api
 """
 
+import hashlib
+import logging
+import threading
+import time
+
 import docker
 
-from ceryx import settings
+from ceryx import metrics, settings
+
 
+logger = logging.getLogger(__name__)
 
+
+@metrics.instrumented('docker')
 class DockerService:
-    """Interacts with the Docker Api"""
+    """
+    Interacts with the Docker Api
+
+    Services in the proxy network are cached in memory. The cache is warmed
+    on first use, kept up to date by a background thread consuming the
+    Docker events stream and fully resynced every ``cache_ttl`` seconds in
+    case an event was missed. A single thread resyncs at a time, the others
+    using the stale services meanwhile, and the events received during a
+    resync are applied once it is done.
+    """
+
+    EVENTS_RETRY_DELAY = 5
 
     @staticmethod
     def from_config():
         """Create an instance of ``DockerService`` from settings"""
-        return DockerService(settings.DOCKER_HOST, settings.PROXY_NETWORK)
+        return DockerService(settings.DOCKER_HOST, settings.PROXY_NETWORK,
+                             settings.DOCKER_CACHE_TTL)
 
-    def __init__(self, base_url, proxy_network):
+    def __init__(self, base_url, proxy_network, cache_ttl=None):
         self.client = docker.DockerClient(base_url=base_url, version='auto')
         self.proxy_network = proxy_network
+        self.cache_ttl = cache_ttl
+
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._syncing = False
+        self._queued_events = []
+        self._services = {}
+        self._fingerprint = None
+        self._synced_at = None
+        self._watcher = None
+        self._listeners = []
 
     def _is_in_proxy_network(self, service):
         if 'Networks' not in service.attrs['Spec']:
@@ -29,13 +61,182 @@ class DockerService:
 
         return False
 
+    def add_listener(self, callback):
+        """
+        Registers a callback called with ``(name, service)`` whenever a
+        service in the proxy network is added or updated, or with
+        ``(name, None)`` when it is removed.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Unregisters a callback registered with ``add_listener``"""
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _notify(self, name, service):
+        for callback in self._listeners:
+            try:
+                callback(name, service)
+            except Exception:
+                logger.exception('Docker service listener failed')
+
+    def _is_stale(self):
+        if self._synced_at is None:
+            return True
+        if self.cache_ttl is None:
+            return False
+        return time.monotonic() - self._synced_at > self.cache_ttl
+
+    @staticmethod
+    def _version(service):
+        """Returns the version of a service, bumped by every update"""
+        return service.attrs.get('Version', {}).get('Index')
+
+    def _is_changed(self, old, new):
+        if old is None or new is None:
+            return old is not new
+        version = self._version(new)
+        return version is None or version != self._version(old)
+
+    def _is_older(self, service, other):
+        version, other_version = self._version(service), self._version(other)
+        return version is not None and other_version is not None and version < other_version
+
+    def _sync(self):
+        """
+        Reloads every service in the proxy network from the docker daemon,
+        unless another thread is doing so. Only the services which changed
+        are notified.
+        """
+        first = self._synced_at is None
+        # the first sync is waited for, the next ones use the stale services
+        if not self._sync_lock.acquire(blocking=first):
+            return
+
+        try:
+            if not self._is_stale():
+                return
+
+            with self._lock:
+                self._syncing = True
+            try:
+                with metrics.docker_call('services.list'):
+                    services = self.client.services.list()
+            finally:
+                with self._lock:
+                    self._syncing = False
+                    queued, self._queued_events = self._queued_events, []
+
+            services = {s.name: s for s in services if self._is_in_proxy_network(s)}
+            with self._lock:
+                # the events received meanwhile are newer than the listed services
+                for name, service in queued:
+                    listed = services.get(name)
+                    if service is None:
+                        services.pop(name, None)
+                    elif listed is None or not self._is_older(service, listed):
+                        services[name] = service
+                old_services, self._services = self._services, services
+                self._update_fingerprint()
+                self._synced_at = time.monotonic()
+        finally:
+            self._sync_lock.release()
+
+        for name in old_services.keys() - services.keys():
+            self._notify(name, None)
+        for name, service in services.items():
+            if self._is_changed(old_services.get(name), service):
+                self._notify(name, service)
+
+    def _cached(self):
+        if self._watcher is None:
+            self._start_watcher()
+        if self._is_stale():
+            self._sync()
+        return self._services
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher = threading.Thread(target=self._watch_events,
+                                             name='ceryx-docker-events',
+                                             daemon=True)
+        self._watcher.start()
+
+    def _watch_events(self):
+        """Applies service events to the cache, reconnecting on failures"""
+        while True:
+            try:
+                events = self.client.events(decode=True,
+                                            filters={'type': 'service'})
+                for event in events:
+                    self._apply_event(event)
+            except Exception:
+                logger.exception('Docker events stream failed, reconnecting')
+
+            # events may have been lost, force a resync on next access
+            with self._lock:
+                self._synced_at = None
+            time.sleep(self.EVENTS_RETRY_DELAY)
+
+    def _apply_event(self, event):
+        action = event.get('Action')
+        actor = event.get('Actor', {})
+        name = actor.get('Attributes', {}).get('name')
+        if (self._synced_at is None and not self._syncing) or not name:
+            return
+
+        service = None
+        if action in ('create', 'update'):
+            try:
+                with metrics.docker_call('services.get'):
+                    service = self.client.services.get(actor['ID'])
+            except docker.errors.NotFound:
+                pass
+        elif action != 'remove':
+            return
+
+        if service is not None and not self._is_in_proxy_network(service):
+            service = None
+
+        with self._lock:
+            if self._syncing:
+                # applied, and notified, once the resync is done
+                self._queued_events.append((name, service))
+                return
+            services = dict(self._services)
+            removed = services.pop(name, None)
+            if service is not None:
+                services[name] = service
+            self._services = services
+            self._update_fingerprint()
+
+        if service is not None or removed is not None:
+            self._notify(name, service)
+
+    def _update_fingerprint(self):
+        names = '\n'.join(sorted(self._services))
+        self._fingerprint = hashlib.sha1(names.encode()).hexdigest()[:16]
+
+    def fingerprint(self):
+        """
+        Returns a digest of the names of the services in the proxy network,
+        which changes whenever a service is added or removed.
+        """
+        self._cached()
+        return self._fingerprint
+
     def services(self, filters=None):
         """Get services from docker daemon"""
-        filters = filters or dict()
-        services = self.client.services.list(filters=filters)
+        if not filters:
+            return list(self._cached().values())
+
+        with metrics.docker_call('services.list'):
+            services = self.client.services.list(filters=filters)
         return [s for s in services if self._is_in_proxy_network(s)]
 
     def has_service(self, name):
         """Checks if a service with the given exists"""
-        services = self.services(filters={'name': name})
-        return len(services) > 0
+        return name in self._cached()
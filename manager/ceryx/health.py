@@ -0,0 +1,310 @@
+"""
+Health checking of the route targets.
+
+Targets are probed concurrently by an asyncio loop running in a background
+thread, each on its own schedule, with a TCP connection or, if an HTTP path
+is configured, with an HTTP GET answered with a status below 500. A target
+is marked unhealthy after ``failures`` consecutive failed probes and healthy
+again after a successful one. Only the changes are written to Redis, where
+the proxy skips the paths of unhealthy targets.
+
+The Redis commands are run by a single thread executor, so that the loop
+keeps probing while waiting for Redis, and only the hosts whose generation
+changed are read again when the route table changes.
+"""
+import asyncio
+import collections
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ceryx import settings, targets
+from ceryx.leases import Lease
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_intervals(value):
+    """
+    Parses comma separated ``address=seconds`` probe intervals, returning
+    them as a ``{address: seconds}`` dict.
+    """
+    intervals = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if item:
+            address, _, seconds = item.rpartition('=')
+            intervals[address.strip()] = float(seconds)
+    return intervals
+
+
+class HealthChecker:
+    """
+    Probes the targets of the route table, at most ``concurrency`` at once,
+    every ``interval`` seconds each, or as given in the ``intervals`` of
+    some targets. A lock in Redis keeps several managers from checking at
+    the same time.
+    """
+    TICK = 0.5
+    LOCK_TIMEOUT = 30
+    RETRY_DELAY = 5
+
+    @staticmethod
+    def from_config(router):
+        return HealthChecker(router, settings.HEALTH_INTERVAL,
+                             settings.HEALTH_TIMEOUT,
+                             settings.HEALTH_CONCURRENCY,
+                             settings.HEALTH_FAILURES,
+                             settings.HEALTH_HTTP_PATH,
+                             parse_intervals(settings.HEALTH_INTERVALS))
+
+    def __init__(self, router, interval=10, timeout=2, concurrency=100,
+                 failures=2, http_path=None, intervals=None):
+        self.router = router.primary()
+        self.interval = interval
+        self.intervals = intervals or {}
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.failures = failures
+        self.http_path = http_path or None
+
+        self._lock = Lease(self.router.client, self.router._prefixed_key('health:lock'),
+                           self.LOCK_TIMEOUT)
+        self._executor = ThreadPoolExecutor(1)
+        self._generation = None
+        self._host_generations = {}
+        self._host_targets = {}
+        self._routed = collections.Counter()
+        self._due = {}
+        self._in_flight = set()
+        self._failures = {}
+        self._unhealthy = set()
+        self._changes = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    async def probe(self, target):
+        """Returns whether the target answered in time"""
+        host, port = targets.split(target)
+        try:
+            connection = asyncio.open_connection(host, port)
+            reader, writer = await asyncio.wait_for(connection, self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError):
+            return False
+
+        try:
+            if self.http_path is None:
+                return True
+
+            request = (f'GET {self.http_path} HTTP/1.0\r\n'
+                       f'Host: {host}\r\n'
+                       f'User-Agent: ceryx-health\r\n\r\n')
+            writer.write(request.encode())
+            status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+            parts = status_line.split()
+            return (len(parts) >= 2 and parts[0].startswith(b'HTTP/')
+                    and parts[1].isdigit() and int(parts[1]) < 500)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+    def record(self, target, ok):
+        """
+        Records the result of a probe, returning the new health of the
+        target if it changed, or None.
+        """
+        if ok:
+            self._failures.pop(target, None)
+            if target in self._unhealthy:
+                self._unhealthy.discard(target)
+                return True
+            return None
+
+        failures = self._failures[target] = self._failures.get(target, 0) + 1
+        if failures >= self.failures and target not in self._unhealthy:
+            self._unhealthy.add(target)
+            return False
+        return None
+
+    async def _check(self, target, semaphore):
+        try:
+            async with semaphore:
+                ok = await self.probe(target)
+            change = self.record(target, ok)
+            if change is not None:
+                self._changes[target] = change
+        finally:
+            self._in_flight.discard(target)
+
+    def target_interval(self, target):
+        """Returns the seconds between two probes of a target"""
+        return self.intervals.get(target, self.interval)
+
+    def _read_changes(self):
+        """
+        Returns the generation of the route table, the generations of the
+        hosts and the paths of the hosts changed since the last refresh,
+        only the generation being read if the table did not change. Runs in
+        the executor.
+
+        The first refresh after a reset reads every route, see
+        ``_read_all``, the next ones the hosts whose generation changed.
+        """
+        if self._generation is None:
+            return self._read_all()
+
+        generation = self.router.generation()
+        if generation == self._generation:
+            return generation, None, {}
+
+        generations = self.router.host_generations()
+        hosts = [host for host, host_generation in generations.items()
+                 if self._host_generations.get(host) != host_generation]
+        hosts += [host for host in self._host_targets if host not in generations]
+
+        paths = {}
+        chunk_size = settings.REDIS_CHUNK_SIZE
+        for i in range(0, len(hosts), chunk_size):
+            chunk = hosts[i:i + chunk_size]
+            paths.update(zip(chunk, self.router.lookup_paths_many(chunk)))
+        return generation, generations, paths
+
+    def _read_all(self):
+        """
+        Reads every route, giving the hosts without a generation one (see
+        ``RedisRouter.adopt_generations``) so that their changes are read
+        incrementally afterwards. The generations are read before the
+        routes, a host changed meanwhile being read again on the next
+        refresh.
+        """
+        generation = self.router.generation()
+        generations = self.router.host_generations()
+        paths = {route['host']: route['paths'] for route in self.router.iter_routes()}
+
+        untracked = [host for host in paths if host not in generations]
+        generations.update(self.router.adopt_generations(untracked))
+        return generation, generations, paths
+
+    def _refresh_targets(self, now, generation, generations, paths):
+        """
+        Schedules the targets of the changed hosts, the new ones at a random
+        time within their interval to spread the probes, and forgets the
+        targets no longer routed.
+        """
+        full = self._generation is None
+        self._generation = generation
+        if generations is not None:
+            self._host_generations = generations
+
+        for host, host_paths in paths.items():
+            new = {address for value in host_paths.values()
+                   for address in targets.addresses(value)}
+            old = self._host_targets.pop(host, set())
+            if new:
+                self._host_targets[host] = new
+
+            for target in new - old:
+                self._routed[target] += 1
+                if target not in self._due:
+                    self._due[target] = now + random.uniform(0, self.target_interval(target))
+            for target in old - new:
+                self._routed[target] -= 1
+                if self._routed[target] > 0:
+                    continue
+                del self._routed[target]
+                self._due.pop(target, None)
+                self._failures.pop(target, None)
+                self._forget_unhealthy(target)
+
+        if full and generations is not None:
+            # targets left unhealthy in Redis by a previous run
+            for target in self._unhealthy - self._routed.keys():
+                self._forget_unhealthy(target)
+
+    def _forget_unhealthy(self, target):
+        if target in self._unhealthy:
+            # the set of unhealthy targets only holds routed targets
+            self._unhealthy.discard(target)
+            self._changes[target] = True
+
+    def _hold_lock(self):
+        """
+        Acquires or renews the lock, returning whether it is held and the
+        checker not stopped
+        """
+        return not self._stopped.is_set() and self._lock.hold()
+
+    def _reset(self):
+        """Resets the state to the one stored in Redis"""
+        self._generation = None
+        self._host_generations = {}
+        self._host_targets = {}
+        self._routed = collections.Counter()
+        self._due = {}
+        self._failures = {}
+        self._unhealthy = set(self.router.lookup_unhealthy())
+        self._changes = {}
+
+    async def run_async(self):
+        """
+        Probes the targets as they are due and writes the health changes,
+        while the lock is held.
+        """
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def redis_call(function, *args):
+            return loop.run_in_executor(self._executor, function, *args)
+
+        await redis_call(self._reset)
+
+        while await redis_call(self._hold_lock):
+            changed = await redis_call(self._read_changes)
+            now = loop.time()
+            self._refresh_targets(now, *changed)
+
+            for target, due in self._due.items():
+                if due <= now and target not in self._in_flight:
+                    self._due[target] = now + self.target_interval(target)
+                    self._in_flight.add(target)
+                    loop.create_task(self._check(target, semaphore))
+
+            changes, self._changes = self._changes, {}
+            if changes:
+                await redis_call(self.router.set_health, changes)
+
+            await asyncio.sleep(self.TICK)
+
+    def run(self):
+        """
+        Checks the targets whenever the lock can be acquired, until stopped.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while not self._stopped.is_set():
+            try:
+                loop.run_until_complete(self.run_async())
+            except Exception:
+                logger.exception('Health checker failed')
+            self._stopped.wait(self.RETRY_DELAY)
+        self._lock.release()
+
+    def start(self):
+        """
+        Runs the health checker in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            name='ceryx-health-checker',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops the health checker, which exits the background thread within
+        a tick, the probes in flight being abandoned.
+        """
+        self._stopped.set()
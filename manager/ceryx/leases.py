@@ -0,0 +1,143 @@
+"""
+Leases on the background jobs of the manager.
+
+The manager runs several worker processes, possibly on several hosts,
+while the route reaper, the snapshot publisher, the route discovery and the
+health checker only need to run once. Each job is started by the process
+holding its lease in Redis, which renews it every few seconds. When that
+process dies, the lease expires and another process takes the job over.
+
+A holder failing to renew its lease, for example when Redis is
+unreachable, stops its job and starts it again once the lease is won back.
+Since the lease may expire before its holder notices, the job may run in
+two processes for up to a third of the lease TTL, plus the time the job
+takes to stop. Jobs are written to stay correct when run concurrently,
+leases only saving the duplicated work.
+"""
+import logging
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+# extends the lease at KEYS[1] by ARGV[2] milliseconds if held by ARGV[1]
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# deletes the lease at KEYS[1] if held by ARGV[1]
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class Lease:
+    """
+    Lease stored in Redis at ``key``, held by a single token at a time and
+    expiring ``ttl`` seconds after its last renewal.
+    """
+
+    def __init__(self, client, key, ttl=30):
+        self.client = client
+        self.key = key
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self._renew = client.register_script(RENEW_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+
+    def hold(self):
+        """
+        Acquires or renews the lease, returning whether it is held. The
+        lease is only renewed if still held by this token, in a single
+        script run, so that a lease just taken over is never extended.
+        """
+        ttl = int(self.ttl * 1000)
+        if self.client.set(self.key, self.token, nx=True, px=ttl):
+            return True
+        return bool(self._renew(keys=[self.key], args=[self.token, ttl]))
+
+    def release(self):
+        """Releases the lease, if held"""
+        self._release(keys=[self.key], args=[self.token])
+
+
+class LeasedJob:
+    """
+    Starts a job, calling ``start``, once its lease is acquired, and keeps
+    renewing the lease afterwards, in a background thread. ``start``
+    returns the started job, which is stopped by calling its ``stop``
+    method when the lease is lost.
+    """
+
+    def __init__(self, name, lease, start):
+        self.name = name
+        self.lease = lease
+        self.start_job = start
+        self.job = None
+        self.started = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _stop_job(self):
+        job, self.job = self.job, None
+        self.started.clear()
+        if job is not None:
+            job.stop()
+
+    def run(self):
+        """
+        Waits for the lease and starts the job, renewing the lease and
+        stopping the job whenever the lease is lost, until stopped.
+        """
+        while not self._stopped.is_set():
+            try:
+                held = self.lease.hold()
+            except Exception:
+                logger.exception('Failed to renew the lease of %s', self.name)
+                held = False
+
+            try:
+                if held and self.job is None:
+                    logger.info('Starting %s', self.name)
+                    self.job = self.start_job()
+                    self.started.set()
+                elif not held and self.job is not None:
+                    logger.warning('Lost the lease of %s, stopping it', self.name)
+                    self._stop_job()
+            except Exception:
+                logger.exception('Failed to start or stop %s', self.name)
+
+            self._stopped.wait(self.lease.ttl / 3)
+
+        try:
+            self._stop_job()
+            self.lease.release()
+        except Exception:
+            logger.exception('Failed to stop %s', self.name)
+
+    def start(self):
+        """
+        Runs the job lease in a background thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run,
+                                            name=f'ceryx-lease-{self.name}',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops the job and releases its lease, waiting for ``timeout``
+        seconds at most.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
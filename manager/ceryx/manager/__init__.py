@@ -1,12 +1,25 @@
 """
 Package containig the classes related to the Manager of Ceryx.
+
+The Docker and Redis clients are created on first use in every process,
+so that importing the application is cheap and connections, threads and
+caches are never shared by the workers forked by the server.
 """
-from flask import Flask
+import os
+import threading
+import time
+
+from flask import Flask, Response, abort, g, request
 from flask_login import LoginManager
 from whitenoise import WhiteNoise
 
+from ceryx import metrics, settings
 from ceryx.docker import DockerService
-from ceryx.db import RedisRouter, RedisUsers
+from ceryx.db import RedisRouter, RedisStats, RedisUsers, RouteReaper, SnapshotPublisher
+from ceryx.discovery import LabelReconciler
+from ceryx.health import HealthChecker
+from ceryx.leases import Lease, LeasedJob
+from ceryx.orphans import OrphanIndex
 
 app = Flask(__name__)
 app.config.from_object('ceryx.settings')
@@ -21,8 +34,147 @@ def load_user(user_id):
     from ceryx.manager.models import User
     return User.get(user_id)
 
-docker_api = DockerService.from_config()
-router = RedisRouter.from_config()
-users = RedisUsers.from_config()
+@login_manager.request_loader
+def load_user_from_request(request):
+    """Authenticates API clients using HTTP Basic authentication"""
+    from ceryx.manager.models import User
+    auth = request.authorization
+    if not auth or not auth.username:
+        return None
+    try:
+        return User.login(auth.username, auth.password or '')
+    except RedisUsers.Busy:
+        # the credentials may be valid, the client should retry
+        abort(Response('{"error": "busy"}\n', status=503,
+                       mimetype='application/json',
+                       headers={'Retry-After': '1'}))
+
+
+class ProcessLocal:
+    """
+    Proxy to an object created by ``factory`` on first use in every
+    process.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._instance = None
+
+    def _get(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._instance = self._factory()
+                    self._pid = os.getpid()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+def _create_docker_api():
+    docker_api = DockerService.from_config()
+    docker_api.add_listener(orphans.on_service_change)
+    return docker_api
+
+
+docker_api = ProcessLocal(_create_docker_api)
+router = ProcessLocal(RedisRouter.from_config)
+users = ProcessLocal(RedisUsers.from_config)
+stats = ProcessLocal(RedisStats.from_config)
+orphans = ProcessLocal(OrphanIndex)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_started,
+                                 endpoint=endpoint, method=request.method,
+                                 status=response.status_code)
+    metrics.finish_request(endpoint)
+    return response
+
+
+def ensure_indexes():
+    """
+    Rebuilds the indexes if they are missing or outdated, unless another
+    worker holds the lease of the rebuild, which is renewed after every
+    chunk of hosts.
+    """
+    lease = Lease(router.client, router._prefixed_key('lease:indexes'))
+    if not lease.hold():
+        return
+    try:
+        router.ensure_indexes(on_chunk=lease.hold)
+    finally:
+        lease.release()
+
+
+def _start_snapshot_publisher():
+    publisher = SnapshotPublisher.from_config(router)
+    publisher.start()
+    return publisher
+
+
+def _start_route_reaper():
+    reaper = RouteReaper.from_config(router)
+    reaper.add_listener(orphans.on_route_change)
+    reaper.start()
+    return reaper
+
+
+def _start_discovery():
+    reconciler = LabelReconciler.from_config(docker_api, router)
+    reconciler.add_listener(orphans.on_route_change)
+    reconciler.start()
+    return reconciler
+
+
+def _start_health_checker():
+    checker = HealthChecker.from_config(router)
+    checker.start()
+    return checker
+
+
+def start_background_jobs():
+    """
+    Starts the background jobs enabled in settings. Every job runs in a
+    single process among the workers of every manager, the one holding its
+    lease (see ``ceryx.leases``) and stopping it when the lease is lost,
+    so this is called by every worker after the fork, with the
+    ``post_fork`` hook of gunicorn. The indexes are rebuilt if needed in the
+    background as well, see ``ensure_indexes``.
+    """
+    jobs = {'route-reaper': _start_route_reaper}
+    if settings.SNAPSHOT_PUBLISH:
+        jobs['snapshot-publisher'] = _start_snapshot_publisher
+    if settings.DISCOVERY:
+        jobs['discovery'] = _start_discovery
+    if settings.HEALTH_CHECKS:
+        jobs['health-checker'] = _start_health_checker
+
+    for name, start in jobs.items():
+        lease = Lease(router.client, router._prefixed_key(f'lease:{name}'))
+        LeasedJob(name, lease, start).start()
+
+    threading.Thread(target=ensure_indexes, name='ceryx-indexes', daemon=True).start()
+
+
+def get_app():
+    """
+    Returns the manager application of the process, to be served by a WSGI
+    server, for example ``gunicorn 'ceryx.manager:get_app()'``. The
+    background jobs are not started, see ``start_background_jobs``.
+    """
+    return app
+
 
-from ceryx.manager import views
+from ceryx.manager import views, api
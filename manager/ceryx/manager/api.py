@@ -0,0 +1,232 @@
+"""
+JSON API of the manager.
+
+Responses carry strong ETags derived from the route table generation kept
+by ``RedisRouter``, so polling clients sending ``If-None-Match`` get a 304
+without the route table being read.
+"""
+import functools
+import hashlib
+import threading
+
+from flask import abort, jsonify, request, Response
+from flask_login import current_user
+
+from ceryx.simulation import Simulator
+from . import app, docker_api, load_user_from_request, router
+from .models import Route, Service
+
+MAX_PER_PAGE = 1000
+MAX_SIMULATED_URLS = 100000
+
+_simulator = None
+_simulator_lock = threading.Lock()
+
+
+def api_login_required(func):
+    """
+    Same as ``login_required``, answering 401 instead of redirecting to
+    the login page.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return Response('{"error": "unauthorized"}\n', status=401,
+                            mimetype='application/json',
+                            headers={'WWW-Authenticate': 'Basic realm="ceryx"'})
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def basic_auth_required(func):
+    """
+    Same as ``api_login_required``, accepting HTTP Basic authentication
+    only. Session cookies are sent along with requests forged by any page
+    the user visits, so they are not enough to authorize the endpoints
+    taking a request body the forms CSRF token can not be checked in.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not request.authorization or load_user_from_request(request) is None:
+            return Response('{"error": "unauthorized"}\n', status=401,
+                            mimetype='application/json',
+                            headers={'WWW-Authenticate': 'Basic realm="ceryx"'})
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def _etag(*parts):
+    """
+    Returns an ETag for the given parts and the query string, which selects
+    the representation.
+    """
+    digest = hashlib.sha1(request.query_string).hexdigest()[:16]
+    return '-'.join(str(p) for p in parts) + '-' + digest
+
+
+def _not_modified(etag):
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def _json(etag, **data):
+    response = jsonify(**data)
+    response.set_etag(etag)
+    return response
+
+
+def _pagination():
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', 100, type=int)
+    return page, min(max(per_page, 1), MAX_PER_PAGE)
+
+
+@app.route('/api/routes', methods=['GET'])
+@api_login_required
+def api_list_routes():
+    """
+    Lists routes by host. ``host`` filters hosts by prefix, ``target`` keeps
+    only the paths pointing to the given service and ``page``/``per_page``
+    paginate the hosts, ``total`` counting the hosts left by the filters.
+    ``target`` and ``port`` are the ones of the first of the weighted
+    ``targets``.
+    """
+    generation = router.generation()
+    # orphan flags depend on the services as well
+    etag = _etag('routes', generation, docker_api.fingerprint())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    host = request.args.get('host') or None
+    target = request.args.get('target') or None
+    page, per_page = _pagination()
+
+    routes, total = Route.page(host, page, per_page, target)
+
+    items = []
+    for route in routes:
+        paths = [
+            {
+                'path': p.path,
+                'target': p.target,
+                'port': int(p.port),
+                'is_orphan': p.is_orphan,
+                'targets': [{'target': t.service, 'port': t.port, 'weight': t.weight}
+                            for t in p.targets],
+                'policy': p.policy,
+                'expires_at': p.deadline,
+            }
+            for p in route.paths
+        ]
+        items.append({'host': route.host, 'paths': paths})
+
+    return _json(etag, generation=generation, page=page, per_page=per_page,
+                 total=total, routes=items)
+
+
+@app.route('/api/routes/<host>', methods=['GET'])
+@api_login_required
+def api_get_route(host):
+    generation = router.generation(host)
+    etag = _etag('host', host, generation)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    paths = router.lookup_paths(host)
+    if not paths:
+        abort(404)
+
+    return _json(etag, host=host, generation=generation, paths=paths)
+
+
+@app.route('/api/services', methods=['GET'])
+@api_login_required
+def api_list_services():
+    """
+    Lists the services in the proxy network. ``name`` filters services by
+    prefix and ``page``/``per_page`` paginate them.
+    """
+    services = sorted(Service.all(), key=lambda s: s.name)
+
+    name = request.args.get('name')
+    if name:
+        services = [s for s in services if s.name.startswith(name)]
+
+    fingerprint = hashlib.sha1(
+        '\n'.join(f'{s.name} {s.image}' for s in services).encode()
+    ).hexdigest()[:16]
+    etag = _etag('services', fingerprint)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    page, per_page = _pagination()
+    offset = (page - 1) * per_page
+    items = [{'name': s.name, 'image': s.image}
+             for s in services[offset:offset + per_page]]
+
+    return _json(etag, page=page, per_page=per_page, total=len(services),
+                 services=items)
+
+
+def _current_simulator():
+    """
+    Returns a ``Simulator`` of the route table, built again only when the
+    route table changed.
+    """
+    global _simulator
+    with _simulator_lock:
+        if _simulator is None or _simulator.snapshot.version != router.generation():
+            _simulator = Simulator(router.build_snapshot())
+        return _simulator
+
+
+@app.route('/api/simulate', methods=['POST'])
+@api_login_required
+def api_simulate():
+    """
+    Resolves a list of URLs as the proxy would, given as a JSON ``urls``
+    list or as plain text, one URL per line. With ``summary`` set, only the
+    summary is returned.
+    """
+    data = request.get_json(silent=True)
+    if data is not None:
+        urls = data.get('urls') if isinstance(data, dict) else None
+        if not isinstance(urls, list) or not all(isinstance(u, str) for u in urls):
+            abort(400)
+    else:
+        urls = request.get_data(as_text=True).splitlines()
+
+    if len(urls) > MAX_SIMULATED_URLS:
+        abort(413)
+
+    simulator = _current_simulator()
+    results = list(simulator.simulate_many(urls))
+    response = {'version': simulator.snapshot.version,
+                'summary': simulator.summary(results)}
+    if not request.args.get('summary', type=int):
+        response['results'] = results
+
+    return jsonify(**response)
+
+
+@app.route('/api/conflicts', methods=['GET'])
+@api_login_required
+def api_conflicts():
+    """
+    Lists the route paths which are never matched and the ones partly
+    shadowed by deeper paths.
+    """
+    etag = _etag('conflicts', router.generation())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    simulator = _current_simulator()
+    return _json(etag, version=simulator.snapshot.version,
+                 **simulator.conflicts())
@@ -2,6 +2,10 @@ from flask_wtf import FlaskForm
 import wtforms as wtf
 from wtforms import validators as val
 
+from ceryx import caching, ratelimit, targets
+from ceryx.caching import CachePolicy
+from ceryx.ratelimit import RateLimit
+from ceryx.targets import Target
 from . import router, docker_api
 from .models import Route
 
@@ -24,6 +28,40 @@ class RouteForm(FlaskForm):
     port = wtf.IntegerField('Port',
                             validators=_route_port_validators,
                             default=Route.DEFAULT_PORT)
+    weight = wtf.IntegerField('Weight',
+                              validators=[
+                                  val.InputRequired(),
+                                  val.NumberRange(min=0, max=targets.MAX_WEIGHT,
+                                                  message='Invalid weight'),
+                              ],
+                              default=1)
+    other_targets = wtf.TextAreaField(
+        'Other Targets',
+        description='One "service[:port]=weight" per line, requests being '
+                    'spread over the targets in proportion of their weights')
+    expires_in = wtf.IntegerField(
+        'Lifetime (seconds)',
+        [val.Optional(), val.NumberRange(min=1, message='Invalid lifetime')],
+        description='Leave empty to keep the route until it is deleted')
+    rate_limit = wtf.FloatField(
+        'Requests per Second', [val.Optional()],
+        description='Leave empty to not limit the requests of the route')
+    rate_limit_burst = wtf.IntegerField('Burst', [val.Optional()],
+                                        description='Defaults to the rate')
+    rate_limit_per = wtf.SelectField('Limit',
+                                     choices=[(ratelimit.PER_ROUTE, 'Per route'),
+                                              (ratelimit.PER_CLIENT, 'Per client')],
+                                     default=ratelimit.PER_ROUTE)
+    cache_ttl = wtf.IntegerField(
+        'Cache TTL (seconds)', [val.Optional()],
+        description='Leave empty to not cache the responses of the route')
+    cache_key = wtf.StringField(
+        'Cache Key', default=','.join(caching.DEFAULT_KEY),
+        description='Comma separated request components among scheme, host, '
+                    'path, args, header:<name> and cookie:<name>')
+    cache_bypass = wtf.StringField(
+        'Bypass Headers', default=','.join(caching.DEFAULT_BYPASS),
+        description='Comma separated request headers skipping the cache')
 
     def validate_source(self, field):
         source = field.data
@@ -36,6 +74,58 @@ class RouteForm(FlaskForm):
         if not docker_api.has_service(field.data):
             raise val.ValidationError('Service does not exist')
 
+    def validate_other_targets(self, field):
+        try:
+            others = self._other_targets()
+        except targets.InvalidTargets as e:
+            raise val.ValidationError(str(e))
+
+        for target in others:
+            if not docker_api.has_service(target.service):
+                raise val.ValidationError(f'Service "{target.service}" does not exist')
+
+        if self.weight.data == 0 and not any(t.weight for t in others):
+            raise val.ValidationError('At least one target must have a weight')
+
+    def validate_rate_limit(self, field):
+        if field.data is None:
+            return
+        try:
+            RateLimit.create(field.data, self.rate_limit_burst.data,
+                             self.rate_limit_per.data)
+        except ratelimit.InvalidRateLimit as e:
+            raise val.ValidationError(str(e))
+
+    def validate_cache_ttl(self, field):
+        if field.data is None:
+            return
+        try:
+            CachePolicy.create(field.data, self.cache_key.data, self.cache_bypass.data)
+        except caching.InvalidCachePolicy as e:
+            raise val.ValidationError(str(e))
+
+    def policy(self):
+        """Returns the policy of the route"""
+        policy = {}
+        if self.rate_limit.data is not None:
+            limit = RateLimit.create(self.rate_limit.data, self.rate_limit_burst.data,
+                                     self.rate_limit_per.data)
+            policy['rate_limit'] = limit.to_policy()
+        if self.cache_ttl.data is not None:
+            cache = CachePolicy.create(self.cache_ttl.data, self.cache_key.data,
+                                       self.cache_bypass.data)
+            policy['cache'] = cache.to_policy()
+        return policy
+
+    def _other_targets(self):
+        lines = (self.other_targets.data or '').splitlines()
+        return [targets.parse_item(line) for line in lines if line.strip()]
+
+    def weighted_targets(self):
+        """Returns the weighted targets of the route"""
+        first = Target.create(self.target.data, self.port.data, self.weight.data)
+        return [first] + self._other_targets()
+
 
 class RouteDeleteForm(FlaskForm):
     host = wtf.StringField('Host', [val.InputRequired()])
@@ -1,8 +1,30 @@
-import re
+import time
 
 import flask_login
 
-from ceryx.manager import router, users, docker_api
+from ceryx import settings, targets
+from ceryx.manager import router, users, docker_api, orphans
+from ceryx.caching import CachePolicy
+from ceryx.orphans import OrphanIndex
+from ceryx.ratelimit import RateLimit
+from ceryx.targets import Target
+
+
+def _service_names():
+    return [s.name for s in docker_api.services()]
+
+
+def _orphan_index():
+    """
+    Returns the orphan routes index, (re)loading it from Redis and Docker
+    if it is stale. The changes made by every process are applied
+    incrementally, see ``OrphanIndex.follow``, the full reload being a
+    fallback.
+    """
+    if orphans.is_stale(settings.ORPHAN_INDEX_TTL):
+        orphans.load(_service_names(), router.iter_routes())
+    orphans.follow(router, _service_names)
+    return orphans
 
 
 class User(flask_login.UserMixin):
@@ -19,15 +41,14 @@ class User(flask_login.UserMixin):
 
     @staticmethod
     def get(username):
-        u = users.lookup(username)
-        if not u:
+        if not users.exists(username):
             return None
 
-        return User(u[0])
+        return User(username)
 
     @staticmethod
     def all():
-        for user in users.lookup():
+        for user in users.iter_users():
             yield User(user)
     
     @staticmethod
@@ -45,44 +66,82 @@ class User(flask_login.UserMixin):
 
 
 class RouteMapping:
+    """
+    A path of a route, along with its targets and policy. ``target`` and
+    ``port`` are the ones of the first target, ``targets`` the list of
+    weighted ``Target`` the requests are spread over. ``deadline`` is the
+    unix time an expiring path is deleted at.
+    """
     DEFAULT_PATH = '/'
     DEFAULT_PORT = 80
 
-    def __init__(self, route, path, target, port, is_orphan=False):
+    def __init__(self, route, path, target, port, is_orphan=False, weighted=None,
+                 policy=None, deadline=None):
         self.route = route
         self.path = path
         self.target = target
         self.port = port
         self.is_orphan = is_orphan
+        self.targets = weighted or [Target.create(target, port)]
+        self.policy = policy or {}
+        self.deadline = deadline
+
+    @property
+    def rate_limit(self):
+        return RateLimit.from_policy(self.policy)
+
+    @property
+    def cache(self):
+        return CachePolicy.from_policy(self.policy)
+
+    @property
+    def expires_in(self):
+        """The seconds left before the path is deleted, or None"""
+        if self.deadline is None:
+            return None
+        return max(int(self.deadline - time.time()), 0)
 
-    @staticmethod
-    def _is_orphan(target, services):
-        for s in services:
-            if re.match(s.name + r'(:\d+?)?$', target):
-                return False
-        return True
+    @property
+    def is_weighted(self):
+        return len(self.targets) > 1
+
+    @property
+    def value(self):
+        """The targets as stored in Redis"""
+        return targets.serialize(self.targets)
 
     @staticmethod
-    def parse(services, route, path, target):
-        target_port = target.split(':')
-        target = target_port[0]
-        port = Route.DEFAULT_PORT if len(target_port) < 2 else target_port[1]
+    def _is_orphan(target):
+        services = OrphanIndex.target_services(target)
+        return not all(docker_api.has_service(s) for s in services)
 
-        is_orphan = RouteMapping._is_orphan(route, services)
+    @staticmethod
+    def parse(route, path, target, policy=None, deadline=None):
+        is_orphan = RouteMapping._is_orphan(target)
+        weighted = targets.parse(target)
+        first = weighted[0]
 
-        return RouteMapping(route, path, target, port)
+        return RouteMapping(route, path, first.service, first.port, is_orphan,
+                            weighted, policy, deadline)
 
-    def update(self, path, target, port):
+    def update(self, path, target, port, weighted=None, policy=None):
         if isinstance(port, str):
             port = int(port)
-        
-        if port is not None and port != Route.DEFAULT_PORT:
-            target = f'{target}:{port}'
-        
-        router.update_path(self.route.host, path, target)
+
+        if port is None:
+            port = Route.DEFAULT_PORT
+        weighted = weighted or [Target.create(target, port)]
+        value = targets.serialize(weighted)
+
+        router.update_path(self.route.host, self.path, path, value, policy)
+        orphans.remove_route(self.route.host, self.path)
+        orphans.set_route(self.route.host, path, value)
         self.path = path
         self.target = target
         self.port = port
+        self.targets = weighted
+        if policy is not None:
+            self.policy = policy
 
 
 class Route:
@@ -95,6 +154,7 @@ class Route:
     
     def update(self, host):
         router.update_host(self.host, host)
+        orphans.rename_host(self.host, host)
         self.host = host
 
     @staticmethod
@@ -112,31 +172,91 @@ class Route:
         return Route(source, path, target, port, is_orphan)
 
     @staticmethod
-    def all():
-        services = docker_api.services()
-        routes = router.lookup_routes('*')
+    def _from_paths(host, paths, policies=None, deadlines=None):
+        policies = policies or {}
+        deadlines = deadlines or {}
+        paths = [RouteMapping.parse(host, p, t, policies.get(p), deadlines.get(p))
+                 for p, t in paths.items()]
+        paths = sorted(paths, key=lambda p: p.path + p.target)
+        return Route(host, paths)
 
-        route_list = []
-        for r in routes:
-            host = r['host']
-            paths = [RouteMapping.parse(services, host, p, t) for p, t in r['paths'].items()]
-            paths = sorted(paths, key=lambda p: p.path + p.target)
-            route_list.append(Route(host, paths))
-
-        return sorted(route_list, key=lambda r: r.host)
+    @staticmethod
+    def all():
+        for r in router.iter_routes():
+            yield Route._from_paths(r['host'], r['paths'])
 
     @staticmethod
-    def add(route):
-        source = route.host
-        if route.path is not None:
-            source = f'{source}:{route.path}'
+    def _page_by_target(search, target, offset, per_page):
+        """
+        Returns the paths of the page of hosts having a path pointing to the
+        ``target`` service, and the total number of such hosts. The host
+        index is walked in chunks, each costing a single round trip.
+        """
+        chunk_size = settings.REDIS_CHUNK_SIZE
+        page, total, start = [], 0, 0
+        while True:
+            hosts = router.lookup_hosts_page(search, start, chunk_size)
+            for host, paths in zip(hosts, router.lookup_paths_many(hosts)):
+                paths = {p: t for p, t in paths.items()
+                         if target in targets.services(t)}
+                if not paths:
+                    continue
+                if offset <= total < offset + per_page:
+                    page.append((host, paths))
+                total += 1
+            if len(hosts) < chunk_size:
+                return page, total
+            start += chunk_size
 
-        if route.port != Route.DEFAULT_PORT:
-            target = f'{route.target}:{route.port}'
+    @staticmethod
+    def page(search=None, page=1, per_page=50, target=None):
+        """
+        Returns a page of routes, ordered by host, with host starting with
+        ``search`` and the total number of such hosts. With ``target``, only
+        the hosts and paths pointing to the given service are returned.
+        """
+        offset = (page - 1) * per_page
+        if target is None:
+            hosts = router.lookup_hosts_page(search, offset, per_page)
+            total = router.count_hosts(search)
+            paths_many = router.lookup_paths_many(hosts)
         else:
-            target = route.target
+            found, total = Route._page_by_target(search, target, offset, per_page)
+            hosts = [host for host, _ in found]
+            paths_many = [paths for _, paths in found]
 
-        router.insert(source, target)
+        routes = [Route._from_paths(host, paths, policies, deadlines)
+                  for host, paths, policies, deadlines in zip(
+                      hosts, paths_many,
+                      router.lookup_policies_many(hosts),
+                      router.lookup_deadlines_many(hosts))
+                  if paths]
+
+        return routes, total
+
+    @staticmethod
+    def orphans():
+        """
+        Returns the orphan routes report, see ``OrphanIndex.report``.
+        """
+        report = _orphan_index().report()
+        report['routes'] = [{'host': host, 'path': path, 'target': target}
+                            for host, path, target in report['routes']]
+        return report
+
+    @staticmethod
+    def add(mapping, expires_in=None):
+        """
+        Adds the path of a ``RouteMapping`` to its route, failing if the
+        path exists. The path is deleted after ``expires_in`` seconds, if
+        given.
+        """
+        host = mapping.route.host
+        path = mapping.path if mapping.path is not None else Route.DEFAULT_PATH
+
+        router.insert(host, path, mapping.value, overwrite=False,
+                      policy=mapping.policy, expires_in=expires_in)
+        orphans.set_route(host, path, mapping.value)
 
     @staticmethod
     def get(host, path):
@@ -153,9 +273,17 @@ class Route:
 
     @staticmethod
     def delete(route):
+        """
+        Deletes every path of a ``Route``, or the path of a "host:path"
+        string.
+        """
         if isinstance(route, Route):
-            route = f'{route.host}:{route.path}'
-        router.delete(route)
+            sources = [(route.host, mapping.path) for mapping in route.paths]
+        else:
+            sources = [route.split(':', 1)]
+        for host, path in sources:
+            router.delete_path(host, path)
+            orphans.remove_route(host, path)
 
     class NotFound(Exception):
         pass
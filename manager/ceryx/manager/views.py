@@ -1,11 +1,36 @@
 import json
+import time
 
-from flask import abort, flash, redirect, request, render_template, url_for
+import flask
+from flask import (abort, flash, redirect, request,
+                   stream_with_context, url_for, Response)
 from flask_login import login_required, login_user, logout_user
 
-from . import app, users, router
+from ceryx import metrics, settings, transfer
+from ceryx.db import RedisUsers
+from . import app, users, router, stats
+from .api import api_login_required, basic_auth_required
 from .forms import RouteForm, RouteDeleteForm, LoginForm, UserAddForm, UserEditForm
-from .models import User, Route, Service
+from .models import User, Route, RouteMapping, Service
+
+
+def render_template(template, **context):
+    with metrics.TEMPLATE_SECONDS.time(template=template):
+        return flask.render_template(template, **context)
+
+
+@app.template_filter('duration')
+def format_duration(seconds):
+    """Formats a number of seconds as 1d 2h, 3h 20m, 5m 10s or 42s"""
+    units = [('d', 86400), ('h', 3600), ('m', 60), ('s', 1)]
+    parts = []
+    for name, size in units:
+        if seconds >= size or (name == 's' and not parts):
+            parts.append(f'{seconds // size}{name}')
+            seconds %= size
+        if len(parts) == 2:
+            break
+    return ' '.join(parts)
 
 
 @app.errorhandler(Route.NotFound)
@@ -18,7 +43,12 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         username, password = form.username.data, form.password.data
-        user = User.login(username, password)
+        try:
+            user = User.login(username, password)
+        except RedisUsers.Busy:
+            flash('Too many login attempts, please try again', 'error')
+            return render_template('login.html', form=form), 503
+
         if user:
             login_user(user)
             return redirect(url_for('list_routes'))
@@ -42,6 +72,17 @@ def list_services():
     return render_template('services/list.html', services=services)
 
 
+@app.route('/metrics', methods=['GET'])
+@api_login_required
+def metrics_endpoint():
+    """
+    Renders the metrics for Prometheus, which authenticates with HTTP Basic
+    authentication (``basic_auth`` in its scrape config).
+    """
+    return Response(metrics.registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/', methods=['GET'])
 def index_redirect():
     return redirect(url_for('list_routes'))
@@ -50,16 +91,93 @@ def index_redirect():
 @app.route('/routes', methods=['GET'])
 @login_required
 def list_routes():
-    routes = Route.all()
-    return render_template('routes/list.html', routes=routes)
+    search = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = settings.ROUTES_PER_PAGE
+
+    routes, total = Route.page(search, page, per_page)
+    pages = max((total + per_page - 1) // per_page, 1)
+
+    return render_template('routes/list.html', routes=routes, search=search,
+                           page=page, pages=pages, total=total)
 
 
 @app.route('/routes/orphaned')
 @login_required
 def orphaned_routes():
-    routes = Route.all()
-    orphaned = [r for r in routes if r.is_orphan]
-    return render_template('routes/orphaned.html', routes=orphaned)
+    report = Route.orphans()
+    return render_template('routes/orphaned.html', routes=report['routes'],
+                           count=report['count'],
+                           by_service=report['by_service'])
+
+
+STATS_WINDOWS = [('1h', 3600), ('6h', 6 * 3600), ('24h', 24 * 3600)]
+
+
+@app.route('/stats', methods=['GET'])
+@login_required
+def route_stats():
+    window = request.args.get('window', '1h')
+    seconds = dict(STATS_WINDOWS).get(window)
+    if seconds is None:
+        abort(404)
+
+    end = time.time()
+    start = end - seconds
+    top = stats.top_routes(start, end, settings.STATS_TOP_ROUTES)
+    clients = stats.distinct_clients_many([(h, p) for h, p, _ in top], start, end)
+    series = [{'time': time.strftime('%H:%M', time.localtime(ts)),
+               'hits': hits, 'clients': series_clients}
+              for ts, hits, series_clients in stats.series(start, end)]
+    total = sum(point['hits'] for point in series)
+
+    routes = [{'host': host, 'path': path, 'hits': hits, 'clients': route_clients,
+               'share': hits / total if total else 0}
+              for (host, path, hits), route_clients in zip(top, clients)]
+
+    return render_template('routes/stats.html', window=window,
+                           windows=STATS_WINDOWS, routes=routes, total=total,
+                           clients=stats.distinct_clients(start, end),
+                           series=series,
+                           peak=max(point['hits'] for point in series))
+
+
+@app.route('/routes/export', methods=['GET'])
+@login_required
+def export_routes():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in transfer.FORMATS:
+        abort(400)
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    lines = transfer.export_routes(router, request.args.get('q'), fmt)
+    return Response(stream_with_context(lines), mimetype=mimetype)
+
+
+@app.route('/routes/import', methods=['POST'])
+@basic_auth_required
+def import_routes():
+    dry_run = request.args.get('dry_run', '').lower() in ['1', 'yes', 'true']
+    chunk_size = request.args.get('chunk_size', type=int)
+
+    if request.is_json:
+        parsed = transfer.parse_json_routes(request.stream)
+    else:
+        parsed = transfer.parse_routes(request.stream)
+    reports = transfer.import_routes(router, parsed, chunk_size, dry_run)
+
+    def body():
+        # the reports are sent as they are produced, the summary last
+        summary = {'added': 0, 'changed': 0, 'unchanged': 0, 'errors': 0}
+        yield f'{{"dry_run": {json.dumps(dry_run)}, "chunks": [\n'
+        for index, report in enumerate(reports):
+            for key in ('added', 'changed', 'unchanged'):
+                summary[key] += report[key]
+            summary['errors'] += len(report['errors'])
+            yield (',\n' if index else '') + json.dumps(report)
+        yield f'\n], "summary": {json.dumps(summary)}}}\n'
+
+    return Response(stream_with_context(body()), mimetype='application/json')
 
 
 @app.route('/routes/new', methods=['GET', 'POST'])
@@ -70,18 +188,20 @@ def route_add():
     form.target.choices = [(s.name, s.name) for s in services]
 
     if form.validate_on_submit():
-        route = Route(form.host.data,
-                      form.path.data,
-                      form.target.data,
-                      form.port.data)
+        route = RouteMapping(Route(form.host.data, []),
+                             form.path.data,
+                             form.target.data,
+                             form.port.data,
+                             weighted=form.weighted_targets(),
+                             policy=form.policy())
 
         try:
-            Route.add(route)
-            flash(f'Route "{route.host}{route.path}" added', 'success')
+            Route.add(route, expires_in=form.expires_in.data)
+            flash(f'Route "{route.route.host}{route.path}" added', 'success')
             return redirect(url_for('list_routes'))
         except Exception as e:
             app.logger.error(e)
-            flash(f'Failed to add route "{route.host}{route.path}"')
+            flash(f'Failed to add route "{route.route.host}{route.path}"')
 
     return render_template('routes/new.html', form=form)
 
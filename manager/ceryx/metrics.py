@@ -0,0 +1,234 @@
+"""
+Low overhead in-process metrics, rendered in the Prometheus text format.
+
+Besides latency histograms and counters, the number of round trips made
+to each backend (Redis, Docker) is counted per web request, so that N+1
+access patterns show up in ``ceryx_request_roundtrips``.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10)
+ROUNDTRIP_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """
+    Monotonic counter, with one value per combination of labels.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """
+    Cumulative histogram, with one set of buckets per combination of
+    labels.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the time spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self._values.items()}
+
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, ('le', bound))
+                yield f'{self.name}_bucket{labels}', cumulative
+            labels = _format_labels(self.labels, key)
+            yield f'{self.name}_sum{labels}', total
+            yield f'{self.name}_count{labels}', cumulative
+
+
+class Registry:
+    """
+    Collection of metrics rendered together.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, value in metric.samples():
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CALL_SECONDS = registry.register(Histogram(
+    'ceryx_call_seconds', 'Latency of the data layer calls',
+    ['component', 'method']))
+CALL_ERRORS = registry.register(Counter(
+    'ceryx_call_errors_total', 'Data layer calls that raised an exception',
+    ['component', 'method']))
+REDIS_SECONDS = registry.register(Histogram(
+    'ceryx_redis_roundtrip_seconds', 'Latency of the Redis round trips',
+    ['command']))
+DOCKER_SECONDS = registry.register(Histogram(
+    'ceryx_docker_api_seconds', 'Latency of the Docker API calls',
+    ['call']))
+HTTP_SECONDS = registry.register(Histogram(
+    'ceryx_http_request_seconds', 'Latency of the manager web requests',
+    ['endpoint', 'method', 'status']))
+TEMPLATE_SECONDS = registry.register(Histogram(
+    'ceryx_template_render_seconds', 'Latency of the template rendering',
+    ['template']))
+REQUEST_ROUNDTRIPS = registry.register(Histogram(
+    'ceryx_request_roundtrips', 'Backend round trips made per web request',
+    ['endpoint', 'backend'], buckets=ROUNDTRIP_BUCKETS))
+
+_request = threading.local()
+
+
+def start_request():
+    """Starts counting the round trips of the current web request"""
+    _request.roundtrips = {'redis': 0, 'docker': 0}
+
+
+def finish_request(endpoint):
+    """Observes the round trips counted since ``start_request``"""
+    roundtrips = getattr(_request, 'roundtrips', None)
+    if roundtrips is None:
+        return
+    _request.roundtrips = None
+    for backend, count in roundtrips.items():
+        REQUEST_ROUNDTRIPS.observe(count, endpoint=endpoint, backend=backend)
+
+
+def count_roundtrip(backend):
+    roundtrips = getattr(_request, 'roundtrips', None)
+    if roundtrips is not None:
+        roundtrips[backend] += 1
+
+
+@contextmanager
+def redis_roundtrip(command):
+    """Times a Redis round trip and counts it for the current request"""
+    count_roundtrip('redis')
+    with REDIS_SECONDS.time(command=command):
+        yield
+
+
+@contextmanager
+def docker_call(call):
+    """Times a Docker API call and counts it for the current request"""
+    count_roundtrip('docker')
+    with DOCKER_SECONDS.time(call=call):
+        yield
+
+
+def _timed(func, component):
+    method = func.__name__
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from func(*args, **kwargs)
+            except Exception:
+                CALL_ERRORS.inc(component=component, method=method)
+                raise
+            finally:
+                CALL_SECONDS.observe(time.perf_counter() - start,
+                                     component=component, method=method)
+        return wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            CALL_ERRORS.inc(component=component, method=method)
+            raise
+        finally:
+            CALL_SECONDS.observe(time.perf_counter() - start,
+                                 component=component, method=method)
+    return wrapper
+
+
+def instrumented(component):
+    """
+    Class decorator timing every public method, generators being timed
+    until they are exhausted.
+    """
+    def decorate(cls):
+        for name, value in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(value):
+                continue
+            setattr(cls, name, _timed(value, component))
+        return cls
+    return decorate
@@ -0,0 +1,177 @@
+"""
+Online migration of the legacy string route keys to the hash layout.
+
+Routes used to be string keys holding their target, ``routes:<host>`` for
+the "/" path of a host and ``routes:<host>:<path>`` for the other paths.
+``RedisRouter`` and the proxy only read the per host hashes, so legacy
+routes are ignored until migrated.
+
+The migration walks the ``routes:*`` keys with SCAN, one batch at a time,
+each batch being rewritten by a single run of the ``migrate_legacy.lua``
+script, which also stores the SCAN cursor in a checkpoint hash. An
+interrupted migration resumes at the last rewritten batch, and batches are
+throttled so that the live traffic is not slowed down.
+"""
+import time
+
+from ceryx import routing, settings
+
+
+# keys listed by the verification report, the others being only counted
+MAX_REPORTED = 100
+
+
+class LegacyMigration:
+    """
+    Migration of the legacy route keys of a router, rewriting batches of
+    ``batch_size`` scanned keys and at most ``max_rate`` keys per second.
+    """
+
+    @staticmethod
+    def from_config(router):
+        return LegacyMigration(router, settings.REDIS_SCAN_COUNT)
+
+    def __init__(self, router, batch_size=1000, max_rate=5000):
+        self.router = router.primary()
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+
+        self._checkpoint_key = self.router._prefixed_key('migration:legacy')
+        self._conflicts_key = self.router._prefixed_key('migration:legacy:conflicts')
+        self._pattern = self.router._prefixed_route_key('*')
+
+    @staticmethod
+    def parse_source(source):
+        """
+        Returns the (host, path) of the ``<host>`` or ``<host>:<path>``
+        source of a legacy route key.
+        """
+        index = source.find(':/')
+        if index < 0:
+            return source, '/'
+        return source[:index], source[index + 1:]
+
+    def _source(self, key):
+        return key[len(self._pattern) - 1:]
+
+    def checkpoint(self):
+        """
+        Returns the progress of the migration, the SCAN cursor to resume at
+        and the numbers of scanned and migrated keys.
+        """
+        state = self.router.client.hgetall(self._checkpoint_key)
+        return {
+            'cursor': int(state.get('cursor', 0)),
+            'scanned': int(state.get('scanned', 0)),
+            'migrated': int(state.get('migrated', 0)),
+            'conflicting': self.router.client.scard(self._conflicts_key),
+            'done': state.get('done') == '1',
+        }
+
+    def reset(self):
+        """Forgets the progress of the migration, to run it from the start"""
+        self.router.client.delete(self._checkpoint_key, self._conflicts_key)
+
+    def migrate_batch(self, cursor, keys):
+        """
+        Rewrites the given scanned keys, ``cursor`` being the SCAN cursor
+        following them. Returns the numbers of migrated, skipped and
+        conflicting keys.
+        """
+        entries = [self.parse_source(self._source(key)) for key in keys]
+
+        script_keys = self.router._script_keys()
+        script_keys += [self._checkpoint_key, self._conflicts_key]
+        args = [self.router._invalidations_channel(), cursor]
+        for key, (host, path) in zip(keys, entries):
+            script_keys += [key] + self.router._script_keys(host)[4:]
+            args += [host, path]
+
+        return self.router.scripts.run('migrate_legacy', script_keys, args)
+
+    def _throttle(self, count, started):
+        elapsed = time.monotonic() - started
+        time.sleep(max(count / self.max_rate - elapsed, 0))
+
+    def run(self):
+        """
+        Migrates the legacy keys from the checkpoint on, yielding a report
+        per batch. Does nothing if the migration is done.
+        """
+        client = self.router.client
+        state = self.checkpoint()
+        if state['done']:
+            return
+
+        cursor = state['cursor']
+        while True:
+            started = time.monotonic()
+            cursor, keys = client.scan(cursor, match=self._pattern,
+                                       count=self.batch_size)
+            migrated, skipped, conflicting = self.migrate_batch(cursor, keys)
+
+            yield {'cursor': int(cursor), 'scanned': len(keys), 'migrated': migrated,
+                   'skipped': skipped, 'conflicting': conflicting}
+
+            if int(cursor) == 0:
+                client.hset(self._checkpoint_key, 'done', 1)
+                return
+            self._throttle(len(keys), started)
+
+    def verify(self):
+        """
+        Walks the route keys again and returns a report of the legacy keys
+        left, conflicting or not, and of the hosts missing from the host
+        index or whose paths are missing from their path index. The
+        migration succeeded if ``legacy`` and ``unindexed`` are empty.
+        """
+        client = self.router.client
+        conflicts = client.smembers(self._conflicts_key)
+        report = {'hosts': 0, 'paths': 0, 'legacy': [], 'conflicts': [],
+                  'unindexed': [], 'counts': {'legacy': 0, 'conflicts': 0,
+                                              'unindexed': 0}}
+
+        def add(kind, item):
+            report['counts'][kind] += 1
+            if len(report[kind]) < MAX_REPORTED:
+                report[kind].append(item)
+
+        cursor = None
+        while cursor != 0:
+            started = time.monotonic()
+            cursor, keys = client.scan(cursor or 0, match=self._pattern,
+                                       count=self.batch_size)
+            cursor = int(cursor)
+
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.type(key)
+            types = pipe.execute()
+
+            hosts = []
+            for key, key_type in zip(keys, types):
+                if key_type == 'string':
+                    add('conflicts' if key in conflicts else 'legacy', key)
+                elif key_type == 'hash':
+                    hosts.append(self._source(key))
+
+            pipe = client.pipeline(transaction=False)
+            for host in hosts:
+                pipe.zscore(self.router._host_index_key(), host)
+                pipe.hkeys(self.router._prefixed_route_key(host))
+                pipe.hgetall(self.router._path_index_key(host))
+            results = pipe.execute()
+
+            for i, host in enumerate(hosts):
+                score, paths, index = results[3 * i:3 * i + 3]
+                report['hosts'] += 1
+                report['paths'] += len(paths)
+                if score is None:
+                    add('unindexed', {'host': host, 'path': None})
+                for path in paths:
+                    if routing.normalize(path) not in index:
+                        add('unindexed', {'host': host, 'path': path})
+
+            self._throttle(len(keys), started)
+
+        return report
@@ -0,0 +1,206 @@
+"""
+Detection of orphan routes, that is, routes whose target service does not
+exist in the proxy network.
+"""
+import logging
+import threading
+import time
+
+from ceryx import targets
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrphanIndex:
+    """
+    Index of routes by target service, kept up to date as routes and
+    services change, so that checking a target and reporting orphans never
+    has to match every route against every service.
+    """
+    FOLLOW_RETRY_DELAY = 5
+    STOP_INTERVAL = 1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._services = set()
+        self._routes = {}
+        self._by_host = {}
+        self._by_service = {}
+        self._missing = set()
+        self._follower = None
+        self._stopped = threading.Event()
+        self.loaded_at = None
+
+    @staticmethod
+    def target_services(target):
+        """Returns the service names of the targets of a route"""
+        return set(targets.services(target))
+
+    def is_stale(self, ttl=None):
+        """Checks if the index was never loaded or is older than ``ttl``"""
+        if self.loaded_at is None:
+            return True
+        return ttl is not None and time.monotonic() - self.loaded_at > ttl
+
+    def load(self, services, routes):
+        """
+        Rebuilds the index from the service names and the routes, as given
+        by ``RedisRouter.iter_routes``.
+        """
+        with self._lock:
+            self._services = set(services)
+            self._routes = {}
+            self._by_host = {}
+            self._by_service = {}
+            self._missing = set()
+            for route in routes:
+                for path, target in route['paths'].items():
+                    self.set_route(route['host'], path, target)
+            self.loaded_at = time.monotonic()
+
+    def is_orphan(self, target):
+        """Checks if a service of the given target does not exist"""
+        return not self.target_services(target) <= self._services
+
+    def add_service(self, name):
+        with self._lock:
+            self._services.add(name)
+            self._missing.discard(name)
+
+    def remove_service(self, name):
+        with self._lock:
+            self._services.discard(name)
+            if name in self._by_service:
+                self._missing.add(name)
+
+    def on_service_change(self, name, service):
+        """Listener for ``DockerService`` changes"""
+        if service is None:
+            self.remove_service(name)
+        else:
+            self.add_service(name)
+
+    def set_route(self, host, path, target):
+        with self._lock:
+            self.remove_route(host, path)
+
+            self._routes[(host, path)] = target
+            self._by_host.setdefault(host, set()).add(path)
+            for service in self.target_services(target):
+                self._by_service.setdefault(service, set()).add((host, path))
+                if service not in self._services:
+                    self._missing.add(service)
+
+    def remove_route(self, host, path):
+        with self._lock:
+            target = self._routes.pop((host, path), None)
+            if target is None:
+                return
+
+            paths = self._by_host[host]
+            paths.discard(path)
+            if not paths:
+                del self._by_host[host]
+
+            for service in self.target_services(target):
+                routes = self._by_service[service]
+                routes.discard((host, path))
+                if not routes:
+                    del self._by_service[service]
+                    self._missing.discard(service)
+
+    def on_route_change(self, host, path, target):
+        """Listener for ``LabelReconciler`` changes"""
+        if target is None:
+            self.remove_route(host, path)
+        else:
+            self.set_route(host, path, target)
+
+    def set_host(self, host, paths):
+        """
+        Replaces the routes of a host by its ``{path: target}`` paths, as
+        given by ``RedisRouter.lookup_paths``.
+        """
+        with self._lock:
+            for path in list(self._by_host.get(host, ())):
+                if path not in paths:
+                    self.remove_route(host, path)
+            for path, target in paths.items():
+                if self._routes.get((host, path)) != target:
+                    self.set_route(host, path, target)
+
+    def remove_host(self, host):
+        with self._lock:
+            for path in list(self._by_host.get(host, ())):
+                self.remove_route(host, path)
+
+    def rename_host(self, old_host, new_host):
+        with self._lock:
+            for path in list(self._by_host.get(old_host, ())):
+                target = self._routes[(old_host, path)]
+                self.remove_route(old_host, path)
+                self.set_route(new_host, path, target)
+
+    def follow(self, router, services):
+        """
+        Keeps the index up to date with the route changes made by every
+        process, in a background thread listening to the invalidations
+        published by ``router``. The index is reloaded, ``services``
+        returning the service names, whenever the subscription is confirmed,
+        the changes made while disconnected being missed.
+        """
+        with self._lock:
+            if self._follower is not None:
+                return
+            self._stopped.clear()
+            self._follower = threading.Thread(target=self._follow,
+                                              args=(router.primary(), services),
+                                              name='ceryx-orphans', daemon=True)
+            self._follower.start()
+
+    def unfollow(self, timeout=None):
+        """Stops following the route changes"""
+        with self._lock:
+            follower, self._follower = self._follower, None
+        if follower is not None:
+            self._stopped.set()
+            follower.join(timeout)
+
+    def _follow(self, router, services):
+        def reload():
+            self.load(services(), router.iter_routes())
+
+        while not self._stopped.is_set():
+            subscriber = None
+            try:
+                subscriber = router.subscribe()
+                while not self._stopped.is_set():
+                    host = subscriber.get_host(self.STOP_INTERVAL, on_subscribe=reload)
+                    if host is not None:
+                        self.set_host(host, router.lookup_paths(host))
+            except Exception:
+                logger.exception('Failed to follow the route changes')
+                self._stopped.wait(self.FOLLOW_RETRY_DELAY)
+            finally:
+                if subscriber is not None:
+                    subscriber.close()
+
+    def report(self):
+        """
+        Returns the orphan routes as a dict with the sorted list of
+        ``(host, path, target)`` entries, their total count and the count of
+        orphan routes per missing service.
+        """
+        with self._lock:
+            by_service = {s: len(self._by_service[s]) for s in self._missing}
+            # a route with several missing services is reported once
+            routes = {(host, path, self._routes[(host, path)])
+                      for service in self._missing
+                      for host, path in self._by_service[service]}
+
+        return {
+            'routes': sorted(routes),
+            'count': len(routes),
+            'by_service': by_service,
+        }
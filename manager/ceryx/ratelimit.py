@@ -0,0 +1,154 @@
+"""
+Per route rate limiting.
+
+The ``rate_limit`` policy of a route path allows ``rate`` requests per
+second on average and bursts of ``burst`` requests, for the whole route or
+for each client address of the route. It is stored in the policies of the
+path as::
+
+    {"rate_limit": {"rate": 10, "burst": 20, "per": "client"}}
+
+The proxies enforce it with a token bucket kept in Redis by the
+``tokenbucket.lua`` script, taking tokens in leases so that most requests
+are allowed or denied without a round trip (see ``ratelimit.lua``).
+``TokenBucket`` and ``LeasedLimiter`` are the Python references of both.
+"""
+import collections
+import math
+
+
+PER_ROUTE = 'route'
+PER_CLIENT = 'client'
+PER = (PER_ROUTE, PER_CLIENT)
+
+# the seconds of traffic a lease covers, and how long its tokens last
+LEASE_SECONDS = 0.1
+LEASE_TTL = 1
+
+
+class InvalidRateLimit(ValueError):
+    """
+    Exception raised when a rate limit policy is malformed.
+    """
+    pass
+
+
+class RateLimit(collections.namedtuple('RateLimit', ['rate', 'burst', 'per'])):
+    """
+    Rate limit of a route, ``rate`` being in requests per second.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def create(rate, burst=None, per=PER_ROUTE):
+        """Returns a validated ``RateLimit``, burst defaulting to the rate"""
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            raise InvalidRateLimit('Rate and burst must be numbers')
+        if not math.isfinite(rate):
+            raise InvalidRateLimit('Rate must be finite')
+        try:
+            burst = int(burst) if burst is not None else max(int(math.ceil(rate)), 1)
+        except (TypeError, ValueError, OverflowError):
+            raise InvalidRateLimit('Rate and burst must be numbers')
+
+        if not rate > 0:
+            raise InvalidRateLimit('Rate must be positive')
+        if burst < 1:
+            raise InvalidRateLimit('Burst must be at least 1')
+        if per not in PER:
+            raise InvalidRateLimit(f'Rate limit must be per {" or ".join(PER)}')
+
+        return RateLimit(rate, burst, per)
+
+    @staticmethod
+    def from_policy(policy):
+        """Returns the ``RateLimit`` of a route policy, or None"""
+        config = (policy or {}).get('rate_limit')
+        if not config:
+            return None
+        if not isinstance(config, dict):
+            raise InvalidRateLimit('Rate limit must be an object')
+        return RateLimit.create(config.get('rate'), config.get('burst'),
+                                config.get('per', PER_ROUTE))
+
+    def to_policy(self):
+        """Returns the ``rate_limit`` entry of a route policy"""
+        rate = int(self.rate) if self.rate == int(self.rate) else self.rate
+        return {'rate': rate, 'burst': self.burst, 'per': self.per}
+
+    @property
+    def lease(self):
+        """The number of tokens taken at once by a proxy"""
+        return max(1, min(self.burst, int(math.ceil(self.rate * LEASE_SECONDS))))
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at ``rate`` tokens per second up to ``burst``
+    tokens, the reference of ``tokenbucket.lua``.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = None
+        self.updated_at = None
+
+    def take(self, now, requested=1):
+        """
+        Takes up to ``requested`` whole tokens at ``now``. Returns the number
+        of tokens granted and, if none was, the seconds until the requested
+        tokens are available.
+        """
+        if self.tokens is None:
+            self.tokens, self.updated_at = self.burst, now
+
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+        granted = min(requested, int(math.floor(self.tokens)))
+        self.tokens -= granted
+
+        wait = 0 if granted else (requested - self.tokens) / self.rate
+        return granted, wait
+
+
+class LeasedLimiter:
+    """
+    The limiter of a proxy, the reference of ``ratelimit.lua``. Requests
+    consume the tokens of a local lease, a new lease being taken from the
+    shared ``take(now, requested)`` bucket only when the lease is spent or
+    expired. Denials are remembered until the bucket should have a lease
+    again, so that requests over the limit do not reach the bucket either.
+    """
+
+    def __init__(self, take, lease, lease_ttl=LEASE_TTL):
+        self.take = take
+        self.lease = lease
+        self.lease_ttl = lease_ttl
+        self.tokens = 0
+        self.expires_at = 0
+        self.denied_until = 0
+        self.round_trips = 0
+
+    def allow(self, now):
+        """Checks if a request at ``now`` is allowed"""
+        if self.tokens > 0 and now < self.expires_at:
+            self.tokens -= 1
+            return True
+
+        if now < self.denied_until:
+            return False
+
+        self.round_trips += 1
+        granted, wait = self.take(now, self.lease)
+        if not granted:
+            self.denied_until = now + wait
+            return False
+
+        self.tokens = granted - 1
+        self.expires_at = now + self.lease_ttl
+        return True
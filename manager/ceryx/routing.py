@@ -0,0 +1,178 @@
+"""
+Python reference of the route matching implemented by the proxy in
+``routelib.lua``.
+
+A request path matches a route path if it is equal to it, ignoring a
+trailing "/", or if it starts with the route path followed by "/". Among
+the matching paths, the one with more "/" wins, ties being broken by the
+greatest path.
+"""
+from ceryx import targets
+
+
+def normalize(path):
+    """Adds a trailing "/" to the given path, if needed"""
+    return path if path.endswith('/') else path + '/'
+
+
+def matches(path, search):
+    """Checks if the request ``path`` matches the route path ``search``"""
+    nsearch = normalize(search)
+    return path.startswith(nsearch) or normalize(path) == nsearch
+
+
+def sort_key(path):
+    """Key ordering route paths by priority, in reverse order"""
+    return path.count('/'), path
+
+
+def unroot(path, root):
+    """
+    Strips the route path ``root`` from the request ``path``, for example if
+    path = /path/subpath and root = /path, returns /subpath
+    """
+    if path == root:
+        return '/'
+
+    if root == '/':
+        return path
+
+    new_path = path[len(root):]
+    if not new_path.startswith('/'):
+        new_path = '/' + new_path
+
+    return new_path
+
+
+def resolve(paths, path, unhealthy=()):
+    """
+    Resolves the request path against the ``{route path: target}`` dict of a
+    host by checking every route path, as the proxy does for hosts without
+    a path index. Paths whose targets are all in ``unhealthy`` are
+    skipped.
+    Returns a ``(target, unrooted path)`` tuple or None.
+    """
+    candidates = [p for p in paths
+                  if matches(path, p) and targets.is_healthy(paths[p], unhealthy)]
+    if not candidates:
+        return None
+
+    route_path = max(candidates, key=sort_key)
+    return paths[route_path], unroot(path, route_path)
+
+
+def build_path_index(paths):
+    """
+    Builds the path index of a host, mapping each normalized route path to
+    the route path it resolves to. When both "/a" and "/a/" exist, "/a/"
+    always wins, so it is the one indexed.
+    """
+    index = {}
+    for path in paths:
+        npath = normalize(path)
+        if path.endswith('/') or npath not in index:
+            index[npath] = path
+    return index
+
+
+def prefixes(path):
+    """
+    Yields the normalized route paths that may match the request path,
+    longest first.
+    """
+    npath = normalize(path)
+    pos = len(npath)
+    while pos > 0:
+        yield npath[:pos]
+        pos = npath.rfind('/', 0, pos - 1) + 1
+
+
+def resolve_indexed(paths, index, path):
+    """
+    Same as ``resolve``, probing the path index once per "/" in the request
+    path instead of checking every route path.
+    """
+    for prefix in prefixes(path):
+        route_path = index.get(prefix)
+        if route_path is not None:
+            return paths[route_path], unroot(path, route_path)
+    return None
+
+
+def is_reachable(path):
+    """
+    Checks if a request may ever match the route path. Request paths start
+    with "/" and are normalized by nginx, so they never contain empty, "."
+    or ".." segments.
+    """
+    if path and not path.startswith('/'):
+        return False
+    segments = normalize(path)[1:-1]
+    return not segments or all(s not in ('', '.', '..') for s in segments.split('/'))
+
+
+def segments(path):
+    """Returns the segments of a normalized path starting with "/"."""
+    return path[1:-1].split('/') if len(path) > 1 else []
+
+
+class PathTree:
+    """
+    Radix tree of the route paths of a host, keyed by path segments. A
+    request is resolved with a single walk down its segments, the deepest
+    route path found winning, which is the same as ``resolve``.
+    """
+
+    class Node:
+        __slots__ = ('children', 'paths')
+
+        def __init__(self):
+            self.children = {}
+            # route paths with this normalized path, "/a" and "/a/"
+            self.paths = []
+
+        @property
+        def path(self):
+            return max(self.paths, key=sort_key) if self.paths else None
+
+    def __init__(self, paths=()):
+        self.root = PathTree.Node()
+        self.unreachable = []
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        # an empty path is the same as "/", with a lower priority
+        if path and not path.startswith('/'):
+            self.unreachable.append(path)
+            return
+
+        node = self.root
+        for segment in segments(normalize(path)):
+            node = node.children.setdefault(segment, PathTree.Node())
+        node.paths.append(path)
+
+    def match(self, path):
+        """Returns the route path matching the request path, or None"""
+        node = self.root
+        best = node.path
+        for segment in segments(normalize(path)):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.paths:
+                best = node.path
+        return best
+
+    def walk(self):
+        """
+        Yields the nodes holding route paths along with the nearest such
+        node above them, or None.
+        """
+        stack = [(self.root, None)]
+        while stack:
+            node, parent = stack.pop()
+            if node.paths:
+                yield node, parent
+                parent = node
+            stack.extend((child, parent) for child in node.children.values())
@@ -0,0 +1,22 @@
+-- Gives the hosts which have routes but no generation, written before the
+-- generations existed or restored by hand, the generation of the route
+-- table, so that their changes and deletion show in the generations hash.
+--
+-- KEYS[5..]: the routes hash of every host of ARGV[2..]
+-- ARGV[2..]: the hosts
+--
+-- Returns {generation, adopted}, adopted being the hosts given the
+-- generation of the route table.
+
+local generation = redis.call('get', generation_key) or 0
+local adopted = {}
+
+for i = 2, #ARGV do
+    local host = ARGV[i]
+    if redis.call('exists', KEYS[i + 3]) == 1
+            and redis.call('hsetnx', generations_key, host, generation) == 1 then
+        adopted[#adopted + 1] = host
+    end
+end
+
+return {tonumber(generation), adopted}
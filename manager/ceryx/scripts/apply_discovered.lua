@@ -0,0 +1,163 @@
+-- Applies the routes discovered for some services, comparing them with the
+-- routes the services own and with the current routes in the same run, so
+-- that concurrent discoveries and manual edits are never overwritten.
+--
+-- KEYS[5]: the hash of the routes owned by every service, as JSON
+-- KEYS[6]: the hash of the owner service of every route, by host .. path
+-- KEYS[7..]: the routes hash, path index, policies hash and deadlines hash
+--            of every host of ARGV[3], four keys per host
+-- ARGV[2]: the JSON list of the [service, [[host, path, target], ...]]
+--          applied, a removed service having no routes
+-- ARGV[3]: the JSON list of the hosts of the routes the services own or
+--          are given
+--
+-- Fails with DISCOVERY_CHANGED, before writing anything, if a route owned
+-- by a service belongs to a host missing from ARGV[3], the services having
+-- changed since their routes were read.
+--
+-- Returns {changes, conflicts}, changes being {host, path, target} entries
+-- with a false target for deleted routes, and conflicts {host, path,
+-- service, owner} entries for the routes left alone, owner being false for
+-- routes set by hand.
+
+local services_key, owners_key = KEYS[5], KEYS[6]
+local services = cjson.decode(ARGV[2])
+
+local host_keys = {}
+for i, host in ipairs(cjson.decode(ARGV[3])) do
+    local k = 4 * i + 3
+    host_keys[host] = {KEYS[k], KEYS[k + 1], KEYS[k + 2], KEYS[k + 3]}
+end
+
+local function route_id(host, path)
+    return host .. path
+end
+
+-- the routes of a list of [host, path, target], by route id, and the ids
+-- in the order of the list
+local function by_id(routes)
+    local routes_by_id, ids = {}, {}
+    for _, route in ipairs(routes) do
+        local id = route_id(route[1], route[2])
+        if not routes_by_id[id] then
+            ids[#ids + 1] = id
+        end
+        routes_by_id[id] = route
+    end
+    return routes_by_id, ids
+end
+
+local desired, owned = {}, {}
+local added, removed = {}, {}
+local added_ids, removed_ids = {}, {}
+
+for _, service in ipairs(services) do
+    local name = service[1]
+    local old_json = redis.call('hget', services_key, name)
+    local old, old_ids = by_id(old_json and cjson.decode(old_json) or {})
+    local new, new_ids = by_id(service[2])
+    owned[name], desired[name] = old, new
+
+    for _, id in ipairs(old_ids) do
+        if not new[id] then
+            if not host_keys[old[id][1]] then
+                return redis.error_reply('DISCOVERY_CHANGED')
+            end
+            removed[id] = {name, old[id]}
+            removed_ids[#removed_ids + 1] = id
+        end
+    end
+    for _, id in ipairs(new_ids) do
+        if not old[id] or old[id][3] ~= new[id][3] then
+            added[id] = {name, new[id]}
+            added_ids[#added_ids + 1] = id
+        end
+    end
+end
+
+local function current_target(route)
+    return redis.call('hget', host_keys[route[1]][1], route[2])
+end
+
+local claims, claim_ids, conflicts = {}, {}, {}
+for _, id in ipairs(added_ids) do
+    local name, route = added[id][1], added[id][2]
+    local owner = redis.call('hget', owners_key, id)
+    -- the route may be taken over from a service giving it up
+    local released_by_owner = owner and desired[owner] and not desired[owner][id]
+    if not owner and current_target(route) then
+        conflicts[#conflicts + 1] = {route[1], route[2], name, false}
+    elseif owner and owner ~= name and not released_by_owner then
+        conflicts[#conflicts + 1] = {route[1], route[2], name, owner}
+    else
+        claims[id] = name
+        claim_ids[#claim_ids + 1] = id
+    end
+end
+
+local changes, touched, touched_hosts = {}, {}, {}
+local function touch_host(host)
+    if not touched[host] then
+        touched[host] = true
+        touched_hosts[#touched_hosts + 1] = host
+    end
+end
+
+for _, id in ipairs(removed_ids) do
+    local name, route = removed[id][1], removed[id][2]
+    if not claims[id] and redis.call('hget', owners_key, id) == name then
+        local host, path = route[1], route[2]
+        -- routes changed by hand since they were discovered are kept
+        if current_target(route) == route[3] then
+            local keys = host_keys[host]
+            delete_path(keys[1], keys[2], keys[3], keys[4], host, path)
+            touch_host(host)
+            changes[#changes + 1] = {host, path, false}
+        end
+        redis.call('hdel', owners_key, id)
+    end
+end
+
+for _, id in ipairs(claim_ids) do
+    local route = added[id][2]
+    local host, path, target = route[1], route[2], route[3]
+    local keys = host_keys[host]
+    redis.call('hset', keys[1], path, target)
+    redis.call('zadd', hosts_key, 0, host)
+    index_path(keys[2], path)
+    redis.call('hset', owners_key, id, claims[id])
+    touch_host(host)
+    changes[#changes + 1] = {host, path, target}
+end
+
+local function route_less(a, b)
+    if a[1] ~= b[1] then
+        return a[1] < b[1]
+    elseif a[2] ~= b[2] then
+        return a[2] < b[2]
+    end
+    return a[3] < b[3]
+end
+
+for _, service in ipairs(services) do
+    local name = service[1]
+    local routes = {}
+    for id, route in pairs(desired[name]) do
+        local old = owned[name][id]
+        if (old and old[3] == route[3]) or claims[id] == name then
+            routes[#routes + 1] = route
+        end
+    end
+    if #routes > 0 then
+        table.sort(routes, route_less)
+        redis.call('hset', services_key, name, cjson.encode(routes))
+    else
+        redis.call('hdel', services_key, name)
+    end
+end
+
+if #touched_hosts > 0 then
+    touch(unpack(touched_hosts))
+end
+
+return {changes, conflicts}
@@ -0,0 +1,113 @@
+-- Helpers shared by the route mutation scripts, prepended to every script
+-- by ScriptRegistry. The path index rules are the ones of ceryx/routing.py
+-- and of RedisRouter._queue_index_path.
+--
+-- Every script takes the following keys first:
+--
+-- KEYS[1]: the host index sorted set
+-- KEYS[2]: the hash of the host generations
+-- KEYS[3]: the route table generation
+-- KEYS[4]: the sorted set of the deadlines of the expiring paths, by
+--          "<host> <path>"
+--
+-- and the invalidations channel as ARGV[1].
+
+local hosts_key, generations_key, generation_key = KEYS[1], KEYS[2], KEYS[3]
+local deadlines_key = KEYS[4]
+local invalidations = ARGV[1]
+
+local function normalize(path)
+    if string.sub(path, -1) ~= '/' then
+        return path .. '/'
+    end
+    return path
+end
+
+-- the other path with the same normalized path, "/a/" for "/a" and vice
+-- versa, or nil if there is no such path
+local function sibling(path)
+    if string.sub(path, -1) ~= '/' then
+        return path .. '/'
+    end
+
+    local other = string.sub(path, 1, -2)
+    if other == '' or string.sub(other, -1) == '/' then
+        return nil
+    end
+    return other
+end
+
+-- adds a path to the path index, "/a/" being preferred over "/a"
+local function index_path(index_key, path)
+    if string.sub(path, -1) == '/' then
+        redis.call('hset', index_key, normalize(path), path)
+    else
+        redis.call('hsetnx', index_key, normalize(path), path)
+    end
+end
+
+-- applies a policy argument to a path: '' keeps the current policy, '{}'
+-- removes it and any other JSON policy replaces it
+local function set_policy(policies_key, path, policy)
+    if policy == '{}' then
+        redis.call('hdel', policies_key, path)
+    elseif policy ~= '' then
+        redis.call('hset', policies_key, path, policy)
+    end
+end
+
+-- applies a deadline argument to a path: '' keeps the current deadline,
+-- '0' removes it and any other value is the time the path expires at
+local function set_deadline(expires_key, host, path, deadline)
+    if deadline == '0' then
+        redis.call('hdel', expires_key, path)
+        redis.call('zrem', deadlines_key, host .. ' ' .. path)
+    elseif deadline ~= '' then
+        redis.call('hset', expires_key, path, deadline)
+        redis.call('zadd', deadlines_key, deadline, host .. ' ' .. path)
+    end
+end
+
+-- removes a path from the path index, falling back to its sibling
+local function unindex_path(host_key, index_key, path)
+    local other = sibling(path)
+    if other and redis.call('hexists', host_key, other) == 1 then
+        redis.call('hset', index_key, normalize(path), other)
+    else
+        redis.call('hdel', index_key, normalize(path))
+    end
+end
+
+-- deletes a path along with its policy and deadline, and the host from
+-- the host index if it was its last path, returning whether it existed
+local function delete_path(host_key, index_key, policies_key, expires_key, host, path)
+    set_deadline(expires_key, host, path, '0')
+    if redis.call('hdel', host_key, path) == 0 then
+        return false
+    end
+
+    redis.call('hdel', policies_key, path)
+    unindex_path(host_key, index_key, path)
+    if redis.call('exists', host_key) == 0 then
+        redis.call('zrem', hosts_key, host)
+    end
+    return true
+end
+
+-- bumps the generation of the hosts and of the route table and publishes
+-- the hosts as invalidated. A host starts at the generation of the route
+-- table, so that a deleted and added again host never reuses a generation,
+-- and the generation of a deleted host is removed.
+local function touch(...)
+    local generation = redis.call('get', generation_key) or 0
+    for _, host in ipairs({...}) do
+        if redis.call('zscore', hosts_key, host) then
+            redis.call('hsetnx', generations_key, host, generation)
+            redis.call('hincrby', generations_key, host, 1)
+        else
+            redis.call('hdel', generations_key, host)
+        end
+        redis.call('publish', invalidations, host)
+    end
+    redis.call('incr', generation_key)
+end
@@ -0,0 +1,27 @@
+-- Deletes a host with all its paths.
+--
+-- KEYS[5]: the host routes hash
+-- KEYS[6]: the host path index
+-- KEYS[7]: the host policies hash
+-- KEYS[8]: the host deadlines hash
+-- ARGV[2]: the host
+--
+-- Returns 1 if the host was deleted and 0 if it did not exist.
+
+local host_key, index_key, policies_key, expires_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local host = ARGV[2]
+
+for _, path in ipairs(redis.call('hkeys', expires_key)) do
+    redis.call('zrem', deadlines_key, host .. ' ' .. path)
+end
+
+local deleted = redis.call('del', host_key)
+redis.call('del', index_key, policies_key, expires_key)
+redis.call('zrem', hosts_key, host)
+if deleted == 0 then
+    return 0
+end
+
+touch(host)
+
+return 1
@@ -0,0 +1,21 @@
+-- Deletes a path, and the host from the host index if it was its last
+-- path.
+--
+-- KEYS[5]: the host routes hash
+-- KEYS[6]: the host path index
+-- KEYS[7]: the host policies hash
+-- KEYS[8]: the host deadlines hash
+-- ARGV[2]: the host
+-- ARGV[3]: the path
+--
+-- Returns 1 if the path was deleted and 0 if it did not exist.
+
+local host_key, index_key, policies_key, expires_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local host, path = ARGV[2], ARGV[3]
+
+if not delete_path(host_key, index_key, policies_key, expires_key, host, path) then
+    return 0
+end
+touch(host)
+
+return 1
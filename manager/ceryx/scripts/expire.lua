@@ -0,0 +1,36 @@
+-- Deletes the paths whose deadline is due, as delete_path does.
+--
+-- KEYS[5..]: the routes hash, path index, policies hash and deadlines hash
+--            of the host of every path, four keys per path
+-- ARGV[2]: the current time
+-- ARGV[3..]: the host and the path of every path, two arguments per path
+--
+-- Paths whose deadline was pushed back or removed meanwhile are kept.
+-- Returns the "<host> <path>" of the deleted paths.
+
+local now = tonumber(ARGV[2])
+local expired, touched = {}, {}
+
+for i = 1, (#ARGV - 2) / 2 do
+    local host, path = ARGV[2 * i + 1], ARGV[2 * i + 2]
+    local k = 4 * i + 1
+    local member = host .. ' ' .. path
+
+    local deadline = tonumber(redis.call('zscore', deadlines_key, member))
+    if deadline and deadline <= now then
+        if delete_path(KEYS[k], KEYS[k + 1], KEYS[k + 2], KEYS[k + 3], host, path) then
+            expired[#expired + 1] = member
+            touched[host] = true
+        end
+    end
+end
+
+local hosts = {}
+for host, _ in pairs(touched) do
+    hosts[#hosts + 1] = host
+end
+if #hosts > 0 then
+    touch(unpack(hosts))
+end
+
+return expired
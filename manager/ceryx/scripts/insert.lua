@@ -0,0 +1,37 @@
+-- Inserts a path -> target entry.
+--
+-- KEYS[5]: the host routes hash
+-- KEYS[6]: the host path index
+-- KEYS[7]: the host policies hash
+-- KEYS[8]: the host deadlines hash
+-- ARGV[2]: the host
+-- ARGV[3]: the path
+-- ARGV[4]: the target
+-- ARGV[5]: '1' to replace an existing entry, '0' to fail with PATH_EXISTS
+-- ARGV[6]: the policy of the path, see set_policy, added paths having no
+--          policy unless given
+-- ARGV[7]: the time the path expires at, '0' if it never expires
+--
+-- Returns 1 if the path was added and 0 if it was replaced.
+
+local host_key, index_key, policies_key, expires_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local host, path, target, overwrite, policy = ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+local deadline = ARGV[7]
+
+local added = redis.call('hsetnx', host_key, path, target)
+if added == 0 then
+    if overwrite ~= '1' then
+        return redis.error_reply('PATH_EXISTS')
+    end
+    redis.call('hset', host_key, path, target)
+elseif policy == '' then
+    policy = '{}'
+end
+set_policy(policies_key, path, policy)
+set_deadline(expires_key, host, path, deadline)
+
+redis.call('zadd', hosts_key, 0, host)
+index_path(index_key, path)
+touch(host)
+
+return added
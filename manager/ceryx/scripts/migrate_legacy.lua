@@ -0,0 +1,84 @@
+-- Rewrites legacy string route keys into the hash layout and advances the
+-- migration checkpoint, atomically.
+--
+-- KEYS[5]: the migration checkpoint hash
+-- KEYS[6]: the set of the legacy keys left in place for conflicting
+-- KEYS[7..]: the legacy key, and the routes hash, path index, policies
+--            hash and deadlines hash of its host, five keys per legacy key
+-- ARGV[2]: the SCAN cursor following the given keys
+-- ARGV[3..]: the host and the path of every legacy key, two arguments per
+--            key
+--
+-- A legacy key is either "routes:<host>", holding the target of the "/"
+-- path of the host at the very key of its routes hash, or
+-- "routes:<host>:<path>". Keys which are not strings are skipped, so that
+-- a batch may be run again. A legacy path already set to another target
+-- in the routes hash is left in place and reported as conflicting.
+--
+-- Returns {migrated, skipped, conflicting} counts.
+
+local checkpoint_key, conflicts_key = KEYS[5], KEYS[6]
+local cursor = ARGV[2]
+local migrated, skipped, conflicting = 0, 0, 0
+local touched = {}
+
+local function is_string(key)
+    return redis.call('type', key)['ok'] == 'string'
+end
+
+-- turns a "routes:<host>" string into the routes hash of the host
+local function convert_host_key(host_key, index_key, host)
+    local target = redis.call('get', host_key)
+    redis.call('del', host_key)
+    redis.call('hset', host_key, '/', target)
+    index_path(index_key, '/')
+    redis.call('zadd', hosts_key, 0, host)
+    touched[host] = true
+end
+
+for i = 1, (#ARGV - 2) / 2 do
+    local host, path = ARGV[2 * i + 1], ARGV[2 * i + 2]
+    local k = 5 * i + 2
+    local legacy_key, host_key, index_key = KEYS[k], KEYS[k + 1], KEYS[k + 2]
+
+    if not is_string(legacy_key) then
+        skipped = skipped + 1
+    elseif legacy_key == host_key then
+        convert_host_key(host_key, index_key, host)
+        migrated = migrated + 1
+    else
+        -- the "/" path of the host may still be a legacy string too
+        if is_string(host_key) then
+            convert_host_key(host_key, index_key, host)
+            migrated = migrated + 1
+        end
+
+        local target = redis.call('get', legacy_key)
+        local current = redis.call('hget', host_key, path)
+        if current and current ~= target then
+            redis.call('sadd', conflicts_key, legacy_key)
+            conflicting = conflicting + 1
+        else
+            redis.call('hset', host_key, path, target)
+            index_path(index_key, path)
+            redis.call('zadd', hosts_key, 0, host)
+            redis.call('del', legacy_key)
+            touched[host] = true
+            migrated = migrated + 1
+        end
+    end
+end
+
+local hosts = {}
+for host, _ in pairs(touched) do
+    hosts[#hosts + 1] = host
+end
+if #hosts > 0 then
+    touch(unpack(hosts))
+end
+
+redis.call('hset', checkpoint_key, 'cursor', cursor)
+redis.call('hincrby', checkpoint_key, 'scanned', (#ARGV - 2) / 2)
+redis.call('hincrby', checkpoint_key, 'migrated', migrated)
+
+return {migrated, skipped, conflicting}
@@ -0,0 +1,51 @@
+-- Moves an existing path to a new path and target.
+--
+-- KEYS[5]: the host routes hash
+-- KEYS[6]: the host path index
+-- KEYS[7]: the host policies hash
+-- KEYS[8]: the host deadlines hash
+-- ARGV[2]: the host
+-- ARGV[3]: the current path
+-- ARGV[4]: the new path
+-- ARGV[5]: the new target
+-- ARGV[6]: the policy of the new path, see set_policy, the policy of the
+--          current path being kept unless given
+--
+-- The deadline of the current path, if any, is moved to the new path.
+--
+-- Fails with PATH_NOT_FOUND if the current path does not exist and with
+-- PATH_EXISTS if the new path is another existing path.
+
+local host_key, index_key, policies_key, expires_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local host, old_path, new_path, target, policy = ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+
+if redis.call('hexists', host_key, old_path) == 0 then
+    return redis.error_reply('PATH_NOT_FOUND')
+end
+
+if old_path ~= new_path then
+    if redis.call('hexists', host_key, new_path) == 1 then
+        return redis.error_reply('PATH_EXISTS')
+    end
+    redis.call('hdel', host_key, old_path)
+    unindex_path(host_key, index_key, old_path)
+
+    local old_policy = redis.call('hget', policies_key, old_path)
+    redis.call('hdel', policies_key, old_path)
+    if policy == '' then
+        policy = old_policy or '{}'
+    end
+
+    local deadline = redis.call('hget', expires_key, old_path)
+    if deadline then
+        set_deadline(expires_key, host, old_path, '0')
+        set_deadline(expires_key, host, new_path, deadline)
+    end
+end
+
+redis.call('hset', host_key, new_path, target)
+index_path(index_key, new_path)
+set_policy(policies_key, new_path, policy)
+touch(host)
+
+return 1
@@ -0,0 +1,48 @@
+-- Renames a host, along with its path index, policies and deadlines.
+--
+-- KEYS[5]: the current host routes hash
+-- KEYS[6]: the current host path index
+-- KEYS[7]: the current host policies hash
+-- KEYS[8]: the current host deadlines hash
+-- KEYS[9]: the new host routes hash
+-- KEYS[10]: the new host path index
+-- KEYS[11]: the new host policies hash
+-- KEYS[12]: the new host deadlines hash
+-- ARGV[2]: the current host
+-- ARGV[3]: the new host
+--
+-- Fails with HOST_NOT_FOUND if the current host does not exist and with
+-- HOST_EXISTS if the new host exists.
+
+local old_key, old_index_key, old_policies_key, old_expires_key = KEYS[5], KEYS[6], KEYS[7], KEYS[8]
+local new_key, new_index_key, new_policies_key, new_expires_key = KEYS[9], KEYS[10], KEYS[11], KEYS[12]
+local old_host, new_host = ARGV[2], ARGV[3]
+
+if redis.call('exists', old_key) == 0 then
+    return redis.error_reply('HOST_NOT_FOUND')
+end
+
+if redis.call('exists', new_key) == 1 then
+    return redis.error_reply('HOST_EXISTS')
+end
+
+redis.call('rename', old_key, new_key)
+redis.call('del', new_index_key, new_policies_key, new_expires_key)
+if redis.call('exists', old_index_key) == 1 then
+    redis.call('rename', old_index_key, new_index_key)
+end
+if redis.call('exists', old_policies_key) == 1 then
+    redis.call('rename', old_policies_key, new_policies_key)
+end
+
+local deadlines = redis.call('hgetall', old_expires_key)
+for i = 1, #deadlines, 2 do
+    set_deadline(old_expires_key, old_host, deadlines[i], '0')
+    set_deadline(new_expires_key, new_host, deadlines[i], deadlines[i + 1])
+end
+
+redis.call('zrem', hosts_key, old_host)
+redis.call('zadd', hosts_key, 0, new_host)
+touch(old_host, new_host)
+
+return 1
@@ -0,0 +1,23 @@
+-- Sets the policy of an existing path.
+--
+-- KEYS[5]: the host routes hash
+-- KEYS[6]: the host path index
+-- KEYS[7]: the host policies hash
+-- KEYS[8]: the host deadlines hash
+-- ARGV[2]: the host
+-- ARGV[3]: the path
+-- ARGV[4]: the policy, '{}' removing it
+--
+-- Fails with PATH_NOT_FOUND if the path does not exist.
+
+local host_key, policies_key = KEYS[5], KEYS[7]
+local host, path, policy = ARGV[2], ARGV[3], ARGV[4]
+
+if redis.call('hexists', host_key, path) == 0 then
+    return redis.error_reply('PATH_NOT_FOUND')
+end
+
+set_policy(policies_key, path, policy)
+touch(host)
+
+return 1
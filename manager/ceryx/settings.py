@@ -10,6 +10,10 @@ if os.getenv('CERYX_DEBUG', '').lower() in ['0', 'no', 'false']:
 
 WEB_BIND_HOST = os.getenv('CERYX_WEB_HOST', '127.0.0.1')
 WEB_BIND_PORT = os.getenv('CERYX_WEB_PORT', 8080)
+WEB_WORKERS = int(os.getenv('CERYX_WEB_WORKERS', 2))
+WEB_THREADS = int(os.getenv('CERYX_WEB_THREADS', 4))
+WEB_TIMEOUT = int(os.getenv('CERYX_WEB_TIMEOUT', 30))
+ROUTES_PER_PAGE = int(os.getenv('CERYX_ROUTES_PER_PAGE', 50))
 
 SECRET_KEY = os.getenv('CERYX_SECRET_KEY')
 if SECRET_KEY:
@@ -19,8 +23,55 @@ if SECRET_KEY:
 REDIS_HOST = os.getenv('CERYX_REDIS_HOST', '127.0.0.1')
 REDIS_PORT = os.getenv('CERYX_REDIS_PORT', 6379)
 REDIS_PREFIX = os.getenv('CERYX_REDIS_PREFIX', 'ceryx')
+REDIS_SCAN_COUNT = int(os.getenv('CERYX_REDIS_SCAN_COUNT', 1000))
+REDIS_CHUNK_SIZE = int(os.getenv('CERYX_REDIS_CHUNK_SIZE', 500))
+REDIS_MODE = os.getenv('CERYX_REDIS_MODE', 'single')
+REDIS_REPLICAS = os.getenv('CERYX_REDIS_REPLICAS', '')
+REDIS_SENTINELS = os.getenv('CERYX_REDIS_SENTINELS', '')
+REDIS_SENTINEL_SERVICE = os.getenv('CERYX_REDIS_SENTINEL_SERVICE', 'ceryx')
+REDIS_CLUSTER_NODES = os.getenv('CERYX_REDIS_CLUSTER_NODES', '')
+REDIS_READ_FROM_REPLICAS = False
+if os.getenv('CERYX_REDIS_READ_FROM_REPLICAS', '').lower() in ['1', 'yes', 'true']:
+    REDIS_READ_FROM_REPLICAS = True
+
+# every key must be in the same slot of the cluster
+if REDIS_MODE == 'cluster' and '{' not in REDIS_PREFIX:
+    REDIS_PREFIX = '{' + REDIS_PREFIX + '}'
+
+SNAPSHOT_PUBLISH = True
+if os.getenv('CERYX_SNAPSHOT_PUBLISH', '').lower() in ['0', 'no', 'false']:
+    SNAPSHOT_PUBLISH = False
+SNAPSHOT_DELAY = float(os.getenv('CERYX_SNAPSHOT_DELAY', 1))
+REAPER_INTERVAL = float(os.getenv('CERYX_REAPER_INTERVAL', 1))
+REAPER_BATCH_SIZE = int(os.getenv('CERYX_REAPER_BATCH_SIZE', 100))
+
+USER_CACHE_TTL = float(os.getenv('CERYX_USER_CACHE_TTL', 5))
+LOGIN_CACHE_TTL = float(os.getenv('CERYX_LOGIN_CACHE_TTL', 60))
+BCRYPT_WORKERS = int(os.getenv('CERYX_BCRYPT_WORKERS', 2))
+BCRYPT_MAX_PENDING = int(os.getenv('CERYX_BCRYPT_MAX_PENDING', 8))
+BCRYPT_TIMEOUT = float(os.getenv('CERYX_BCRYPT_TIMEOUT', 5))
 
 DOCKER_HOST = os.getenv('CERYX_DOCKER_HOST', 'unix:///var/run/docker.sock')
 DOCKER_PORT = os.getenv('CERYX_DOCKER_PORT')
+DOCKER_CACHE_TTL = int(os.getenv('CERYX_DOCKER_CACHE_TTL', 300))
+ORPHAN_INDEX_TTL = int(os.getenv('CERYX_ORPHAN_INDEX_TTL', 3600))
+STATS_BUCKET = int(os.getenv('CERYX_STATS_BUCKET', 60))
+STATS_TOP_ROUTES = int(os.getenv('CERYX_STATS_TOP_ROUTES', 20))
+
+HEALTH_CHECKS = False
+if os.getenv('CERYX_HEALTH_CHECKS', '').lower() in ['1', 'yes', 'true']:
+    HEALTH_CHECKS = True
+HEALTH_INTERVAL = float(os.getenv('CERYX_HEALTH_INTERVAL', 10))
+HEALTH_INTERVALS = os.getenv('CERYX_HEALTH_INTERVALS', '')
+HEALTH_TIMEOUT = float(os.getenv('CERYX_HEALTH_TIMEOUT', 2))
+HEALTH_CONCURRENCY = int(os.getenv('CERYX_HEALTH_CONCURRENCY', 100))
+HEALTH_FAILURES = int(os.getenv('CERYX_HEALTH_FAILURES', 2))
+HEALTH_HTTP_PATH = os.getenv('CERYX_HEALTH_HTTP_PATH', '')
+
+DISCOVERY = False
+if os.getenv('CERYX_DISCOVERY', '').lower() in ['1', 'yes', 'true']:
+    DISCOVERY = True
+DISCOVERY_LABEL_PREFIX = os.getenv('CERYX_DISCOVERY_LABEL_PREFIX', 'ceryx')
+DISCOVERY_DELAY = float(os.getenv('CERYX_DISCOVERY_DELAY', 0.2))
 
 PROXY_NETWORK = os.getenv('CERYX_PROXY_NETWORK', 'proxy')
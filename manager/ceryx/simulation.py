@@ -0,0 +1,143 @@
+"""
+Offline evaluation of the route table: resolving large lists of URLs as the
+proxy would and finding the route paths which shadow each other.
+"""
+import posixpath
+from collections import Counter
+from urllib.parse import unquote, urlsplit
+
+from ceryx import routing
+from ceryx.db import RoutingSnapshot
+
+
+def parse_url(url):
+    """
+    Returns the (host, path) of a URL, with or without a scheme, as seen by
+    the proxy in ``$host`` and ``$uri``: the host is lowercased without its
+    port and the path is decoded, without its query string and with its
+    slashes merged and its dot segments resolved.
+    """
+    url = url.strip()
+    if '://' not in url:
+        url = '//' + url
+    parts = urlsplit(url)
+
+    host = (parts.hostname or '').lower()
+    path = unquote(parts.path) or '/'
+    normalized = posixpath.normpath(path)
+    if normalized.startswith('//'):
+        normalized = '/' + normalized.lstrip('/')
+    if path.endswith('/') and normalized != '/':
+        normalized += '/'
+    return host, normalized
+
+
+class Simulator:
+    """
+    Resolves requests against a ``RoutingSnapshot``, with one
+    ``routing.PathTree`` per host built upfront.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.trees = {host: routing.PathTree(paths)
+                      for host, paths in snapshot.routes.items()}
+
+    def resolve(self, host, path):
+        """
+        Resolves a request as the proxy does, falling back to the wildcard
+        routes. Returns the matched (host, route path) or None.
+        """
+        for candidate in (host, RoutingSnapshot.WILDCARD_HOST):
+            tree = self.trees.get(candidate)
+            route_path = tree.match(path) if tree is not None else None
+            if route_path is not None:
+                return candidate, route_path
+        return None
+
+    def simulate(self, url):
+        """
+        Resolves a URL, returning a dict with the matched route, the target
+        and the unrooted path it would be proxied to, all None on a miss.
+        """
+        host, path = parse_url(url)
+        result = {'url': url, 'host': host, 'path': path, 'route': None,
+                  'target': None, 'target_path': None}
+
+        match = self.resolve(host, path)
+        if match is not None:
+            route_host, route_path = match
+            result.update(route={'host': route_host, 'path': route_path},
+                          target=self.snapshot.routes[route_host][route_path],
+                          target_path=routing.unroot(path, route_path))
+        return result
+
+    def simulate_many(self, urls):
+        """Yields the result of every non blank URL, see ``simulate``"""
+        for url in urls:
+            url = url.strip()
+            if url:
+                yield self.simulate(url)
+
+    def summary(self, results):
+        """
+        Summarizes simulation results with the number of requests and
+        misses, the hit count of every matched route and the routes which
+        were never matched.
+        """
+        hits = Counter()
+        requests = misses = 0
+        for result in results:
+            requests += 1
+            route = result['route']
+            if route is None:
+                misses += 1
+            else:
+                hits[route['host'], route['path']] += 1
+
+        return {
+            'requests': requests,
+            'misses': misses,
+            'hits': [{'host': host, 'path': path, 'hits': count}
+                     for (host, path), count in hits.most_common()],
+            'unused': [{'host': host, 'path': path}
+                       for host, path, _ in self.snapshot.entries()
+                       if (host, path) not in hits],
+        }
+
+    def conflicts(self):
+        """
+        Returns the route paths of every host which are never matched, as
+        ``unreachable`` entries with the reason and the path shadowing them
+        if any, and the route paths whose requests are partly taken over by
+        deeper paths, as ``shadowed`` entries.
+        """
+        unreachable, shadowed = [], []
+
+        for host in sorted(self.trees):
+            tree = self.trees[host]
+
+            for path in tree.unreachable:
+                unreachable.append({'host': host, 'path': path,
+                                    'reason': 'no leading "/"', 'by': None})
+
+            by_parent = {}
+            for node, parent in tree.walk():
+                winner = node.path
+                for path in node.paths:
+                    if path != winner:
+                        unreachable.append({'host': host, 'path': path,
+                                            'reason': 'shadowed', 'by': winner})
+                    elif not routing.is_reachable(path):
+                        unreachable.append({'host': host, 'path': path,
+                                            'reason': 'not a normalized path',
+                                            'by': None})
+                if parent is not None and routing.is_reachable(winner):
+                    by_parent.setdefault(parent.path, []).append(winner)
+
+            for path in sorted(by_parent):
+                shadowed.append({'host': host, 'path': path,
+                                 'by': sorted(by_parent[path])})
+
+        unreachable.sort(key=lambda c: (c['host'], c['path']))
+        return {'unreachable': unreachable, 'shadowed': shadowed}
@@ -0,0 +1,136 @@
+"""
+Targets of the routes.
+
+A route path maps to a single ``service[:port]`` target or to weighted
+targets, stored in the same hash field as a comma separated list of
+``service[:port]=weight`` items, for example::
+
+    app:8080=9,app-canary:8080=1
+
+A target without a weight has a weight of 1, so single targets keep their
+format. The proxy picks one of the targets for each request, at random in
+proportion of the weights, skipping the unhealthy ones; ``choose`` is the
+Python reference of ``targets.lua``.
+"""
+import collections
+import random
+
+
+DEFAULT_PORT = 80
+MAX_WEIGHT = 1000
+
+
+class Target(collections.namedtuple('Target', ['address', 'weight'])):
+    """
+    A ``service[:port]`` address receiving a share of the requests of a
+    route in proportion of its weight.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def create(service, port=DEFAULT_PORT, weight=1):
+        port = int(port)
+        address = service if port == DEFAULT_PORT else f'{service}:{port}'
+        return Target(address, weight)
+
+    @property
+    def service(self):
+        return split(self.address)[0]
+
+    @property
+    def port(self):
+        return split(self.address)[1]
+
+
+class InvalidTargets(ValueError):
+    """
+    Exception raised when a route target is malformed.
+    """
+    pass
+
+
+def split(address):
+    """Returns the (service, port) of a ``service[:port]`` address"""
+    service, _, port = address.partition(':')
+    return service, int(port) if port else DEFAULT_PORT
+
+
+def parse_item(item):
+    """Parses a single ``service[:port][=weight]`` target"""
+    address, sep, weight = item.rpartition('=')
+    if not sep:
+        address, weight = weight, '1'
+    address = address.strip()
+
+    try:
+        service, _ = split(address)
+        weight = int(weight)
+    except ValueError:
+        raise InvalidTargets(f'Invalid target "{item}"')
+
+    if not service or any(c in address for c in ',= ') or not 0 <= weight <= MAX_WEIGHT:
+        raise InvalidTargets(f'Invalid target "{item}"')
+
+    return Target(address, weight)
+
+
+def parse(value):
+    """
+    Parses the target of a route, returning the list of its ``Target``.
+    """
+    targets = [parse_item(item) for item in value.split(',')]
+    if not any(t.weight for t in targets):
+        raise InvalidTargets('At least one target must have a weight')
+
+    return targets
+
+
+def serialize(targets):
+    """
+    Formats targets as stored in Redis, a single target with a weight of 1
+    being stored as its address.
+    """
+    if len(targets) == 1 and targets[0].weight == 1:
+        return targets[0].address
+    return ','.join(f'{t.address}={t.weight}' for t in targets)
+
+
+def addresses(value):
+    """Returns the addresses of the targets of a route"""
+    if ',' not in value and '=' not in value:
+        return [value]
+    return [t.address for t in parse(value)]
+
+
+def services(value):
+    """Returns the service names of the targets of a route"""
+    return [split(address)[0] for address in addresses(value)]
+
+
+def is_healthy(value, unhealthy):
+    """
+    Checks if a target of a route receiving requests is not in the
+    ``unhealthy`` addresses.
+    """
+    if ',' not in value and '=' not in value:
+        return value not in unhealthy
+    return any(t.weight and t.address not in unhealthy for t in parse(value))
+
+
+def choose(value, unhealthy=(), rand=random):
+    """
+    Picks the address of one of the targets of a route, in proportion of
+    the weights, among the healthy ones if any.
+    """
+    if ',' not in value and '=' not in value:
+        return value
+
+    targets = [t for t in parse(value) if t.weight]
+    healthy = [t for t in targets if t.address not in unhealthy]
+    targets = healthy or targets
+
+    point = rand.randint(1, sum(t.weight for t in targets))
+    for target in targets:
+        point -= target.weight
+        if point <= 0:
+            return target.address
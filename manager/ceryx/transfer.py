@@ -0,0 +1,227 @@
+"""
+Streaming export and import of the route table, as NDJSON (one route per
+line) or as a JSON array of routes. A route is represented as
+``{"host": ..., "path": ..., "target": ...}``.
+
+Both formats are parsed incrementally, so that imports never hold the
+whole input in memory.
+"""
+import codecs
+import json
+
+from ceryx import settings, targets
+from ceryx.db import chunks
+
+
+FORMATS = ('ndjson', 'json')
+
+# the characters read at once from JSON arrays
+READ_SIZE = 65536
+
+
+class InvalidRoute(Exception):
+    """
+    Exception raised when an imported route is malformed.
+    """
+    pass
+
+
+def export_routes(router, pattern=None, fmt='ndjson'):
+    """
+    Yields the routes with host matching the given pattern serialized in
+    the given format, one chunk of text at a time.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format "{fmt}"')
+
+    separator = '\n' if fmt == 'ndjson' else ',\n'
+    first = True
+
+    if fmt == 'json':
+        yield '[\n'
+
+    for route in router.iter_routes(pattern):
+        for path, target in sorted(route['paths'].items()):
+            entry = json.dumps({'host': route['host'], 'path': path, 'target': target})
+            if fmt == 'ndjson':
+                yield entry + separator
+            else:
+                yield entry if first else separator + entry
+            first = False
+
+    if fmt == 'json':
+        yield '\n]\n'
+
+
+def _validate(entry):
+    if not isinstance(entry, dict):
+        raise InvalidRoute('Route must be an object')
+
+    for field in ('host', 'path', 'target'):
+        if not isinstance(entry.get(field), str) or not entry[field]:
+            raise InvalidRoute(f'Route field "{field}" must be a non empty string')
+
+    if not entry['path'].startswith('/'):
+        raise InvalidRoute('Route path must start with "/"')
+
+    try:
+        targets.parse(entry['target'])
+    except targets.InvalidTargets as e:
+        raise InvalidRoute(str(e))
+
+    return entry['host'], entry['path'], entry['target']
+
+
+def parse_routes(lines):
+    """
+    Parses NDJSON lines, yielding ``(line number, route)`` pairs where route
+    is either a (host, path, target) tuple or the ``InvalidRoute`` error.
+    Blank lines are skipped.
+    """
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            yield number, _validate(json.loads(line))
+        except ValueError as e:
+            yield number, InvalidRoute(f'Invalid JSON: {e}')
+        except InvalidRoute as e:
+            yield number, e
+
+
+def _iter_json_array(stream, read_size=READ_SIZE):
+    """
+    Yields the items of the JSON array read from a file object, reading at
+    most ``read_size`` characters at once. Raises ``ValueError`` if the
+    array is malformed.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = stream.read(read_size)
+        eof = not data
+        if isinstance(data, bytes):
+            data = utf8.decode(data, final=eof)
+        buffer = buffer[pos:] + data
+        pos = 0
+
+    def next_char():
+        # skips whitespace, returning the next character or '' at the end
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            fill()
+
+    if next_char() != '[':
+        raise ValueError('Expected an array of routes')
+    pos += 1
+    if next_char() == ']':
+        return
+
+    while True:
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            # the item may not be complete yet
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # a number may go on in the next read
+            fill()
+            continue
+
+        pos = end
+        yield item
+
+        separator = next_char()
+        pos += 1
+        if separator == ']':
+            return
+        if separator != ',':
+            raise ValueError(f'Expected "," or "]" instead of "{separator}"')
+        next_char()
+
+
+def parse_json_routes(stream):
+    """
+    Same as ``parse_routes``, for a JSON array of routes read incrementally
+    from a file object, numbering routes by their position in the array. A
+    malformed array ends with an ``InvalidRoute`` error numbered 0.
+    """
+    routes = _iter_json_array(stream)
+    number = 0
+    while True:
+        try:
+            entry = next(routes)
+        except StopIteration:
+            return
+        except ValueError as e:
+            yield 0, InvalidRoute(f'Invalid JSON: {e}')
+            return
+
+        number += 1
+        try:
+            yield number, _validate(entry)
+        except InvalidRoute as e:
+            yield number, e
+
+
+def import_routes(router, parsed, chunk_size=None, dry_run=False):
+    """
+    Imports parsed routes, as given by ``parse_routes``, writing each chunk
+    of ``chunk_size`` routes in a single pipelined transaction.
+
+    Yields a report per chunk, with the numbers of added, changed and
+    unchanged routes and the errors of the chunk. On a dry run nothing is
+    written and the report also lists the added and changed routes.
+    """
+    chunk_size = chunk_size or settings.REDIS_CHUNK_SIZE
+
+    for index, chunk in enumerate(chunks(parsed, chunk_size), start=1):
+        errors = [{'line': number, 'error': str(route)}
+                  for number, route in chunk if isinstance(route, Exception)]
+        entries = [route for _, route in chunk if not isinstance(route, Exception)]
+
+        report = {'chunk': index, 'added': 0, 'changed': 0, 'unchanged': 0,
+                  'errors': errors}
+
+        try:
+            current = router.primary().lookup_many((host, path) for host, path, _ in entries)
+        except Exception as e:
+            report['errors'].append({'line': None, 'error': str(e)})
+            yield report
+            continue
+
+        writes, diff = [], []
+        for (host, path, target), old_target in zip(entries, current):
+            if old_target == target:
+                report['unchanged'] += 1
+                continue
+
+            report['added' if old_target is None else 'changed'] += 1
+            writes.append((host, path, target))
+            diff.append({'host': host, 'path': path,
+                         'old_target': old_target, 'target': target})
+
+        if dry_run:
+            report['diff'] = diff
+        elif writes:
+            try:
+                router.insert_many(writes)
+            except Exception as e:
+                report['added'] = report['changed'] = 0
+                report['errors'].append({'line': None, 'error': str(e)})
+
+        yield report
@@ -0,0 +1,54 @@
+"""
+Fixtures of the manager tests, run from the manager directory with
+``python -m pytest``.
+
+Tests needing Redis use the server given by ``CERYX_TEST_REDIS``, as
+``host:port`` (``127.0.0.1:6379`` by default), and are skipped if it can not
+be reached. Its ``CERYX_TEST_REDIS_DB`` database (15 by default) is flushed
+before every test.
+"""
+import os
+
+import pytest
+import redis
+
+from ceryx.db import RedisRouter
+
+
+PROXY_LUALIB = os.path.join(os.path.dirname(__file__), '..', '..', 'proxy',
+                            'nginx', 'lualib')
+
+
+def redis_address(value=None):
+    """Returns the (host, port) of a ``host:port`` address"""
+    host, _, port = (value or os.getenv('CERYX_TEST_REDIS', '127.0.0.1:6379')).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+@pytest.fixture
+def redis_client():
+    host, port = redis_address()
+    client = redis.StrictRedis(host=host, port=port,
+                               db=int(os.getenv('CERYX_TEST_REDIS_DB', 15)),
+                               decode_responses=True, socket_timeout=5)
+    try:
+        client.ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip(f'no Redis server at {host}:{port}')
+    client.flushdb()
+    yield client
+    client.flushdb()
+
+
+@pytest.fixture
+def router(redis_client):
+    return RedisRouter(prefix='ceryx', client=redis_client)
+
+
+@pytest.fixture
+def lualib():
+    """Returns a function reading the scripts of the proxy lualib directory"""
+    def read(name):
+        with open(os.path.join(PROXY_LUALIB, f'{name}.lua')) as f:
+            return f.read()
+    return read
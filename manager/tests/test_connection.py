@@ -0,0 +1,220 @@
+"""
+Checks the Redis topologies of ``ceryx.connection`` against several local
+redis-server processes, started from the ``redis-server`` of the PATH or
+from ``CERYX_TEST_REDIS_SERVER``. The tests are skipped if there is none.
+"""
+import os
+import random
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+import redis
+
+from ceryx.connection import (ClusterTopology, InstrumentedRedis, SingleTopology,
+                              TopologyConnectionPool)
+from ceryx.db import RedisRouter
+
+
+def is_free(port):
+    with socket.socket() as s:
+        try:
+            s.bind(('127.0.0.1', port))
+            return True
+        except OSError:
+            return False
+
+
+def free_port():
+    """
+    Returns a free port whose cluster bus port, 10000 above, is free as
+    well.
+    """
+    while True:
+        port = random.randint(20000, 50000)
+        if is_free(port) and is_free(port + 10000):
+            return port
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Timed out waiting for the Redis servers')
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def redis_server(tmp_path):
+    """Returns a function starting a redis-server and returning its address"""
+    binary = os.getenv('CERYX_TEST_REDIS_SERVER') or shutil.which('redis-server')
+    if not binary:
+        pytest.skip('redis-server is not installed')
+    processes = []
+
+    def start(*args):
+        port = free_port()
+        directory = tmp_path / str(port)
+        directory.mkdir()
+        processes.append(subprocess.Popen(
+            [binary, '--bind', '127.0.0.1', '--port', str(port), '--save', '',
+             '--dir', str(directory), *args],
+            stdout=subprocess.DEVNULL))
+        client = admin(('127.0.0.1', port))
+
+        def is_up():
+            try:
+                return client.ping()
+            except redis.ConnectionError:
+                return False
+        wait_for(is_up)
+        return '127.0.0.1', port
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait()
+
+
+def admin(address):
+    return redis.StrictRedis(*address, decode_responses=True, socket_timeout=5)
+
+
+def router_for(topology):
+    def client(replica):
+        return InstrumentedRedis(connection_pool=TopologyConnectionPool(
+            topology, replica=replica, decode_responses=True, socket_timeout=5))
+    prefix = '{ceryx}' if topology.cluster else 'ceryx'
+    return RedisRouter(prefix=prefix, client=client(False), read_client=client(True))
+
+
+def role(client):
+    return client.info('replication')['role']
+
+
+def start_replica(redis_server, primary):
+    replica = redis_server('--replicaof', *map(str, primary))
+    wait_for(lambda: admin(replica).info('replication').get('master_link_status') == 'up')
+    return replica
+
+
+def test_replica_reads(redis_server):
+    primary = redis_server()
+    replica = start_replica(redis_server, primary)
+    router = router_for(SingleTopology(primary, [replica]))
+
+    router.insert('example.com', '/', 'app:80')
+    router.client.execute_command('WAIT', 1, 5000)
+
+    assert router.lookup('example.com') == 'app:80'
+    assert role(router.read_client) == 'slave'
+    assert role(router.client) == 'master'
+
+
+def test_replica_reads_fall_back_to_primary(redis_server):
+    primary = redis_server()
+    replica = start_replica(redis_server, primary)
+    router = router_for(SingleTopology(primary, [replica]))
+    router.insert('example.com', '/', 'app:80')
+    router.client.execute_command('WAIT', 1, 5000)
+    assert role(router.read_client) == 'slave'
+
+    admin(replica).shutdown()
+
+    assert router.lookup('example.com') == 'app:80'
+    assert role(router.read_client) == 'master'
+
+
+def test_failover_retries_on_new_primary(redis_server):
+    primary = redis_server()
+    replica = start_replica(redis_server, primary)
+    topology = SingleTopology(primary)
+    router = router_for(topology)
+    router.insert('example.com', '/', 'app:80')
+    router.client.execute_command('WAIT', 1, 5000)
+
+    # promotes the replica, as Sentinel would, the topology then returning it
+    admin(replica).slaveof()
+    admin(primary).slaveof(*replica)
+    topology.address = replica
+
+    router.insert('example.com', '/api', 'api:80')
+    router.set_policy('example.com', '/api', {'cache': {'ttl': 10}})
+
+    assert admin(replica).hgetall('ceryx:routes:example.com') == \
+        {'/': 'app:80', '/api': 'api:80'}
+    assert role(router.client) == 'master'
+
+
+def start_cluster(redis_server, tag, count=2):
+    """
+    Starts a cluster of ``count`` masters, the first one serving the slot of
+    the tag, and returns their addresses and node ids.
+    """
+    nodes = [redis_server('--cluster-enabled', 'yes', '--cluster-node-timeout', '1000')
+             for _ in range(count)]
+    clients = [admin(node) for node in nodes]
+    slot = clients[0].execute_command('CLUSTER KEYSLOT', tag)
+
+    # the first node serves the slot of the tag, every node sharing the
+    # others so that none becomes a replica once the slot of the tag moved
+    others = [s for s in range(16384) if s != slot]
+    clients[0].execute_command('CLUSTER ADDSLOTS', slot)
+    for i, client in enumerate(clients):
+        client.execute_command('CLUSTER ADDSLOTS', *others[i::count])
+    for node in nodes[1:]:
+        clients[0].execute_command('CLUSTER MEET', *node)
+
+    def is_ok():
+        return all(c.execute_command('CLUSTER INFO').startswith('cluster_state:ok')
+                   for c in clients)
+    wait_for(is_ok)
+    return nodes, [c.execute_command('CLUSTER MYID') for c in clients], slot
+
+
+def move_slot(source, target, source_id, target_id, slot):
+    source, target = admin(source), admin(target)
+    target.execute_command('CLUSTER SETSLOT', slot, 'IMPORTING', source_id)
+    source.execute_command('CLUSTER SETSLOT', slot, 'MIGRATING', target_id)
+    keys = source.execute_command('CLUSTER GETKEYSINSLOT', slot, 1000)
+    if keys:
+        source.execute_command('MIGRATE', target.connection_pool.connection_kwargs['host'],
+                               target.connection_pool.connection_kwargs['port'],
+                               '', 0, 5000, 'KEYS', *keys)
+    for client in (target, source):
+        client.execute_command('CLUSTER SETSLOT', slot, 'NODE', target_id)
+
+
+def test_cluster_follows_moved_slot(redis_server):
+    nodes, ids, slot = start_cluster(redis_server, '{ceryx}')
+    router = router_for(ClusterTopology(nodes, '{ceryx}'))
+    router.insert('example.com', '/', 'app:80')
+    assert router.client.info('server')['tcp_port'] == nodes[0][1]
+
+    move_slot(nodes[0], nodes[1], ids[0], ids[1], slot)
+
+    assert router.lookup('example.com') == 'app:80'
+    router.insert('example.com', '/api', 'api:80')
+    assert admin(nodes[1]).hgetall('{ceryx}:routes:example.com') == \
+        {'/': 'app:80', '/api': 'api:80'}
+    assert router.client.info('server')['tcp_port'] == nodes[1][1]
+
+
+def test_cluster_replica_reads(redis_server):
+    nodes, ids, slot = start_cluster(redis_server, '{ceryx}')
+    replica = redis_server('--cluster-enabled', 'yes')
+    admin(replica).execute_command('CLUSTER MEET', *nodes[0])
+    wait_for(lambda: ids[0] in admin(replica).execute_command('CLUSTER NODES'))
+    admin(replica).execute_command('CLUSTER REPLICATE', ids[0])
+    wait_for(lambda: admin(replica).info('replication').get('master_link_status') == 'up')
+    wait_for(lambda: all(len(ClusterTopology([node], '{ceryx}')._slot_nodes()) == 2
+                         for node in nodes))
+
+    router = router_for(ClusterTopology(nodes, '{ceryx}'))
+    router.insert('example.com', '/', 'app:80')
+    router.client.execute_command('WAIT', 1, 5000)
+
+    assert router.lookup('example.com') == 'app:80'
+    assert router.read_client.info('server')['tcp_port'] == replica[1]
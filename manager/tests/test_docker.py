@@ -0,0 +1,99 @@
+"""
+Checks the cache of the services of the proxy network.
+"""
+import threading
+import time
+
+import docker
+import pytest
+
+from ceryx.docker import DockerService
+
+
+class StubService:
+    def __init__(self, name, version, network='proxy'):
+        self.name = name
+        self.attrs = {'Spec': {'Networks': [{'Target': network}]},
+                      'Version': {'Index': version}}
+
+
+class StubClient:
+    """Docker client listing ``services``, each listing taking ``delay``"""
+
+    def __init__(self, services, delay=0):
+        self.services = self
+        self.listed = services
+        self.delay = delay
+        self.lists = 0
+        self.fetched = {}
+
+    def list(self, filters=None):
+        self.lists += 1
+        listed = list(self.listed)
+        time.sleep(self.delay)
+        return listed
+
+    def get(self, service_id):
+        return self.fetched[service_id]
+
+    def events(self, **kwargs):
+        # a stream staying open, the events being applied by the tests
+        threading.Event().wait()
+        yield from ()
+
+
+@pytest.fixture
+def service(monkeypatch):
+    client = StubClient([StubService('a', 1), StubService('b', 1),
+                         StubService('other', 1, network='other')])
+    monkeypatch.setattr(docker, 'DockerClient', lambda **kwargs: client)
+    service = DockerService('unix://docker.sock', 'proxy', cache_ttl=60)
+    notified = []
+    service.add_listener(lambda name, s: notified.append((name, s and s.attrs['Version']['Index'])))
+    return service, client, notified
+
+
+def test_sync_notifies_changed_services_only(service):
+    service, client, notified = service
+    assert service.has_service('a') and not service.has_service('other')
+    assert sorted(notified) == [('a', 1), ('b', 1)]
+    notified.clear()
+
+    client.listed = [StubService('a', 1), StubService('b', 2), StubService('c', 1)]
+    service._synced_at = None
+    service.services()
+
+    assert sorted(notified) == [('b', 2), ('c', 1)]
+
+
+def test_concurrent_resyncs_list_once(service):
+    service, client, notified = service
+    service.services()
+    client.delay = 0.2
+    service._synced_at -= 120
+
+    threads = [threading.Thread(target=service.services) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert client.lists == 2
+
+
+def test_events_received_while_syncing_are_kept(service):
+    service, client, notified = service
+    client.delay = 0.2
+    thread = threading.Thread(target=service.services)
+    thread.start()
+    time.sleep(0.05)
+
+    client.fetched['c'] = StubService('c', 3)
+    service._apply_event({'Action': 'create',
+                          'Actor': {'ID': 'c', 'Attributes': {'name': 'c'}}})
+    service._apply_event({'Action': 'remove',
+                          'Actor': {'ID': 'b', 'Attributes': {'name': 'b'}}})
+    thread.join()
+
+    assert sorted(s.name for s in service.services()) == ['a', 'c']
+    assert sorted(notified) == [('a', 1), ('c', 3)]
@@ -0,0 +1,180 @@
+"""
+Checks the health checker against dummy TCP and HTTP servers.
+"""
+import asyncio
+
+import pytest
+import redis
+
+from ceryx.health import HealthChecker, parse_intervals
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def start_server(loop, response=None):
+    """
+    Starts a dummy server answering every request with ``response``, or
+    only accepting connections, and returns its address.
+    """
+    async def handle(reader, writer):
+        if response is not None:
+            await reader.readline()
+            writer.write(response)
+        writer.close()
+
+    server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0))
+    return f'127.0.0.1:{server.sockets[0].getsockname()[1]}'
+
+
+def closed_address(loop):
+    """Returns the address of a port nothing listens on"""
+    server = loop.run_until_complete(asyncio.start_server(lambda r, w: None, '127.0.0.1', 0))
+    address = f'127.0.0.1:{server.sockets[0].getsockname()[1]}'
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    return address
+
+
+class StubRouter:
+    # never connected to, the probes not needing Redis
+    client = redis.StrictRedis()
+
+    def primary(self):
+        return self
+
+    def _prefixed_key(self, key):
+        return key
+
+
+def test_tcp_probe(loop):
+    checker = HealthChecker(StubRouter(), timeout=1)
+
+    assert loop.run_until_complete(checker.probe(start_server(loop)))
+    assert not loop.run_until_complete(checker.probe(closed_address(loop)))
+
+
+@pytest.mark.parametrize('response, healthy', [
+    (b'HTTP/1.0 200 OK\r\n\r\n', True),
+    (b'HTTP/1.1 404 Not Found\r\n\r\n', True),
+    (b'HTTP/1.1 503 Service Unavailable\r\n\r\n', False),
+    (b'garbage\r\n', False),
+])
+def test_http_probe(loop, response, healthy):
+    checker = HealthChecker(StubRouter(), timeout=1, http_path='/health')
+
+    assert loop.run_until_complete(checker.probe(start_server(loop, response))) is healthy
+
+
+def test_record_needs_consecutive_failures():
+    checker = HealthChecker(StubRouter(), failures=2)
+    checker._unhealthy = set()
+
+    assert checker.record('app:80', False) is None
+    assert checker.record('app:80', True) is None
+    assert checker.record('app:80', False) is None
+    assert checker.record('app:80', False) is False
+    assert checker.record('app:80', False) is None
+    assert checker.record('app:80', True) is True
+
+
+def test_parse_intervals():
+    assert parse_intervals('') == {}
+    assert parse_intervals('api:8080=2, batch=60') == {'api:8080': 2.0, 'batch': 60.0}
+
+
+def run_checker(loop, checker, seconds):
+    task = loop.create_task(checker.run_async())
+    loop.run_until_complete(asyncio.sleep(seconds))
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        loop.run_until_complete(task)
+
+
+@pytest.fixture
+def checker(router):
+    checker = HealthChecker(router, interval=0.2, timeout=0.5, failures=1)
+    checker.TICK = 0.05
+    return checker
+
+
+def test_checker_marks_unhealthy_targets(loop, router, checker):
+    up, down = start_server(loop), closed_address(loop)
+    router.insert('example.com', '/', up)
+    router.insert('example.com', '/api', f'{down}=1,{up}=1')
+    router.insert('other.com', '/', down)
+
+    run_checker(loop, checker, 1)
+
+    assert router.lookup_unhealthy() == {down}
+
+
+def test_checker_forgets_unrouted_targets(loop, router, checker):
+    down = closed_address(loop)
+    router.insert('example.com', '/', down)
+    router.insert('other.com', '/', down)
+    run_checker(loop, checker, 1)
+    assert router.lookup_unhealthy() == {down}
+
+    router.delete_host('example.com')
+    run_checker(loop, checker, 0.5)
+    assert router.lookup_unhealthy() == {down}
+
+    router.delete_host('other.com')
+    run_checker(loop, checker, 0.5)
+    assert router.lookup_unhealthy() == set()
+
+
+def test_checker_probes_hosts_without_generation(loop, redis_client, router, checker):
+    up, down = start_server(loop), closed_address(loop)
+    # written without the router, as before the generations existed
+    redis_client.hset('ceryx:routes:legacy.com', '/', down)
+    redis_client.zadd('ceryx:hosts', 0, 'legacy.com')
+    router.insert('other.com', '/', up)
+
+    run_checker(loop, checker, 1)
+    assert router.lookup_unhealthy() == {down}
+
+    # and its deletion is read incrementally
+    assert 'legacy.com' in router.host_generations()
+    router.delete_host('legacy.com')
+    assert 'legacy.com' not in router.host_generations()
+    assert checker._read_changes()[2] == {'legacy.com': {}}
+
+
+def test_refresh_reads_changed_hosts_only(router, checker):
+    for i in range(10):
+        router.insert(f'h{i}.com', '/', f'app{i}:80')
+    checker._reset()
+    checker._refresh_targets(0, *checker._read_changes())
+    assert set(checker._due) == {f'app{i}:80' for i in range(10)}
+
+    router.insert('h3.com', '/', 'new:80')
+    generation, generations, paths = checker._read_changes()
+    assert paths == {'h3.com': {'/': 'new:80'}}
+
+    checker._refresh_targets(0, generation, generations, paths)
+    assert 'new:80' in checker._due and 'app3:80' not in checker._due
+    assert checker._read_changes()[2] == {}
+
+
+def test_targets_are_probed_at_their_interval(loop, router, checker):
+    fast, slow = start_server(loop), start_server(loop)
+    router.insert('fast.com', '/', fast)
+    router.insert('slow.com', '/', slow)
+    checker.intervals = {slow: 60}
+    probes = []
+
+    async def probe(target):
+        probes.append(target)
+        return True
+    checker.probe = probe
+
+    run_checker(loop, checker, 0.7)
+
+    assert probes.count(fast) >= 2
+    assert probes.count(slow) <= 1
@@ -0,0 +1,44 @@
+"""
+Checks the rebuild of the host and path indexes.
+"""
+from ceryx import settings
+from ceryx.db import INDEXES_VERSION
+
+
+def test_rebuild_indexes_from_the_route_keys(redis_client, router):
+    for i in range(5):
+        redis_client.hset(f'ceryx:routes:h{i}.com', '/api', 'app:80')
+    redis_client.zadd('ceryx:hosts', 0, 'gone.com')
+
+    assert router.ensure_indexes()
+
+    assert router.lookup_hosts_page() == [f'h{i}.com' for i in range(5)]
+    assert redis_client.hgetall('ceryx:paths:h0.com') == {'/api/': '/api'}
+    assert redis_client.get('ceryx:indexes') == str(INDEXES_VERSION)
+    assert not router.ensure_indexes()
+    assert not redis_client.keys('*:rebuild')
+
+
+def test_rebuild_keeps_the_live_index_until_done(redis_client, router, monkeypatch):
+    monkeypatch.setattr(settings, 'REDIS_CHUNK_SIZE', 2)
+    for i in range(5):
+        router.insert(f'h{i}.com', '/', 'app:80')
+    counts = []
+
+    def on_chunk():
+        counts.append(router.count_hosts())
+        # inserted while rebuilding, and maybe missed by the scan
+        router.insert(f'new{len(counts)}.com', '/', 'app:80')
+
+    router.rebuild_indexes(on_chunk)
+
+    assert min(counts) >= 5
+    hosts = set(router.lookup_hosts_page())
+    assert {f'new{i + 1}.com' for i in range(len(counts))} <= hosts
+    assert {f'h{i}.com' for i in range(5)} <= hosts
+
+
+def test_rebuild_empty_table(redis_client, router):
+    redis_client.zadd('ceryx:hosts', 0, 'gone.com')
+    router.rebuild_indexes()
+    assert router.count_hosts() == 0
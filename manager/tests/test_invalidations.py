@@ -0,0 +1,90 @@
+"""
+Checks that the changes made through ``RedisRouter`` bump the generations
+and publish the changed hosts to the ``RouteSubscriber``.
+"""
+import pytest
+
+
+MUTATIONS = {
+    'insert': lambda router: router.insert('example.com', '/api', 'api:80'),
+    'update': lambda router: router.insert('example.com', '/', 'other:80'),
+    'delete_path': lambda router: router.delete_path('example.com', '/'),
+    'delete_host': lambda router: router.delete_host('example.com'),
+    'set_policy': lambda router: router.set_policy('example.com', '/', {'cache': {'ttl': 10}}),
+    'update_path': lambda router: router.update_path('example.com', '/', '/new', 'app:80'),
+    'insert_many': lambda router: router.insert_many([('example.com', '/a', 'a:80')]),
+}
+
+
+@pytest.fixture
+def subscriber(router):
+    router.insert('example.com', '/', 'app:80')
+    router.insert('other.com', '/', 'app:80')
+    subscriber = router.subscribe()
+    # wait for the subscription to be confirmed
+    subscriber.get_host(timeout=0.1)
+    yield subscriber
+    subscriber.close()
+
+
+@pytest.mark.parametrize('mutation', MUTATIONS.values(), ids=list(MUTATIONS))
+def test_mutation_bumps_generations(router, subscriber, mutation):
+    generation = router.generation()
+    host_generation = router.generation('example.com')
+    other_generation = router.generation('other.com')
+
+    mutation(router)
+
+    assert router.generation() == generation + 1
+    if router.lookup_paths('example.com'):
+        assert router.generation('example.com') == host_generation + 1
+    else:
+        # the generations of the deleted hosts are removed
+        assert 'example.com' not in router.host_generations()
+    assert router.generation('other.com') == other_generation
+
+
+def test_added_again_host_does_not_reuse_generations(router):
+    router.insert('example.com', '/', 'app:80')
+    router.insert('other.com', '/', 'app:80')
+    router.insert('example.com', '/', 'other:80')
+    deleted_generation = router.generation('example.com')
+    router.delete_host('example.com')
+
+    router.insert_many([('example.com', '/', 'app:80')])
+    assert router.generation('example.com') > deleted_generation
+    assert router.generation('example.com') <= router.generation()
+
+
+@pytest.mark.parametrize('mutation', MUTATIONS.values(), ids=list(MUTATIONS))
+def test_mutation_publishes_host(router, subscriber, mutation):
+    mutation(router)
+
+    assert subscriber.get_host(timeout=1) == 'example.com'
+    assert subscriber.get_host(timeout=0.1) is None
+
+
+def test_update_host_publishes_both_hosts(router, subscriber):
+    router.update_host('example.com', 'renamed.com')
+
+    assert {subscriber.get_host(timeout=1), subscriber.get_host(timeout=1)} == \
+        {'example.com', 'renamed.com'}
+
+
+def test_subscriber_drops_cached_entry(router, subscriber):
+    cache = {host: router.lookup_paths(host) for host in ('example.com', 'other.com')}
+
+    router.insert('example.com', '/', 'other:80')
+
+    assert subscriber.invalidate(cache, timeout=1) == {'example.com'}
+    assert cache == {'other.com': {'/': 'app:80'}}
+
+
+def test_failed_mutation_publishes_nothing(router, subscriber):
+    generation = router.generation()
+
+    with pytest.raises(router.PathExists):
+        router.insert('example.com', '/', 'other:80', overwrite=False)
+
+    assert router.generation() == generation
+    assert subscriber.get_host(timeout=0.1) is None
@@ -0,0 +1,116 @@
+"""
+Checks that a background job runs in a single process at a time.
+"""
+import time
+
+import pytest
+
+from ceryx.leases import Lease, LeasedJob
+
+
+def test_lease_is_held_by_a_single_token(redis_client):
+    first, second = Lease(redis_client, 'lease'), Lease(redis_client, 'lease')
+
+    assert first.hold()
+    assert first.hold()
+    assert not second.hold()
+
+    first.release()
+    assert second.hold()
+    assert not first.hold()
+
+
+def test_expired_lease_is_taken_over(redis_client):
+    first, second = Lease(redis_client, 'lease', ttl=1), Lease(redis_client, 'lease', ttl=1)
+    assert first.hold()
+
+    time.sleep(1.1)
+
+    assert second.hold()
+    assert not first.hold()
+
+
+class Job:
+    """Job recording whether it runs"""
+
+    def __init__(self, runs):
+        self.runs = runs
+        self.runs.append(self)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+@pytest.fixture
+def start_jobs(redis_client):
+    """
+    Returns a function starting leased jobs on the same lease, returning
+    them along with the list of their runs. Jobs are stopped after the test.
+    """
+    jobs = []
+
+    def start(count, ttl=0.3):
+        runs, started = [], []
+        for _ in range(count):
+            job = LeasedJob('job', Lease(redis_client, 'lease', ttl=ttl),
+                            lambda: Job(runs))
+            job.start()
+            started.append(job)
+        jobs.extend(started)
+        return started, runs
+
+    yield start
+
+    for job in jobs:
+        job.stop(timeout=5)
+        assert not job._thread.is_alive()
+
+
+def test_renewal_does_not_extend_a_taken_over_lease(redis_client):
+    first, second = Lease(redis_client, 'lease', ttl=0.2), Lease(redis_client, 'lease', ttl=10)
+    assert first.hold()
+    redis_client.delete('lease')
+    assert second.hold()
+
+    assert not first.hold()
+    first.release()
+
+    assert redis_client.get('lease') == second.token
+    assert redis_client.pttl('lease') > 5000
+
+
+def test_job_is_started_once(start_jobs):
+    jobs, runs = start_jobs(3)
+
+    time.sleep(0.5)
+
+    assert len(runs) == 1 and runs[0].running
+    assert sum(job.started.is_set() for job in jobs) == 1
+
+
+def test_job_is_stopped_when_the_lease_is_lost(redis_client, start_jobs):
+    (job,), runs = start_jobs(1)
+    time.sleep(0.2)
+    assert len(runs) == 1
+
+    # another process takes the lease over
+    redis_client.set('lease', 'other', px=500)
+    time.sleep(0.3)
+    assert not runs[0].running
+    assert not job.started.is_set()
+
+    # and the job is started again once the lease expired
+    time.sleep(0.5)
+    assert len(runs) == 2 and runs[1].running
+    assert job.started.is_set()
+
+
+def test_stopped_job_releases_its_lease(redis_client, start_jobs):
+    (job,), runs = start_jobs(1)
+    time.sleep(0.2)
+
+    job.stop(timeout=5)
+
+    assert not runs[0].running
+    assert redis_client.get('lease') is None
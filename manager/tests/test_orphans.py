@@ -0,0 +1,51 @@
+"""
+Checks that the ``OrphanIndex`` follows the route changes made by other
+processes.
+"""
+import time
+
+import pytest
+
+from ceryx.db import RedisRouter
+from ceryx.orphans import OrphanIndex
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def orphans(router):
+    router.insert('example.com', '/', 'app:80')
+    orphans = OrphanIndex()
+    orphans.STOP_INTERVAL = 0.05
+    orphans.follow(router, lambda: ['app'])
+    wait_for(lambda: not orphans.is_stale())
+    yield orphans
+    orphans.unfollow()
+
+
+def test_follow_loads_the_index(orphans):
+    assert orphans.report()['routes'] == []
+
+
+def test_follow_applies_changes_of_other_routers(router, orphans):
+    loaded_at = orphans.loaded_at
+    other = RedisRouter(prefix=router.prefix, client=router.client)
+
+    other.insert('example.com', '/api', 'gone:80')
+    wait_for(lambda: orphans.report()['routes'])
+    assert orphans.report()['routes'] == [('example.com', '/api', 'gone:80')]
+
+    other.delete_host('example.com')
+    wait_for(lambda: not orphans.report()['routes'])
+    assert orphans.loaded_at == loaded_at
+
+
+def test_unfollow_stops_the_thread(orphans):
+    follower = orphans._follower
+    orphans.unfollow()
+    assert not follower.is_alive()
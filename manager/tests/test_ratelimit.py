@@ -0,0 +1,149 @@
+"""
+Checks the token bucket and the leased limiter of ``ceryx.ratelimit``, and
+that ``tokenbucket.lua`` behaves as ``TokenBucket``.
+"""
+import random
+
+import pytest
+
+from ceryx.ratelimit import LeasedLimiter, RateLimit, TokenBucket, InvalidRateLimit
+
+
+def test_create_validates():
+    assert RateLimit.create('2.5') == RateLimit(2.5, 3, 'route')
+    assert RateLimit.create(10, 20, 'client') == RateLimit(10.0, 20, 'client')
+    for args in [(0,), ('fast',), (10, 0), (10, 10, 'host')]:
+        with pytest.raises(InvalidRateLimit):
+            RateLimit.create(*args)
+
+
+@pytest.mark.parametrize('args', [('inf',), ('-inf',), ('nan',), (1e400, 5),
+                                  (float('inf'), 5), (10, float('inf'))])
+def test_create_rejects_non_finite_numbers(args):
+    with pytest.raises(InvalidRateLimit):
+        RateLimit.create(*args)
+
+
+def test_policy_round_trip():
+    limit = RateLimit.create(10, 20, 'client')
+    assert RateLimit.from_policy({'rate_limit': limit.to_policy()}) == limit
+    assert RateLimit.from_policy({}) is None
+
+
+@pytest.mark.parametrize('rate, burst, lease', [
+    (1, 1, 1), (100, 200, 10), (100, 5, 5), (1000, 2000, 100), (0.5, 1, 1),
+])
+def test_lease_size(rate, burst, lease):
+    assert RateLimit.create(rate, burst).lease == lease
+
+
+def test_bucket_starts_full_and_allows_a_burst():
+    bucket = TokenBucket(rate=1, burst=5)
+
+    assert bucket.take(0, 3) == (3, 0)
+    assert bucket.take(0, 3) == (2, 0)
+    granted, wait = bucket.take(0, 3)
+    assert granted == 0 and wait == pytest.approx(3)
+
+
+def test_bucket_refills_up_to_the_burst():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.take(0, 5)
+
+    assert bucket.take(0.25, 5) == (2, 0)
+    assert bucket.take(100, 10) == (5, 0)
+
+
+def test_bucket_ignores_time_going_back():
+    bucket = TokenBucket(rate=10, burst=5)
+    bucket.take(10, 5)
+
+    granted, wait = bucket.take(9, 1)
+    assert granted == 0 and wait == pytest.approx(0.1)
+
+
+def test_limiter_consumes_leases_locally():
+    bucket = TokenBucket(rate=100, burst=100)
+    limiter = LeasedLimiter(bucket.take, lease=10)
+
+    assert all(limiter.allow(0) for _ in range(100))
+    assert limiter.round_trips == 10
+    assert not limiter.allow(0)
+
+
+def test_limiter_remembers_denials():
+    bucket = TokenBucket(rate=10, burst=1)
+    limiter = LeasedLimiter(bucket.take, lease=1)
+
+    assert limiter.allow(0)
+    assert not limiter.allow(0.01)
+    round_trips = limiter.round_trips
+    assert not limiter.allow(0.05)
+    assert limiter.round_trips == round_trips
+    assert limiter.allow(0.1)
+
+
+def test_limiter_drops_expired_leases():
+    bucket = TokenBucket(rate=100, burst=100)
+    limiter = LeasedLimiter(bucket.take, lease=10, lease_ttl=1)
+
+    assert limiter.allow(0)
+    assert limiter.tokens == 9
+    assert limiter.allow(2)
+    assert limiter.round_trips == 2
+    assert limiter.tokens == 9
+
+
+def test_limiters_share_the_rate():
+    rate, burst, seconds = 50, 10, 10
+    bucket = TokenBucket(rate, burst)
+    limiters = [LeasedLimiter(bucket.take, RateLimit.create(rate, burst).lease)
+                for _ in range(4)]
+    rng = random.Random(1)
+
+    allowed = 0
+    for i in range(seconds * 1000):
+        allowed += rng.choice(limiters).allow(i / 1000)
+
+    assert allowed <= rate * seconds + burst
+    assert allowed >= rate * seconds * 0.9
+
+
+def requests_sequence(seed):
+    """Returns increasing times with the numbers of tokens requested"""
+    rng = random.Random(seed)
+    now, sequence = 1000.0, []
+    for _ in range(200):
+        now += rng.choice([0, 0, 0.001, 0.01, 0.1, 0.5, 3])
+        sequence.append((round(now, 3), rng.randint(1, 8)))
+    return sequence
+
+
+@pytest.mark.parametrize('rate, burst', [(1, 1), (10, 20), (2.5, 4), (100, 10)])
+@pytest.mark.parametrize('seed', range(3))
+def test_tokenbucket_lua_matches_reference(redis_client, lualib, rate, burst, seed):
+    script = redis_client.register_script(lualib('tokenbucket'))
+    bucket = TokenBucket(rate, burst)
+
+    for now, requested in requests_sequence(seed):
+        granted, wait = script(keys=['bucket'], args=[rate, burst, repr(now), requested])
+        expected_granted, expected_wait = bucket.take(now, requested)
+        assert granted == expected_granted, (now, requested)
+        assert float(wait) == pytest.approx(expected_wait, abs=1e-9), (now, requested)
+
+
+def test_limiter_on_tokenbucket_lua_matches_reference(redis_client, lualib):
+    script = redis_client.register_script(lualib('tokenbucket'))
+    limit = RateLimit.create(20, 5)
+
+    def lua_take(now, requested):
+        granted, wait = script(keys=['bucket'],
+                               args=[limit.rate, limit.burst, repr(now), requested])
+        return granted, float(wait)
+
+    lua_limiter = LeasedLimiter(lua_take, limit.lease)
+    reference = LeasedLimiter(TokenBucket(limit.rate, limit.burst).take, limit.lease)
+
+    for now, _ in requests_sequence(7):
+        assert lua_limiter.allow(now) == reference.allow(now), now
+    assert lua_limiter.round_trips == reference.round_trips
@@ -0,0 +1,54 @@
+"""
+Checks the route lookup of the proxy, ``routelib.lua``, against its Python
+reference ``routing.resolve`` on generated route tables.
+"""
+import random
+
+import pytest
+
+from ceryx import routing
+
+
+SEGMENTS = ('a', 'b', 'ab', 'api', 'v1')
+
+
+def random_path(rng, max_depth=4):
+    path = '/' + '/'.join(rng.choice(SEGMENTS) for _ in range(rng.randint(0, max_depth)))
+    if path != '/' and rng.random() < 0.4:
+        path += '/'
+    return path
+
+
+def random_table(rng):
+    paths = {random_path(rng): f'svc{i}:80' for i in range(rng.randint(1, 30))}
+    for path in list(paths):
+        if rng.random() < 0.2:
+            paths[path] = f'{paths[path]}=2,spare{rng.randint(0, 3)}:80=1'
+    return paths
+
+
+def random_unhealthy(rng, paths):
+    addresses = {item.split('=')[0] for target in paths.values()
+                 for item in target.split(',')}
+    return {a for a in addresses if rng.random() < 0.3}
+
+
+@pytest.mark.parametrize('indexed', [False, True], ids=['scan', 'index'])
+@pytest.mark.parametrize('seed', range(20))
+def test_routelib_matches_reference(redis_client, lualib, seed, indexed):
+    rng = random.Random(seed)
+    script = redis_client.register_script(lualib('routelib'))
+    paths = random_table(rng)
+    unhealthy = random_unhealthy(rng, paths)
+
+    redis_client.hmset('routes', paths)
+    if indexed:
+        redis_client.hmset('paths', routing.build_path_index(paths))
+    if unhealthy:
+        redis_client.sadd('unhealthy', *unhealthy)
+
+    for _ in range(50):
+        path = random_path(rng, max_depth=6)
+        found = script(keys=['routes', 'paths', 'unhealthy'], args=[path])
+        expected = routing.resolve(paths, path, unhealthy)
+        assert (tuple(found[:2]) if found else None) == expected, (paths, path)
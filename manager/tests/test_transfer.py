@@ -0,0 +1,101 @@
+"""
+Checks the incremental parsing of imported routes and the import of
+parsed routes.
+"""
+import io
+import json
+
+import pytest
+
+from ceryx import transfer
+
+
+ROUTES = [{'host': f'h{i}.com', 'path': f'/p{i}', 'target': f'app{i}:80'}
+          for i in range(50)]
+
+
+def parse_json(text, read_size=7):
+    stream = io.BytesIO(text.encode())
+    return list(transfer.parse_json_routes(_Reader(stream, read_size)))
+
+
+class _Reader:
+    """File object ignoring the requested size, as small reads"""
+
+    def __init__(self, stream, read_size):
+        self.stream = stream
+        self.read_size = read_size
+
+    def read(self, size=-1):
+        return self.stream.read(self.read_size)
+
+
+@pytest.mark.parametrize('read_size', [1, 3, 7, 64, 65536])
+def test_json_array_is_parsed_incrementally(read_size):
+    text = json.dumps(ROUTES, indent=2)
+
+    parsed = parse_json(text, read_size)
+
+    assert parsed == [(i + 1, (r['host'], r['path'], r['target']))
+                      for i, r in enumerate(ROUTES)]
+
+
+def test_json_array_with_unicode_split_across_reads():
+    route = {'host': 'ünïcode.com', 'path': '/é', 'target': 'app:80'}
+
+    assert parse_json(json.dumps([route], ensure_ascii=False), 1) == \
+        [(1, ('ünïcode.com', '/é', 'app:80'))]
+
+
+def test_json_array_reads_text_streams():
+    parsed = list(transfer.parse_json_routes(io.StringIO(json.dumps(ROUTES[:2]))))
+    assert [number for number, _ in parsed] == [1, 2]
+
+
+@pytest.mark.parametrize('text', ['[]', ' [ ] ', '\n[\n]\n'])
+def test_empty_json_array(text):
+    assert parse_json(text) == []
+
+
+def test_invalid_routes_are_reported_by_position():
+    text = json.dumps([ROUTES[0], {'host': 'a.com'}, 42, ROUTES[1]])
+
+    parsed = parse_json(text)
+
+    assert [number for number, _ in parsed] == [1, 2, 3, 4]
+    assert isinstance(parsed[1][1], transfer.InvalidRoute)
+    assert isinstance(parsed[2][1], transfer.InvalidRoute)
+    assert parsed[3][1] == ('h1.com', '/p1', 'app1:80')
+
+
+@pytest.mark.parametrize('text', [
+    '{"host": "a.com"}', '[' + json.dumps(ROUTES[0]), '[' + json.dumps(ROUTES[0]) + ',]',
+    '[' + json.dumps(ROUTES[0]) + ' x', '',
+])
+def test_malformed_json_array_ends_with_an_error(text):
+    parsed = parse_json(text)
+
+    number, error = parsed[-1]
+    assert number == 0 and isinstance(error, transfer.InvalidRoute)
+
+
+def test_import_dry_run_writes_nothing(router):
+    router.insert('h0.com', '/p0', 'app0:80')
+    router.insert('h1.com', '/p1', 'old:80')
+    parsed = transfer.parse_json_routes(io.StringIO(json.dumps(ROUTES[:3])))
+
+    reports = list(transfer.import_routes(router, parsed, chunk_size=2, dry_run=True))
+
+    assert [(r['added'], r['changed'], r['unchanged']) for r in reports] == \
+        [(0, 1, 1), (1, 0, 0)]
+    assert router.lookup('h1.com', '/p1') == 'old:80'
+
+
+def test_import_writes_routes(router):
+    lines = io.StringIO(''.join(json.dumps(r) + '\n' for r in ROUTES) + '{"host": 1}\n')
+
+    reports = list(transfer.import_routes(router, transfer.parse_routes(lines), chunk_size=20))
+
+    assert sum(r['added'] for r in reports) == len(ROUTES)
+    assert reports[-1]['errors'] == [{'line': 51, 'error': 'Route field "host" must be a non empty string'}]
+    assert router.lookup('h49.com', '/p49') == 'app49:80'
@@ -0,0 +1,42 @@
+"""
+Checks the in process caches of the users.
+"""
+import time
+
+from ceryx.db import ExpiringCache, RedisUsers
+
+
+def test_cache_evicts_the_least_recently_used():
+    cache = ExpiringCache(2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_cache_entries_expire():
+    cache = ExpiringCache(2, ttl=0.05)
+    cache.set('a', False)
+    assert cache.get('a') is False
+
+    time.sleep(0.06)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_exists_cache_is_bounded(redis_client):
+    users = RedisUsers(prefix='ceryx', client=redis_client)
+    users.client.set('ceryx:users:alice', 'hash')
+
+    for index in range(users.MAX_CACHED_USERS + 10):
+        assert not users.exists(f'unknown-{index}')
+    assert users.exists('alice')
+
+    assert len(users._cache) == users.MAX_CACHED_USERS
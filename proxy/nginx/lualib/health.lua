@@ -0,0 +1,39 @@
+-- Local copy of the set of unhealthy targets maintained by the health
+-- checker of the manager, kept up to date by invalidation.lua, so that
+-- cached and snapshot routes to unhealthy targets are resolved through
+-- Redis, which falls through to healthy routes.
+
+local unhealthy = ngx.shared.ceryx_unhealthy
+
+local _M = {}
+
+-- Loads the unhealthy targets stored in Redis, given a connected client
+function _M.load(red, prefix)
+    local targets, err = red:smembers(prefix .. ":unhealthy")
+    if not targets then
+        return nil, err
+    end
+
+    unhealthy:flush_all()
+    for _, target in ipairs(targets) do
+        unhealthy:set(target, true)
+    end
+
+    return #targets
+end
+
+-- Applies a "<0|1> <target>" health change message
+function _M.apply(message)
+    local state, target = string.match(message, "^([01]) (.+)$")
+    if state == "1" then
+        unhealthy:delete(target)
+    elseif state == "0" then
+        unhealthy:set(target, true)
+    end
+end
+
+function _M.is_healthy(target)
+    return not unhealthy:get(target)
+end
+
+return _M
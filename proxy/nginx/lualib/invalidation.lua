@@ -0,0 +1,134 @@
+-- Subscribes to the hosts invalidated by the manager and bumps their
+-- generation, so that router.lua stops serving their cached routes, and
+-- loads the routing snapshots and the target health changes published by
+-- the manager, and flushes the route statistics (see stats.lua).
+-- Runs in a single worker, the generations being shared by all of them.
+
+if ngx.worker.id() ~= 0 then
+    return
+end
+
+local snapshot = require "snapshot"
+local health = require "health"
+local stats = require "stats"
+
+local generations = ngx.shared.ceryx_generations
+local cache = ngx.shared.ceryx
+
+-- Setup
+
+-- Redis host
+local redis_host = os.getenv("REDIS_HOST")
+if not redis_host then
+    redis_host = "127.0.0.1"
+end
+
+-- Redis port
+local redis_port = os.getenv("REDIS_PORT")
+if not redis_port then
+    redis_port = 6379
+end
+
+-- Redis prefix
+local redis_prefix = os.getenv("REDIS_PREFIX")
+if not redis_prefix then redis_prefix = "ceryx" end
+
+local channel = redis_prefix .. ":invalidations"
+local snapshots_channel = redis_prefix .. ":snapshots"
+local health_channel = redis_prefix .. ":health"
+local retry_delay = 1 -- second
+
+-- End Setup
+
+local subscribe
+
+local function load_snapshot()
+    local redis = require "resty.redis"
+    local red = redis:new()
+    red:set_timeout(10000) -- 10 s, snapshots may be large
+
+    local ok, err = red:connect(redis_host, redis_port)
+    if ok then
+        ok, err = snapshot.load(red, redis_prefix)
+        red:set_keepalive()
+    end
+
+    if not ok then
+        ngx.log(ngx.WARN, "routing snapshot not loaded: " .. err)
+    end
+end
+
+local function load_health(red)
+    local ok, err = health.load(red, redis_prefix)
+    if not ok then
+        ngx.log(ngx.WARN, "unhealthy targets not loaded: " .. err)
+    end
+end
+
+local function retry()
+    if not ngx.worker.exiting() then
+        ngx.timer.at(retry_delay, subscribe)
+    end
+end
+
+subscribe = function(premature)
+    if premature then
+        return
+    end
+
+    local redis = require "resty.redis"
+    local red = redis:new()
+    red:set_timeout(1000) -- 1 s
+
+    local ok, err = red:connect(redis_host, redis_port)
+    if not ok then
+        ngx.log(ngx.ERR, "failed to connect to redis at " .. redis_host .. ":" .. redis_port .. ": " .. err)
+        return retry()
+    end
+
+    ok, err = red:subscribe(channel, snapshots_channel, health_channel)
+    if not ok then
+        ngx.log(ngx.ERR, "failed to subscribe to " .. channel .. ": " .. err)
+        red:close()
+        return retry()
+    end
+
+    -- invalidations may have been missed while not subscribed
+    cache:flush_all()
+    load_snapshot()
+
+    local health_red = redis:new()
+    health_red:set_timeout(1000)
+    ok, err = health_red:connect(redis_host, redis_port)
+    if ok then
+        load_health(health_red)
+        health_red:set_keepalive()
+    else
+        ngx.log(ngx.WARN, "unhealthy targets not loaded: " .. err)
+    end
+
+    while not ngx.worker.exiting() do
+        local res, err = red:read_reply()
+        if res then
+            if res[1] == "message" and res[2] == channel then
+                generations:incr(res[3], 1, 0)
+                snapshot.invalidate(res[3])
+            elseif res[1] == "message" and res[2] == snapshots_channel then
+                load_snapshot()
+            elseif res[1] == "message" and res[2] == health_channel then
+                health.apply(res[3])
+                -- cached routes may have fallen through the changed target
+                cache:flush_all()
+            end
+        elseif err ~= "timeout" then
+            ngx.log(ngx.ERR, "lost subscription to " .. channel .. ": " .. err)
+            break
+        end
+    end
+
+    red:close()
+    retry()
+end
+
+ngx.timer.at(0, subscribe)
+stats.start(redis_host, redis_port, redis_prefix)
@@ -0,0 +1,138 @@
+-- Policies of the routes, stored as JSON next to their targets and
+-- returned with them by every lookup, for example:
+--
+--   {"rate_limit": {"rate": 10, "burst": 20, "per": "client"},
+--    "cache": {"ttl": 60, "key": ["host", "path", "args"], "bypass": ["Authorization"]}}
+--
+-- Decoded policies are cached per worker, so that applying the policy of
+-- a route costs a table lookup.
+
+local cjson = require "cjson.safe"
+local ratelimit = require "ratelimit"
+
+local MAX_DECODED = 10000
+
+-- The proxy_cache_path zone of the cached routes, see ceryx.conf
+local CACHE_ZONE = "ceryx"
+local MAX_CACHE_TTL = 86400
+
+local KEY_VARIABLES = {
+    scheme = "scheme",
+    host = "host",
+    path = "uri",
+    args = "args",
+}
+
+local _M = {}
+
+local decoded_policies = {}
+local decoded_count = 0
+
+-- Returns the nginx variables of cache key components, such as "path" or
+-- "header:Accept-Language", the prefix being implied for bypass headers
+local function cache_variables(components, prefix)
+    local variables = {}
+    for _, component in ipairs(components) do
+        component = (prefix or "") .. tostring(component)
+        local variable = KEY_VARIABLES[component]
+        local header = string.match(component, "^header:(.+)$")
+        local cookie = string.match(component, "^cookie:(.+)$")
+        if header then
+            variable = "http_" .. string.gsub(string.lower(header), "-", "_")
+        elseif cookie then
+            variable = "cookie_" .. cookie
+        end
+        if variable then
+            variables[#variables + 1] = variable
+        end
+    end
+    return variables
+end
+
+-- Enables the response cache for the current request, unless it has a
+-- bypass header. proxy_cache_valid does not take variables, so entries
+-- expire with the TTL bucket part of their key, each route having its
+-- own offset so that its entries do not all expire at once.
+local function enable_cache(route, cache)
+    for _, variable in ipairs(cache.bypass) do
+        if ngx.var[variable] then
+            return
+        end
+    end
+
+    local parts = {route}
+    for _, variable in ipairs(cache.key) do
+        parts[#parts + 1] = ngx.var[variable] or ""
+    end
+    local key = table.concat(parts, "|")
+
+    local offset = ngx.crc32_short(route) % cache.ttl
+    local bucket = math.floor((ngx.time() + offset) / cache.ttl)
+
+    ngx.var.ceryx_cache = CACHE_ZONE
+    ngx.var.ceryx_cache_key = bucket .. "|" .. key
+    ngx.var.ceryx_cache_bypass = ""
+end
+
+local function decode(policy)
+    local decoded = decoded_policies[policy]
+    if decoded then
+        return decoded
+    end
+
+    decoded = cjson.decode(policy) or {}
+
+    local limit = decoded.rate_limit
+    if type(limit) == "table" and tonumber(limit.rate) and tonumber(limit.rate) > 0 then
+        local rate = tonumber(limit.rate)
+        decoded.rate_limit = {
+            rate = rate,
+            burst = tonumber(limit.burst) or math.max(math.ceil(rate), 1),
+            per = limit.per,
+        }
+    else
+        decoded.rate_limit = nil
+    end
+
+    local cache = decoded.cache
+    local ttl = type(cache) == "table" and tonumber(cache.ttl)
+    if ttl and ttl >= 1 then
+        decoded.cache = {
+            ttl = math.min(math.floor(ttl), MAX_CACHE_TTL),
+            key = cache_variables(type(cache.key) == "table" and cache.key or {"host", "path", "args"}),
+            bypass = cache_variables(type(cache.bypass) == "table" and cache.bypass or {}, "header:"),
+        }
+    else
+        decoded.cache = nil
+    end
+
+    if decoded_count >= MAX_DECODED then
+        decoded_policies = {}
+        decoded_count = 0
+    end
+    decoded_policies[policy] = decoded
+    decoded_count = decoded_count + 1
+
+    return decoded
+end
+
+-- Applies the policy of the "<host> <path>" route to the current request,
+-- ending it if it is not allowed
+function _M.apply(route, policy)
+    if not policy or policy == "" then
+        return
+    end
+
+    local decoded = decode(policy)
+
+    if decoded.rate_limit and not ratelimit.allow(route, decoded.rate_limit, ngx.var.remote_addr) then
+        ngx.header["Retry-After"] = 1
+        return ngx.exit(ngx.HTTP_TOO_MANY_REQUESTS)
+    end
+
+    if decoded.cache then
+        enable_cache(route, decoded.cache)
+    end
+end
+
+return _M
@@ -0,0 +1,103 @@
+-- Rate limiting of the routes having a "rate_limit" policy, such as
+-- {"rate": 10, "burst": 20, "per": "client"}.
+--
+-- The token bucket of a route, or of a client of a route, lives in Redis
+-- and is shared by every proxy (see tokenbucket.lua). Tokens are taken in
+-- leases covering a tenth of a second of traffic and consumed locally, so
+-- that requests under the limit rarely query Redis, and denials are
+-- remembered until the bucket should have a lease again. The Python
+-- reference is LeasedLimiter in ceryx/ratelimit.py in the manager.
+
+local redis = require "resty.redis"
+
+local leases = ngx.shared.ceryx_ratelimit
+
+-- Setup
+
+local redis_host = os.getenv("REDIS_HOST") or "127.0.0.1"
+local redis_port = os.getenv("REDIS_PORT") or 6379
+local redis_prefix = os.getenv("REDIS_PREFIX") or "ceryx"
+
+-- End Setup
+
+local LEASE_SECONDS = 0.1
+local LEASE_TTL = 1 -- second
+local SCRIPT_PATH = "/usr/local/openresty/nginx/lualib/tokenbucket.lua"
+
+local _M = {}
+
+local script_source, script_sha
+
+local function take(key, limit, requested)
+    local red = redis:new()
+    red:set_timeout(100) -- 100 ms
+    local ok, err = red:connect(redis_host, redis_port)
+    if not ok then
+        return nil, err
+    end
+
+    if not script_source then
+        local file = io.open(SCRIPT_PATH)
+        if not file then
+            return nil, "failed to read " .. SCRIPT_PATH
+        end
+        script_source = file:read("*all")
+        file:close()
+    end
+
+    local args = {limit.rate, limit.burst, ngx.now(), requested}
+    local res
+    if script_sha then
+        res, err = red:evalsha(script_sha, 1, key, unpack(args))
+    end
+    if not script_sha or (err and string.find(err, "NOSCRIPT", 1, true)) then
+        script_sha, err = red:script("load", script_source)
+        if script_sha then
+            res, err = red:evalsha(script_sha, 1, key, unpack(args))
+        end
+    end
+
+    if not res then
+        red:close()
+        return nil, err
+    end
+
+    red:set_keepalive()
+    return tonumber(res[1]), tonumber(res[2])
+end
+
+-- Checks if a request to the "<host> <path>" route from the given client
+-- is allowed by the rate limit of the route
+function _M.allow(route, limit, client)
+    local key = route
+    if limit.per == "client" then
+        key = route .. " " .. client
+    end
+
+    local left = leases:incr("t:" .. key, -1)
+    if left and left >= 0 then
+        return true
+    end
+
+    if leases:get("d:" .. key) then
+        return false
+    end
+
+    local lease = math.max(1, math.min(limit.burst, math.ceil(limit.rate * LEASE_SECONDS)))
+    local granted, wait = take(redis_prefix .. ":ratelimit:" .. key, limit, lease)
+    if not granted then
+        -- the limits can not be enforced without Redis, requests go through
+        ngx.log(ngx.ERR, "failed to take rate limit tokens: " .. wait)
+        return true
+    end
+
+    if granted == 0 then
+        leases:set("d:" .. key, true, math.max(wait, 0.001))
+        return false
+    end
+
+    leases:set("t:" .. key, granted - 1, LEASE_TTL)
+    return true
+end
+
+return _M
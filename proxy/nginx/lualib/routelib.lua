@@ -1,34 +1,35 @@
-function string.starts(input, search)
+-- Resolves the target of a request path for a host.
+--
+-- KEYS[1]: the host routes hash (path -> target)
+-- KEYS[2]: the host path index hash (normalized path -> path), optional
+-- KEYS[3]: the set of unhealthy targets, optional
+-- KEYS[4]: the host policies hash (path -> JSON policy), optional
+-- ARGV[1]: the request path
+--
+-- Paths whose target is unhealthy are skipped, so that the next matching
+-- path is used instead. Returns {target, unrooted path, route path, policy}
+-- or nil, the policy being '' if the route path has none. The Python
+-- reference of this script is ceryx/routing.py in the manager.
+
+local function starts(input, search)
     return string.sub(input, 1, string.len(search)) == search
 end
 
-function string.ends(input, search)
+local function ends(input, search)
     return search == '' or string.sub(input, -string.len(search)) == search
 end
 
-function string.ocurrencies(input, search)
-    local count = 0
-    for s in string.gfind(input, search) do
-        count = count + 1
-    end
+local function ocurrencies(input, search)
+    local _, count = string.gsub(input, search, '')
     return count
 end
 
 -- namespace for path related functions
 local Path = {}
 
-function Path.sort(lhs, rhs)
-    local l_ocurr = string.ocurrencies(lhs, '/')
-    local r_ocurr = string.ocurrencies(rhs, '/')
-    if l_ocurr == r_ocurr then
-        return lhs > rhs
-    end
-    return l_ocurr > r_ocurr
-end
-
 -- normalize path by adding a trailing '/' if needed
 function Path.normalize(path)
-    if not string.ends(path, '/') then
+    if not ends(path, '/') then
         return path .. '/'
     else
         return path
@@ -39,7 +40,7 @@ end
 function Path.matches(path, search)
     local npath = Path.normalize(path)
     local nsearch = Path.normalize(search)
-    return string.starts(path, nsearch) or npath == nsearch
+    return starts(path, nsearch) or npath == nsearch
 end
 
 -- strip the root of a path
@@ -53,7 +54,7 @@ function Path.unroot(path, root)
         return path
     end
 
-    local new_path = string.sub(arg_path, string.len(paths[1]) + 1)
+    local new_path = string.sub(path, string.len(root) + 1)
 
     if string.sub(new_path, 1, 1) ~= '/' then
         new_path = '/' .. new_path
@@ -62,32 +63,117 @@ function Path.unroot(path, root)
     return new_path
 end
 
-local arg_host, arg_path = KEYS[1], ARGV[1]
-local paths = {}
-local idx = 1
+-- namespace for target related functions
+local Target = {}
+
+-- verify that a target is not marked as unhealthy, weighted targets
+-- ("a:8080=3,b=1", see targets.lua) being healthy if any target with a
+-- weight is
+function Target.healthy(health_key, target)
+    if not health_key then
+        return true
+    end
+
+    if not string.find(target, '[,=]') then
+        return redis.call('sismember', health_key, target) == 0
+    end
+
+    for item in string.gmatch(target, '[^,]+') do
+        local address, weight = string.match(item, '^%s*(.-)%s*=%s*(%d+)%s*$')
+        if not address then
+            address, weight = string.match(item, '^%s*(.-)%s*$'), '1'
+        end
+        if tonumber(weight) > 0 and redis.call('sismember', health_key, address) == 0 then
+            return true
+        end
+    end
+
+    return false
+end
+
+-- find the best matching path with a healthy target by checking every path
+-- of the host
+function Path.scan(host_key, health_key, path)
+    local candidates = {}
+
+    for _, candidate in ipairs(redis.call('hkeys', host_key)) do
+        if Path.matches(path, candidate) then
+            candidates[#candidates + 1] = candidate
+        end
+    end
+
+    table.sort(candidates, function(a, b)
+        local count_a, count_b = ocurrencies(a, '/'), ocurrencies(b, '/')
+        if count_a ~= count_b then
+            return count_a > count_b
+        end
+        return a > b
+    end)
+
+    for _, candidate in ipairs(candidates) do
+        local target = redis.call('hget', host_key, candidate)
+        if Target.healthy(health_key, target) then
+            return candidate, target
+        end
+    end
 
-local routes = redis.call('hkeys', arg_host)
-if #routes == 0 then
     return nil
 end
 
-for _, path in ipairs(routes) do
-    if Path.matches(arg_path, path) then
-        paths[idx] = path
-        idx = idx + 1
+-- find the best matching path with a healthy target by probing the path
+-- index with every prefix of the path ending in '/', longest first
+function Path.probe(host_key, index_key, health_key, path)
+    local npath = Path.normalize(path)
+    local slashes = {}
+
+    for pos in string.gmatch(npath, '()/') do
+        slashes[#slashes + 1] = pos
     end
+
+    for i = #slashes, 1, -1 do
+        local found = redis.call('hget', index_key, string.sub(npath, 1, slashes[i]))
+        if found then
+            local target = redis.call('hget', host_key, found)
+            if Target.healthy(health_key, target) then
+                return found, target
+            end
+
+            -- "/a" is only indexed when "/a/" does not exist, so it has to be
+            -- checked as well when "/a/" is unhealthy
+            if ends(found, '/') then
+                local other = string.sub(found, 1, -2)
+                if not ends(other, '/') then
+                    target = redis.call('hget', host_key, other)
+                    if target and Target.healthy(health_key, target) then
+                        return other, target
+                    end
+                end
+            end
+        end
+    end
+
+    return nil
 end
 
-table.sort(paths, Path.sort)
+local arg_host, arg_index, arg_health, arg_policies = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local arg_path = ARGV[1]
 
-if #paths == 0 then
-  return nil
+local path, target
+if arg_index and redis.call('exists', arg_index) == 1 then
+    path, target = Path.probe(arg_host, arg_index, arg_health, arg_path)
+else
+    path, target = Path.scan(arg_host, arg_health, arg_path)
+end
+
+if not path then
+    return nil
 end
 
-local path = paths[1]
-local target_path = Path.unroot(arg_path, path)
+local policy = arg_policies and redis.call('hget', arg_policies, path)
 
 return {
-    redis.call('hget', arg_host, path),
-    target_path
-}
\ No newline at end of file
+    target,
+    Path.unroot(arg_path, path),
+    path,
+    policy or ''
+}
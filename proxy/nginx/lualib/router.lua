@@ -2,18 +2,22 @@ local container_url = ngx.var.container_url
 local host = ngx.var.host
 local path = ngx.var.uri
 local cache = ngx.shared.ceryx
+local generations = ngx.shared.ceryx_generations
+local targets = require "targets"
+local policies = require "policies"
 
 -- Setup
 
 -- Debug Mode
 local debug_mode = os.getenv("DEBUG")
 
--- Cache expiration time
+-- Cache expiration time, routes are also dropped from the cache as soon as
+-- their host is invalidated by the manager (see invalidation.lua)
 local cache_exptime = os.getenv("CACHE_EXPTIME")
 if not cache_exptime then
-    cache_exptime = 60 -- 1 minute
+    cache_exptime = 3600 -- 1 hour
 else
-    cache_exptime = tonumber(exptime)
+    cache_exptime = tonumber(cache_exptime)
 end
 
 -- Redis host
@@ -34,11 +38,49 @@ if not redis_prefix then redis_prefix = "ceryx" end
 
 -- End Setup
 
--- Check if key exists in local cache
-local res, flags = cache:get(host .. path)
-if res then
-    ngx.var.container_url = res
-    return
+-- Proxies the request to the target of the "<host> <path>" route, once
+-- its policy allows it
+local function route_to(target, target_path, route, policy)
+    ngx.var.container_url = targets.pick(target)
+    ngx.var.container_path = target_path
+    ngx.var.ceryx_route = route
+    policies.apply(route, policy)
+end
+
+-- Cached values are "<target> <route path length> <policy length>
+-- <route path><policy><target path>"
+local function encode_cached(target, target_path, route_path, policy)
+    return target .. " " .. string.len(route_path) .. " " .. string.len(policy) .. " "
+        .. route_path .. policy .. target_path
+end
+
+local function decode_cached(cached)
+    local target, route_length, policy_length, start = string.match(cached, "^(%S+) (%d+) (%d+) ()")
+    local route_end = start + tonumber(route_length)
+    local policy_end = route_end + tonumber(policy_length)
+    return target, string.sub(cached, policy_end), string.sub(cached, start, route_end - 1),
+        string.sub(cached, route_end, policy_end - 1)
+end
+
+-- Check if key exists in local cache and was stored after the last
+-- invalidation of the host, whose generation is kept in the flags
+local cache_key = "route:" .. host .. path
+local generation = generations:get(host) or 0
+local cached, cached_generation = cache:get(cache_key)
+if cached and cached_generation == generation then
+    local target, target_path, route_path, policy = decode_cached(cached)
+    if targets.is_healthy(target) then
+        return route_to(target, target_path, host .. " " .. route_path, policy)
+    end
+end
+
+-- Check the routing snapshot, which also knows definite misses
+local snapshot = require "snapshot"
+local found, target, target_path, route, policy = snapshot.resolve(host, path)
+if found and targets.is_healthy(target) then
+    return route_to(target, target_path, route, policy)
+elseif found == false then
+    ngx.exit(ngx.HTTP_NOT_FOUND)
 end
 
 local redis = require "resty.redis"
@@ -76,11 +118,14 @@ if not route_script then
     end
 end
 
--- Construct Redis key
+-- Construct Redis keys of the host routes, path index and policies
 local key = redis_prefix .. ":routes:" .. host
+local index_key = redis_prefix .. ":paths:" .. host
+local health_key = redis_prefix .. ":unhealthy"
+local policies_key = redis_prefix .. ":policies:" .. host
 
 -- Try to get target for host
-res, err = red:evalsha(route_script, 1, key, path)
+res, err = red:evalsha(route_script, 4, key, index_key, health_key, policies_key, path)
 
 -- Exit if route could not be read
 if err then
@@ -91,24 +136,23 @@ end
 if not res or res == ngx.null then
     ngx.log(ngx.WARN, "no route for host: " .. host .. path)
 
-    -- Construct Redis key for $wildcard
+    -- Construct Redis keys for $wildcard
     key = redis_prefix .. ":routes:$wildcard"
-    res, err = red:get(key)
-    
+    index_key = redis_prefix .. ":paths:$wildcard"
+    policies_key = redis_prefix .. ":policies:$wildcard"
+    res, err = red:evalsha(route_script, 4, key, index_key, health_key, policies_key, path)
+
     if not res or res == ngx.null then
         ngx.exit(ngx.HTTP_NOT_FOUND)
     end
 
-    ngx.var.container_url = res[1]
-    ngx.var.container_path = res[2]
-
-    return
+    return route_to(res[1], res[2], "$wildcard " .. res[3], res[4])
 end
 
--- Save found key to local cache for specified time in seconds
+-- Save found key to local cache for specified time in seconds, weighted
+-- targets being picked for each request
 if not debug_mode then
-    cache:set(host, res, cache_exptime)
+    cache:set(cache_key, encode_cached(res[1], res[2], res[3], res[4]), cache_exptime, generation)
 end
 
-ngx.var.container_url = res[1]
-ngx.var.container_path = res[2]
+route_to(res[1], res[2], host .. " " .. res[3], res[4])
@@ -0,0 +1,159 @@
+-- Local copy of the routing snapshot published by the manager, used to
+-- answer lookups, including definite misses, without querying Redis.
+--
+-- The snapshot is loaded by invalidation.lua. It is only trusted if no
+-- route changed between its build and its load, and hosts invalidated
+-- after its load are resolved through Redis until the next snapshot.
+
+local cjson = require "cjson.safe"
+
+local snapshot = ngx.shared.ceryx_snapshot
+
+local WILDCARD_HOST = "$wildcard"
+
+local _M = {}
+
+-- path matching, same as routelib.lua
+
+local function normalize(path)
+    if string.sub(path, -1) ~= "/" then
+        return path .. "/"
+    end
+    return path
+end
+
+local function matches(path, search)
+    local nsearch = normalize(search)
+    return string.sub(path, 1, string.len(nsearch)) == nsearch or normalize(path) == nsearch
+end
+
+local function unroot(path, root)
+    if path == root then
+        return "/"
+    end
+
+    if root == "/" then
+        return path
+    end
+
+    local new_path = string.sub(path, string.len(root) + 1)
+
+    if string.sub(new_path, 1, 1) ~= "/" then
+        new_path = "/" .. new_path
+    end
+
+    return new_path
+end
+
+local function ocurrencies(input, search)
+    local _, count = string.gsub(input, search, "")
+    return count
+end
+
+local function resolve_paths(paths, path)
+    local best, best_count = nil, -1
+
+    for candidate, _ in pairs(paths) do
+        if matches(path, candidate) then
+            local count = ocurrencies(candidate, "/")
+            if count > best_count or (count == best_count and candidate > best) then
+                best, best_count = candidate, count
+            end
+        end
+    end
+
+    if not best then
+        return nil
+    end
+
+    return paths[best], unroot(path, best), best
+end
+
+-- Loads the snapshot stored in Redis, given a connected client
+function _M.load(red, prefix)
+    local data, err = red:get(prefix .. ":snapshot")
+    if not data or data == ngx.null then
+        return nil, err or "no snapshot"
+    end
+
+    local generation
+    generation, err = red:get(prefix .. ":generation")
+    if not generation then
+        return nil, err
+    end
+
+    local decoded = cjson.decode(data)
+    if not decoded then
+        return nil, "invalid snapshot"
+    end
+
+    snapshot:flush_all()
+
+    for host, paths in pairs(decoded.routes) do
+        local ok
+        ok, err = snapshot:safe_set("h:" .. host, cjson.encode(paths))
+        if not ok then
+            -- a partial snapshot would answer misses wrongly
+            snapshot:flush_all()
+            return nil, "failed to store snapshot: " .. err
+        end
+    end
+
+    for host, paths in pairs(decoded.policies or {}) do
+        for route_path, policy in pairs(paths) do
+            local ok
+            ok, err = snapshot:safe_set("p:" .. host .. " " .. route_path, cjson.encode(policy))
+            if not ok then
+                snapshot:flush_all()
+                return nil, "failed to store snapshot: " .. err
+            end
+        end
+    end
+
+    snapshot:set("version", decoded.version)
+    snapshot:set("ready", tonumber(generation) == decoded.version)
+
+    return decoded.version
+end
+
+-- Marks a host as changed after the snapshot was loaded
+function _M.invalidate(host)
+    snapshot:set("stale:" .. host, true)
+end
+
+local function resolve_host(host, path)
+    if snapshot:get("stale:" .. host) then
+        return nil
+    end
+
+    local paths = snapshot:get("h:" .. host)
+    if not paths then
+        return false
+    end
+
+    local target, target_path, route_path = resolve_paths(cjson.decode(paths), path)
+    if not target then
+        return false
+    end
+
+    local route = host .. " " .. route_path
+    return true, target, target_path, route, snapshot:get("p:" .. route) or ""
+end
+
+-- Resolves a request, falling back to the wildcard routes. Returns
+-- true, target, path, the "<host> <path>" route and its policy on a hit,
+-- false on a definite miss and nil if the snapshot can not tell.
+function _M.resolve(host, path)
+    if not snapshot:get("ready") then
+        return nil
+    end
+
+    local found, target, target_path, route, policy = resolve_host(host, path)
+    if found ~= false or host == WILDCARD_HOST then
+        return found, target, target_path, route, policy
+    end
+
+    return resolve_host(WILDCARD_HOST, path)
+end
+
+return _M
@@ -0,0 +1,238 @@
+-- Traffic statistics of the routes.
+--
+-- Every worker counts the hits of each route per time bucket in a shared
+-- dict, and the clients of each route in another one, without querying
+-- Redis. The clients are added with safe_add and capped per bucket, so that
+-- many distinct clients never evict the hit counts. The first worker
+-- flushes the counts every few seconds, in pipelines of at most MAX_FLUSHED
+-- keys, to the keys read by RedisStats in the manager:
+--
+--   <prefix>:stats:hits:<bucket>                  sorted set of route hits
+--   <prefix>:stats:requests:<bucket>              routed requests
+--   <prefix>:stats:clients:<bucket>               HyperLogLog of clients
+--   <prefix>:stats:clients:<bucket>:<host> <path> HyperLogLog of route clients
+--
+-- Routes are identified as "<host> <path>", path being the route path.
+
+local redis = require "resty.redis"
+
+local stats = ngx.shared.ceryx_stats
+local clients = ngx.shared.ceryx_stats_clients
+
+-- Setup
+
+-- Seconds covered by a bucket, which must match CERYX_STATS_BUCKET
+local bucket_size = tonumber(os.getenv("STATS_BUCKET")) or 60
+
+-- Seconds the buckets are kept in Redis
+local retention = tonumber(os.getenv("STATS_RETENTION")) or 86400
+
+-- Seconds between two flushes
+local flush_interval = tonumber(os.getenv("STATS_FLUSH_INTERVAL")) or 5
+
+-- Distinct clients of the routes tracked per bucket, the others being
+-- ignored until the next bucket
+local max_clients = tonumber(os.getenv("STATS_MAX_CLIENTS")) or 100000
+
+-- End Setup
+
+local MAX_FLUSHED = 10000
+-- passes of MAX_FLUSHED keys per flush, the keys left waiting for the next
+-- flush
+local MAX_PASSES = 20
+local MAX_PFADD = 1000
+
+if redis.add_commands then
+    -- needed by lua-resty-redis versions only knowing the common commands
+    redis.add_commands("pfadd")
+end
+
+local _M = {}
+
+local function current_bucket()
+    return math.floor(ngx.now() / bucket_size) * bucket_size
+end
+
+-- Accounts a request routed to the given "<host> <path>" route
+function _M.record(route, client)
+    if not route or route == "" then
+        return
+    end
+
+    local bucket = current_bucket()
+    stats:incr(bucket .. " " .. route, 1, 0)
+
+    local key = bucket .. " " .. client .. " " .. route
+    if clients:get(key) then
+        return
+    end
+
+    -- "n <bucket>" counts the clients tracked in the bucket
+    local counter = "n " .. bucket
+    if (clients:get(counter) or 0) >= max_clients then
+        return
+    end
+    local tracked = clients:incr(counter, 1, 0)
+    if not tracked or tracked > max_clients then
+        return
+    end
+    if not clients:safe_add(key, true) then
+        -- tracked meanwhile by another worker, or the dict is full
+        clients:incr(counter, -1)
+    end
+end
+
+-- Groups the client keys by HyperLogLog, deleting the counters of the past
+-- buckets. Returns the client keys.
+local function collect_clients(keys, current, prefix, members_by_key)
+    local flushed = {}
+
+    for _, key in ipairs(keys) do
+        local bucket, client, route = string.match(key, "^(%d+) (%S+) (.+)$")
+        if bucket then
+            for _, hll_key in ipairs({
+                prefix .. ":stats:clients:" .. bucket,
+                prefix .. ":stats:clients:" .. bucket .. ":" .. route,
+            }) do
+                local members = members_by_key[hll_key]
+                if not members then
+                    members = {}
+                    members_by_key[hll_key] = members
+                end
+                members[#members + 1] = client
+            end
+            flushed[#flushed + 1] = key
+        else
+            bucket = tonumber(string.match(key, "^n (%d+)$"))
+            if bucket and bucket < current then
+                clients:delete(key)
+            end
+        end
+    end
+
+    return flushed
+end
+
+-- Writes a pass of at most MAX_FLUSHED hit keys and MAX_FLUSHED client keys
+-- to Redis and forgets the written counts. Returns the number of keys
+-- written and whether keys may be left.
+local function flush_pass(red, prefix)
+    local hit_keys = stats:get_keys(MAX_FLUSHED)
+    local client_keys = clients:get_keys(MAX_FLUSHED)
+    local more = #hit_keys == MAX_FLUSHED or #client_keys == MAX_FLUSHED
+    if #hit_keys == 0 and #client_keys == 0 then
+        return 0, false
+    end
+
+    local current = current_bucket()
+    local hits, members_by_key, expiring = {}, {}, {}
+
+    for _, key in ipairs(hit_keys) do
+        local bucket, route = string.match(key, "^(%d+) (.+)$")
+        local count = stats:get(key)
+        if bucket and count and count > 0 then
+            hits[#hits + 1] = {bucket, route, count, key}
+        else
+            stats:delete(key)
+        end
+    end
+    local flushed_clients = collect_clients(client_keys, current, prefix, members_by_key)
+
+    if #hits == 0 and #flushed_clients == 0 then
+        return 0, more
+    end
+
+    red:init_pipeline()
+
+    for _, hit in ipairs(hits) do
+        local bucket, route, count = hit[1], hit[2], hit[3]
+        local hits_key = prefix .. ":stats:hits:" .. bucket
+        local requests_key = prefix .. ":stats:requests:" .. bucket
+        red:zincrby(hits_key, count, route)
+        red:incrby(requests_key, count)
+        expiring[hits_key] = true
+        expiring[requests_key] = true
+    end
+
+    for hll_key, members in pairs(members_by_key) do
+        for i = 1, #members, MAX_PFADD do
+            red:pfadd(hll_key, unpack(members, i, math.min(i + MAX_PFADD - 1, #members)))
+        end
+        expiring[hll_key] = true
+    end
+
+    for key, _ in pairs(expiring) do
+        red:expire(key, retention)
+    end
+
+    local res, err = red:commit_pipeline()
+    if not res then
+        return nil, err
+    end
+
+    -- counts added meanwhile are kept for the next flush, the written keys
+    -- being deleted so that the next pass gets the following ones
+    for _, hit in ipairs(hits) do
+        if stats:incr(hit[4], -hit[3]) == 0 then
+            stats:delete(hit[4])
+        end
+    end
+    for _, key in ipairs(flushed_clients) do
+        clients:delete(key)
+    end
+
+    return #hits + #flushed_clients, more
+end
+
+-- Writes the accumulated counts to Redis, given a connected client, and
+-- forgets the written counts. Returns the number of keys written.
+function _M.flush(red, prefix)
+    local total = 0
+
+    for _ = 1, MAX_PASSES do
+        local flushed, more = flush_pass(red, prefix)
+        if not flushed then
+            -- more is the error
+            return nil, more
+        end
+        total = total + flushed
+        if not more or flushed == 0 then
+            break
+        end
+    end
+
+    return total
+end
+
+-- Flushes the statistics every few seconds, in a timer
+function _M.start(redis_host, redis_port, prefix)
+    local flush
+
+    flush = function(premature)
+        if premature then
+            return
+        end
+
+        local red = redis:new()
+        red:set_timeout(1000)
+        local ok, err = red:connect(redis_host, redis_port)
+        if ok then
+            ok, err = _M.flush(red, prefix)
+        end
+
+        if ok then
+            red:set_keepalive()
+        else
+            red:close()
+            ngx.log(ngx.WARN, "failed to flush route statistics: " .. err)
+        end
+
+        if not ngx.worker.exiting() then
+            ngx.timer.at(flush_interval, flush)
+        end
+    end
+
+    return ngx.timer.at(flush_interval, flush)
+end
+
+return _M
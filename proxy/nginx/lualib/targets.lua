@@ -0,0 +1,99 @@
+-- Selection among the weighted targets of a route.
+--
+-- A route target is either a single "service[:port]" address or weighted
+-- addresses, such as "app:8080=9,app-canary:8080=1", an address without a
+-- weight having a weight of 1. One address is picked for each request, at
+-- random in proportion of the weights, among the healthy ones if any. The
+-- Python reference is ceryx/targets.py in the manager.
+
+local health = require "health"
+
+local MAX_PARSED = 10000
+
+local _M = {}
+
+-- parsed weighted targets, per worker
+local parsed_targets = {}
+local parsed_count = 0
+
+math.randomseed(ngx.now() * 1000 + ngx.worker.pid())
+
+local function parse(target)
+    local parsed = parsed_targets[target]
+    if parsed then
+        return parsed
+    end
+
+    parsed = {}
+    for item in string.gmatch(target, "[^,]+") do
+        local address, weight = string.match(item, "^%s*(.-)%s*=%s*(%d+)%s*$")
+        if not address then
+            address, weight = string.match(item, "^%s*(.-)%s*$"), "1"
+        end
+        weight = tonumber(weight)
+        if weight > 0 then
+            parsed[#parsed + 1] = {address, weight}
+        end
+    end
+
+    if parsed_count >= MAX_PARSED then
+        parsed_targets = {}
+        parsed_count = 0
+    end
+    parsed_targets[target] = parsed
+    parsed_count = parsed_count + 1
+
+    return parsed
+end
+
+-- Checks if any address of the target receiving requests is healthy
+function _M.is_healthy(target)
+    if not string.find(target, "[,=]") then
+        return health.is_healthy(target)
+    end
+
+    for _, item in ipairs(parse(target)) do
+        if health.is_healthy(item[1]) then
+            return true
+        end
+    end
+    return false
+end
+
+-- Picks the address of the target to proxy the request to
+function _M.pick(target)
+    if not string.find(target, "[,=]") then
+        return target
+    end
+
+    local items = parse(target)
+    local candidates, total = {}, 0
+    for _, item in ipairs(items) do
+        if health.is_healthy(item[1]) then
+            candidates[#candidates + 1] = item
+            total = total + item[2]
+        end
+    end
+
+    if total == 0 then
+        -- every address is unhealthy, spread the requests anyway
+        candidates = items
+        for _, item in ipairs(items) do
+            total = total + item[2]
+        end
+    end
+
+    if total == 0 then
+        return nil
+    end
+
+    local point = math.random(total)
+    for _, item in ipairs(candidates) do
+        point = point - item[2]
+        if point <= 0 then
+            return item[1]
+        end
+    end
+end
+
+return _M
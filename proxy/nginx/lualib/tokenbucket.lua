@@ -0,0 +1,42 @@
+-- Takes tokens from a token bucket, atomically.
+--
+-- KEYS[1]: the bucket hash (tokens, ts)
+-- ARGV[1]: the rate, in tokens per second
+-- ARGV[2]: the burst, the capacity of the bucket
+-- ARGV[3]: the current time, in seconds
+-- ARGV[4]: the number of tokens requested
+--
+-- Returns {granted tokens, seconds until the requested tokens are
+-- available}, the wait being 0 if tokens were granted, so that denied
+-- proxies come back for a whole lease. The Python reference of this script is
+-- TokenBucket in ceryx/ratelimit.py in the manager.
+
+local key = KEYS[1]
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local now, requested = tonumber(ARGV[3]), tonumber(ARGV[4])
+
+local state = redis.call('hmget', key, 'tokens', 'ts')
+local tokens, ts = tonumber(state[1]), tonumber(state[2])
+if not tokens then
+    tokens, ts = burst, now
+end
+
+-- the clocks of the proxies may be slightly apart, time never goes back
+if now > ts then
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    ts = now
+end
+
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+
+redis.call('hmset', key, 'tokens', tokens, 'ts', ts)
+-- a bucket left alone long enough to be full again is forgotten
+redis.call('pexpire', key, math.ceil(burst / rate * 1000) + 1000)
+
+local wait = 0
+if granted == 0 then
+    wait = (requested - tokens) / rate
+end
+
+return {granted, tostring(wait)}